@@ -1,394 +1,744 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import torch
-import torchvision.transforms as transforms
-import cv2
-from PIL import Image
-import os
 from pathlib import Path
 import uuid
-import sys
-from app.ml.efficientnet_model import EfficientNetClassifier
+import asyncio
+from app.ml.serving import build_serving_model, warmup, ModelLoader
+from app.ml.inference_engine import InferenceEngine
+from app.ml.executor import InferenceExecutor, PoolSaturatedError
+from app.ml.image_io import save_bytes, expand_archive, ArchiveMemberTooLargeError
+from app.ml.tta import MAX_TTA_VIEWS
+from app.ml.quality import decode_with_qc, DEFAULT_THRESHOLDS
+from app.ml.calibration import apply_temperature, top_k_classes
+from app.ml.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, StageTimer
+from app.ml.gradcam import explainable_model, grad_cam, decode_for_explain, encode_heatmap, render_heatmap_png
+from app.ml.similarity_index import SimilarityIndex, open_index
+from app.ml.prediction_cache import PredictionCache, content_hash
+from app.ml.uploads import read_upload, stream_upload_to, UploadTooLargeError, UnsupportedImageError
+from app.ml.history_store import create_history_store, encode_cursor, decode_cursor, normalize_timestamp
+from app.ml.config import (
+    INFER_MAX_BATCH_SIZE, INFER_MAX_WAIT_MS,
+    INFER_EXECUTOR, INFER_WORKERS, INFER_MAX_PENDING, INFER_RETRY_AFTER_S,
+    PERSIST_PREDICT_UPLOADS,
+    PRED_CACHE_MAX_ENTRIES, PRED_CACHE_TTL_S, PRED_CACHE_PATH,
+    MODEL_BACKGROUND_LOAD, MODEL_WARMUP_ITERS,
+    BATCH_MAX_ITEMS, BATCH_CONCURRENCY,
+    HISTORY_BACKEND, HISTORY_DB_PATH, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE,
+    UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, BATCH_MAX_BYTES,
+    EXPLAIN_CACHE_MAX_ENTRIES,
+    SIMILARITY_INDEX_PATH, SIMILARITY_INDEX_DTYPE, SIMILARITY_PQ_SUBSPACES, SIMILARITY_SNAPSHOT_EVERY,
+    QC_MODE, PREDICT_TOP_K, METRICS_SERVER_TIMING,
+)
 
 from typing import List, Dict, Optional
 import json
+import atexit
+import threading
+import time
 from datetime import datetime
 
 router = APIRouter()
 
-# In-memory storage for prediction history
-prediction_history: List[Dict] = []
+# Lịch sử dự đoán: SQLite (WAL) dùng chung giữa các worker, ghi gom lô ở nền
+history_store = create_history_store(HISTORY_BACKEND, HISTORY_DB_PATH)
+
+# Ngưỡng kiểm tra chất lượng ảnh; None: tắt QC
+qc_thresholds = None if QC_MODE == "off" else DEFAULT_THRESHOLDS
 
 # Device configuration
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Load model function (copied from test.py)
-def load_model_cls(model_path: str, device):
-    ckpt = torch.load(model_path, map_location=device, weights_only=False)
-    idx_to_class = ckpt["idx_to_class"]
-
-    model = EfficientNetClassifier(
-        num_classes=len(idx_to_class),
-        embedding_dim=256,
-        pretrained=True,
-        apply_softmax=True
-    ).to(device)
-
-    model.load_state_dict(ckpt["model_state_dict"])
-    model.transform = transforms.Compose([
-            transforms.Resize((300, 300)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.7539897561073303, 0.5854063034057617, 0.5899980068206787],
-                                 std=[0.12629127502441406, 0.14309869706630707, 0.15721528232097626]),
-    ])
-    model.eval()
-    
-    return model, idx_to_class
-
-def predict_class(model, idx_to_class, image):
+# Pool cho phần đọc ảnh + transform; giới hạn số request đang xử lý
+executor = InferenceExecutor(
+    kind=INFER_EXECUTOR,
+    max_workers=INFER_WORKERS,
+    max_pending=INFER_MAX_PENDING,
+    retry_after=INFER_RETRY_AFTER_S,
+)
+
+# Model, engine và cache được dựng trong init_model (mặc định chạy nền khi khởi động)
+model = None
+idx_to_class: Dict[int, str] = {}
+preprocessor = None
+engine: Optional[InferenceEngine] = None
+prediction_cache: Optional[PredictionCache] = None
+explain_model = None
+heatmap_cache: Optional[PredictionCache] = None
+similarity_index: Optional[SimilarityIndex] = None
+temperature = 1.0
+
+_snapshot_lock = threading.Lock()
+
+def _snapshot_index():
+    """
+    Ghi snapshot chỉ mục embedding (bỏ qua nếu đang có 1 lần ghi khác trong worker này).
+    Các worker ghi lần lượt dưới khoá file và gộp ca của nhau (xem SimilarityIndex.save).
+    """
+    if similarity_index is None or not SIMILARITY_INDEX_PATH or not _snapshot_lock.acquire(blocking=False):
+        return
     try:
-        image_rgb = Image.fromarray(image).convert("RGB")
-        with torch.no_grad():
-            probs = model.predict_proba(image_rgb, device)
-        pred_idx = torch.argmax(probs).item()
-        pred_class = idx_to_class[pred_idx]
-        return pred_class
+        if similarity_index.added_since_snapshot:
+            similarity_index.save(SIMILARITY_INDEX_PATH)
     except Exception as e:
-        raise e
+        print(f"Failed to snapshot similarity index: {e}")
+    finally:
+        _snapshot_lock.release()
+
+def _index_case(digest: str, embedding, result: Dict, case: Optional[Dict]):
+    """Thêm ca vừa phân loại vào chỉ mục embedding; snapshot ở nền sau mỗi SIMILARITY_SNAPSHOT_EVERY ca"""
+    if similarity_index is None or embedding is None or case is None:
+        return
+    similarity_index.add(digest, embedding.numpy(), {**case, "prediction": result["prediction"]})
+    if SIMILARITY_INDEX_PATH and similarity_index.added_since_snapshot >= SIMILARITY_SNAPSHOT_EVERY:
+        asyncio.get_running_loop().run_in_executor(None, _snapshot_index)
+
+def init_model():
+    """Nạp model, warm-up, rồi khởi động engine và cache"""
+    global device, model, idx_to_class, preprocessor, engine, prediction_cache, explain_model, heatmap_cache, similarity_index, temperature
+
+    serving = build_serving_model(device)
+    warmup(serving, MODEL_WARMUP_ITERS)
+
+    # Cache kết quả theo hash nội dung ảnh + fingerprint checkpoint
+    prediction_cache = PredictionCache(
+        model_fingerprint=serving.fingerprint,
+        max_entries=PRED_CACHE_MAX_ENTRIES,
+        ttl_s=PRED_CACHE_TTL_S,
+        persist_path=PRED_CACHE_PATH or None,
+    )
+    # Heatmap Grad-CAM (chỉ có với model eager fp32)
+    heatmap_cache = PredictionCache(
+        model_fingerprint=serving.fingerprint,
+        max_entries=EXPLAIN_CACHE_MAX_ENTRIES,
+        ttl_s=PRED_CACHE_TTL_S,
+    )
+    explain_model = explainable_model(serving.model)
+
+    # Engine gom các request /predict thành batch để chạy 1 lần forward
+    new_engine = InferenceEngine(serving.model, serving.device, max_batch_size=INFER_MAX_BATCH_SIZE, max_wait_ms=INFER_MAX_WAIT_MS)
+    new_engine.start()
+
+    # Chỉ mục embedding các ca đã phân loại (chỉ với model eager, cần forward_with_embedding)
+    if new_engine.supports_embedding:
+        similarity_index = open_index(
+            SIMILARITY_INDEX_PATH,
+            dim=getattr(serving.model, "model", serving.model).classifier.in_features,
+            fingerprint=serving.fingerprint,
+            dtype=SIMILARITY_INDEX_DTYPE,
+            pq_subspaces=SIMILARITY_PQ_SUBSPACES,
+        )
+        if SIMILARITY_INDEX_PATH:
+            atexit.register(_snapshot_index)
+
+    device, model, idx_to_class, preprocessor = serving.device, serving.model, serving.idx_to_class, serving.preprocessor
+    temperature = serving.temperature
+    engine = new_engine
 
 # Load model once at startup
-# Thử nhiều đường dẫn khác nhau để tìm model
-raw_paths = [
-    Path(__file__).parent / ".." / ".." / ".." / "ml" / "model" / "best_model.pth",  # Đường dẫn tương đối: endpoints → api → v1 → app → ml → model
-    Path("backend/app/ml/model/best_model.pth"),  # Đường dẫn từ thư mục gốc
-    Path(os.getcwd()) / "backend" / "app" / "ml" / "model" / "best_model.pth",  # Đường dẫn tuyệt đối từ thư mục hiện tại
-]
-
-# Giải quyết các đường dẫn để loại bỏ .. và .
-model_paths = [str(path.resolve()) for path in raw_paths]
-
-MODEL_PATH = None
-for path in model_paths:
-    if os.path.exists(path):
-        MODEL_PATH = path
-        break
-
-if MODEL_PATH is None:
-    raise FileNotFoundError(f"Model file not found at any of the expected paths: {model_paths}")
-
-model, idx_to_class = load_model_cls(MODEL_PATH, device)
+model_loader = ModelLoader(init_model)
+if MODEL_BACKGROUND_LOAD:
+    model_loader.start()
+else:
+    model_loader.load()
+
+def _require_model():
+    """Trả 503 khi model chưa sẵn sàng (đang nạp hoặc nạp lỗi)"""
+    if not model_loader.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model is not ready ({model_loader.status()['status']})",
+            headers={"Retry-After": str(INFER_RETRY_AFTER_S)},
+        )
+
+def _check_quality(x, qc: Optional[Dict]):
+    """Ảnh không giải mã được: 400; bị QC loại: 422 kèm điểm QC"""
+    if x is not None:
+        return
+    if qc is None:
+        raise HTTPException(status_code=400, detail="Could not read image file")
+    raise HTTPException(
+        status_code=422,
+        detail={"message": "Image failed quality control: " + "; ".join(qc["errors"]), "qc": qc},
+    )
+
+def _build_result(probs: torch.Tensor, qc: Optional[Dict]) -> Dict:
+    """Kết quả lưu cache: xác suất đã hiệu chỉnh nhiệt độ, độ tin cậy và top-k từ cùng 1 lần forward"""
+    probabilities = probs.tolist()
+    ranked = top_k_classes(probabilities, idx_to_class, PREDICT_TOP_K)
+    return {
+        "prediction": ranked[0]["class"],
+        "probabilities": probabilities,
+        "confidence": ranked[0]["probability"],
+        "top_k": ranked,
+        "temperature": temperature,
+        "qc": qc,
+    }
+
+def _top_k(result: Dict, k: int) -> List[Dict]:
+    """top-k của kết quả (kể cả từ cache); k lớn hơn số lớp đã lưu thì xếp hạng lại từ probabilities"""
+    ranked = result.get("top_k") or []
+    if k <= len(ranked):
+        return ranked[:k]
+    return top_k_classes(result["probabilities"], idx_to_class, k)
+
+async def _decode_timed(timer: StageTimer, fn, *args):
+    """
+    Chạy hàm giải mã trong executor. Các bước decode / qc / preprocess do hàm tự đo (kể cả
+    trong process pool); phần còn lại của thời gian khứ hồi (chờ pool, chuyển dữ liệu) là executor_wait.
+    """
+    t0 = time.perf_counter()
+    out = await executor.run(fn, *args)
+    elapsed = time.perf_counter() - t0
+    timings = out[-1] if out is not None else {}
+    for name, seconds in timings.items():
+        timer.add(name, seconds)
+    timer.add("executor_wait", max(0.0, elapsed - sum(timings.values())))
+    return out
+
+async def classify_bytes(
+    content: bytes,
+    digest: Optional[str] = None,
+    tta: int = 1,
+    case: Optional[Dict] = None,
+    timer: Optional[StageTimer] = None,
+):
+    """
+    Dự đoán cho nội dung 1 file ảnh. Cache hit trả về ngay, không đụng tới torch;
+    cache miss thì giải mã + transform trong executor và forward qua InferenceEngine.
+    digest: hash nội dung đã tính trong lúc đọc upload (bỏ qua bước hash lại).
+    tta: số view test-time augmentation; các view chạy chung 1 lần forward,
+    xác suất được lấy trung bình.
+    Xác suất trả về đã hiệu chỉnh nhiệt độ (temperature của checkpoint), kèm top-k.
+    case: thông tin ca (id bản ghi, tên file) để thêm embedding vào chỉ mục ca tương tự;
+    embedding lấy từ cùng lần forward với phân loại.
+    Ảnh được kiểm tra chất lượng ngay sau khi giải mã; ảnh bị loại trả 422 mà không chạy mạng.
+    timer: ghi thời gian từng bước (cache, decode, qc, preprocess, inference, index).
+    Trả về (kết quả, cached).
+    """
+    _require_model()
+    timer = timer or StageTimer("classify")
+    with timer.stage("cache"):
+        digest = digest or content_hash(content)
+        key = prediction_cache.make_key(content, digest, variant=f"tta{tta}" if tta > 1 else "")
+        result = await prediction_cache.aget(key)
+    if result is not None:
+        return result, True
+
+    with executor.admit():
+        x, qc, _ = await _decode_timed(timer, decode_with_qc, content, preprocessor, qc_thresholds, tta)
+        _check_quality(x, qc)
+        with_embedding = similarity_index is not None and case is not None
+        # Gồm thời gian chờ trong hàng đợi của InferenceEngine và forward
+        with timer.stage("inference"):
+            if tta > 1:
+                out = await asyncio.wrap_future(engine.submit_views(x, with_embedding))
+                probs, emb = out if with_embedding else (out, None)
+                # Hiệu chỉnh từng view rồi mới lấy trung bình; embedding của view gốc (view đầu tiên)
+                probs, emb = apply_temperature(probs, temperature).mean(dim=0), (emb[0] if emb is not None else None)
+            else:
+                out = await asyncio.wrap_future(engine.submit(x, with_embedding))
+                probs, emb = out if with_embedding else (out, None)
+                probs = apply_temperature(probs, temperature)
+
+    result = _build_result(probs, qc)
+    prediction_cache.put(key, result)
+    with timer.stage("index"):
+        _index_case(digest, emb, result, case)
+    return result, False
+
+async def explain_bytes(
+    content: bytes,
+    digest: Optional[str] = None,
+    case: Optional[Dict] = None,
+    timer: Optional[StageTimer] = None,
+):
+    """
+    Dự đoán kèm heatmap Grad-CAM. Xác suất và gradient lấy từ cùng 1 lần forward
+    (không qua InferenceEngine vì cần autograd); heatmap được cache theo hash ảnh.
+    Trả về (kết quả, cached, heatmap).
+    """
+    _require_model()
+    timer = timer or StageTimer("explain")
+    if explain_model is None:
+        raise HTTPException(status_code=501, detail="Explanations are not available for this serving mode")
+    with timer.stage("cache"):
+        digest = digest or content_hash(content)
+        key = prediction_cache.make_key(content, digest)
+        heatmap_key = heatmap_cache.make_key(content, digest)
+        heatmap = await heatmap_cache.aget(heatmap_key)
+        result = await prediction_cache.aget(key) if heatmap is not None else None
+    if result is not None:
+        return result, True, heatmap
+
+    with executor.admit():
+        decoded = await _decode_timed(timer, decode_for_explain, content, preprocessor, qc_thresholds)
+        if decoded is None:
+            raise HTTPException(status_code=400, detail="Could not read image file")
+        x, qc, image_size, _ = decoded
+        _check_quality(x, qc)
+        with timer.stage("gradcam"):
+            probs, cam, target, emb = await asyncio.to_thread(grad_cam, explain_model, x)
+
+    result = _build_result(apply_temperature(probs, temperature), qc)
+    heatmap = encode_heatmap(cam, target, idx_to_class[target], image_size)
+    prediction_cache.put(key, result)
+    heatmap_cache.put(heatmap_key, heatmap)
+    with timer.stage("index"):
+        _index_case(digest, emb, result, case)
+    return result, False, heatmap
+
+def _upload_exception(e: ValueError) -> HTTPException:
+    status_code = 413 if isinstance(e, UploadTooLargeError) else 400
+    return HTTPException(status_code=status_code, detail=str(e))
+
+def _outcome(e: HTTPException) -> str:
+    """Nhãn outcome của metric predictions cho 1 lỗi HTTP"""
+    if e.status_code == 422:
+        return "rejected"
+    if e.status_code == 503:
+        return "busy"
+    return "invalid" if e.status_code < 500 else "error"
+
+def _busy_exception(e: PoolSaturatedError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry later",
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 @router.post("/upload")
 async def upload_image(file: UploadFile = File(...)):
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Create uploads directory if not exists
+        # Thư mục uploads được tạo khi ghi file
         uploads_dir = Path("uploads")
-        uploads_dir.mkdir(parents=True, exist_ok=True)
         
         # Generate unique filename
-        file_extension = Path(file.filename).suffix
+        file_extension = Path(file.filename or "").suffix
         unique_filename = f"{uuid.uuid4()}{file_extension}"
         file_path = uploads_dir / unique_filename
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Ghi thẳng ra đĩa theo chunk; kiểm tra định dạng theo magic bytes và giới hạn kích thước
+        await stream_upload_to(file, file_path, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE)
         
         return {
             "filename": unique_filename,
             "path": str(file_path),
             "message": "Image uploaded successfully"
         }
+    except (UploadTooLargeError, UnsupportedImageError) as e:
+        raise _upload_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @router.post("/predict")
-async def predict_image(file: UploadFile = File(...)):
+async def predict_image(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    tta: int = Query(1, ge=1, le=MAX_TTA_VIEWS, description="số view test-time augmentation (1: tắt)"),
+    explain: bool = Query(False, description="trả kèm heatmap Grad-CAM"),
+    top_k: int = Query(PREDICT_TOP_K, ge=1, le=100, description="số lớp xác suất cao nhất trả kèm"),
+):
+    timer = StageTimer("predict")
+    outcome = "error"
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Create uploads directory if not exists
-        uploads_dir = Path("uploads")
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        
+        if explain and tta > 1:
+            raise HTTPException(status_code=400, detail="explain cannot be combined with tta")
+
         # Generate unique filename
-        file_extension = Path(file.filename).suffix
+        file_extension = Path(file.filename or "").suffix
         unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = uploads_dir / unique_filename
-        
-        # Save file temporarily
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Load and predict
-        img = cv2.imread(str(file_path))
-        if img is None:
-            raise HTTPException(status_code=400, detail="Could not read image file")
         
-        result_class = predict_class(model, idx_to_class, img)
-        
-        # Clean up - remove the temporary file after prediction
-        os.remove(file_path)
+        # Đọc theo chunk (kiểm tra magic bytes, giới hạn kích thước, hash dần) rồi giải mã trong bộ nhớ
+        with timer.stage("upload"):
+            upload = await read_upload(file, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE)
+        record_id = str(uuid.uuid4())
+        case = {"id": record_id, "filename": unique_filename, "originalFilename": file.filename}
+        heatmap = None
+        if explain:
+            result, cached, heatmap = await explain_bytes(upload.data, upload.digest, case, timer)
+        else:
+            result, cached = await classify_bytes(upload.data, upload.digest, tta, case, timer)
+        
+        # Lưu file upload (tuỳ chọn) sau khi đã trả response
+        if PERSIST_PREDICT_UPLOADS:
+            background_tasks.add_task(save_bytes, Path("uploads") / unique_filename, upload.data)
         
         # Create prediction record
         prediction_record = {
-            "id": str(uuid.uuid4()),
+            "id": record_id,
             "filename": unique_filename,
             "originalFilename": file.filename,  # Lưu tên file gốc
-            "prediction": result_class,
+            "prediction": result["prediction"],
+            "confidence": result.get("confidence"),
+            "top_k": _top_k(result, top_k),
+            "temperature": result.get("temperature"),
+            "cached": cached,
+            "tta": tta,
+            "content_hash": upload.digest,
+            "qc": result.get("qc"),
             "created_at": datetime.now().isoformat(),
             "message": "Prediction completed successfully"
         }
         
         # Add to prediction history
-        prediction_history.append(prediction_record)
-        
+        with timer.stage("history"):
+            history_store.append(prediction_record)
+        outcome = "cached" if cached else "ok"
+        if METRICS_SERVER_TIMING:
+            response.headers["Server-Timing"] = timer.server_timing()
+        
+        if heatmap is not None:
+            return {
+                **prediction_record,
+                "heatmap": heatmap,
+                "heatmap_url": request.url_for("get_explanation", record_id=prediction_record["id"]).path,
+            }
         return prediction_record
+    except (UploadTooLargeError, UnsupportedImageError) as e:
+        outcome = "invalid"
+        raise _upload_exception(e)
+    except PoolSaturatedError as e:
+        outcome = "busy"
+        raise _busy_exception(e)
+    except HTTPException as e:
+        outcome = _outcome(e)
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        timer.finish(outcome)
+
+@router.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    top_k: int = Query(PREDICT_TOP_K, ge=1, le=100, description="số lớp xác suất cao nhất trả kèm"),
+):
+    """
+    Dự đoán nhiều ảnh trong 1 request: nhiều file multipart, hoặc 1 file zip/tar chứa ảnh.
+    Các ảnh được giải mã song song và forward theo batch qua InferenceEngine; kết quả
+    trả về dạng NDJSON (mỗi dòng 1 ảnh) ngay khi từng ảnh xong, không theo thứ tự gửi.
+    """
+    _require_model()
+    items = []
+    for file in files:
+        # Không bắt buộc là ảnh: có thể là file zip/tar; ảnh hỏng sẽ báo lỗi ở từng dòng kết quả
+        try:
+            content = (await read_upload(file, BATCH_MAX_BYTES, UPLOAD_CHUNK_SIZE, require_image=False)).data
+        except UploadTooLargeError as e:
+            raise _upload_exception(e)
+        try:
+            archive_items = await asyncio.to_thread(
+                expand_archive, content, BATCH_MAX_ITEMS, UPLOAD_MAX_BYTES, BATCH_MAX_BYTES, UPLOAD_CHUNK_SIZE
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        if archive_items is None:
+            items.append((file.filename, content))
+        else:
+            items.extend(archive_items)
+        if len(items) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} images per batch")
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in request")
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def classify_item(index: int, name: str, content: bytes):
+        record_id = str(uuid.uuid4())
+        timer = StageTimer("predict_batch")
+        if isinstance(content, ArchiveMemberTooLargeError):
+            # Ảnh trong zip/tar vượt giới hạn: không được giải nén, báo lỗi riêng cho ảnh đó
+            timer.finish("invalid")
+            return {"index": index, "originalFilename": name, "status_code": 413, "error": str(content)}
+        with timer.stage("cache"):
+            digest = content_hash(content)
+        async with semaphore:
+            # Thời gian chờ tới lượt trong request (BATCH_CONCURRENCY) nằm trong "total"
+            try:
+                result, cached = await classify_bytes(content, digest, case={"id": record_id, "filename": name, "originalFilename": name}, timer=timer)
+            except PoolSaturatedError as e:
+                timer.finish("busy")
+                return {"index": index, "originalFilename": name, "status_code": 503, "error": str(e)}
+            except HTTPException as e:
+                timer.finish(_outcome(e))
+                return {"index": index, "originalFilename": name, "status_code": e.status_code, "error": e.detail}
+            except Exception as e:
+                timer.finish("error")
+                return {"index": index, "originalFilename": name, "status_code": 500, "error": f"Prediction failed: {str(e)}"}
 
-@router.get("/predictions/history")
-async def get_prediction_history():
-    """Lấy lịch sử các dự đoán đã thực hiện"""
-    try:
-        # Sắp xếp theo thời gian tạo, mới nhất trước
-        sorted_history = sorted(prediction_history, key=lambda x: x.get('created_at', ''), reverse=True)
-        return {"predictions": sorted_history}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to retrieve prediction history: {str(e)}")
-
-@router.post("/predict-from-upload/{filename}")
-async def predict_from_uploaded_image(filename: str):
-    try:
-        file_path = Path(f"uploads/{filename}")
-        
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        img = cv2.imread(str(file_path))
-        if img is None:
-            raise HTTPException(status_code=400, detail="Could not read image file")
-        
-        result_class = predict_class(model, idx_to_class, img)
-        
-        # Create prediction record
         prediction_record = {
-            "id": str(uuid.uuid4()),
-            "filename": filename,
-            "originalFilename": filename,  # Trong trường hợp này, tên file chính là tên file được upload
-            "prediction": result_class,
+            "id": record_id,
+            "filename": name,
+            "originalFilename": name,
+            "prediction": result["prediction"],
+            "confidence": result.get("confidence"),
+            "top_k": _top_k(result, top_k),
+            "temperature": result.get("temperature"),
+            "cached": cached,
+            "content_hash": digest,
+            "qc": result.get("qc"),
             "created_at": datetime.now().isoformat(),
             "message": "Prediction completed successfully"
         }
-        
-        # Add to prediction history
-        prediction_history.append(prediction_record)
-        
-        return prediction_record
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-import torch
-import torchvision.transforms as transforms
-import cv2
-from PIL import Image
-import os
-from pathlib import Path
-import uuid
-import sys
-from app.ml.efficientnet_model import EfficientNetClassifier
-
-from typing import List, Dict, Optional
-import json
-from datetime import datetime
-
-router = APIRouter()
-
-# In-memory storage for prediction history
-prediction_history: List[Dict] = []
-
-# Device configuration
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# Load model function (copied from test.py)
-def load_model_cls(model_path: str, device):
-    ckpt = torch.load(model_path, map_location=device, weights_only=False)
-    idx_to_class = ckpt["idx_to_class"]
-
-    model = EfficientNetClassifier(
-        num_classes=len(idx_to_class),
-        embedding_dim=256,
-        pretrained=True,
-        apply_softmax=True
-    ).to(device)
-
-    model.load_state_dict(ckpt["model_state_dict"])
-    model.transform = transforms.Compose([
-            transforms.Resize((300, 300)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.7539897561073303, 0.5854063034057617, 0.5899980068206787],
-                                 std=[0.12629127502441406, 0.14309869706630707, 0.15721528232097626]),
-    ])
-    model.eval()
-    
-    return model, idx_to_class
-
-def predict_class(model, idx_to_class, image):
-    try:
-        image_rgb = Image.fromarray(image).convert("RGB")
-        with torch.no_grad():
-            probs = model.predict_proba(image_rgb, device)
-        pred_idx = torch.argmax(probs).item()
-        pred_class = idx_to_class[pred_idx]
-        return pred_class
-    except Exception as e:
-        raise e
-
-# Load model once at startup
-# Thử nhiều đường dẫn khác nhau để tìm model
-raw_paths = [
-    Path(__file__).parent / ".." / ".." / ".." / "ml" / "model" / "best_model.pth",  # Đường dẫn tương đối: endpoints → api → v1 → app → ml → model
-    Path("backend/app/ml/model/best_model.pth"),  # Đường dẫn từ thư mục gốc
-    Path(os.getcwd()) / "backend" / "app" / "ml" / "model" / "best_model.pth",  # Đường dẫn tuyệt đối từ thư mục hiện tại
-]
-
-# Giải quyết các đường dẫn để loại bỏ .. và .
-model_paths = [str(path.resolve()) for path in raw_paths]
-
-MODEL_PATH = None
-for path in model_paths:
-    if os.path.exists(path):
-        MODEL_PATH = path
-        break
-
-if MODEL_PATH is None:
-    raise FileNotFoundError(f"Model file not found at any of the expected paths: {model_paths}")
-
-model, idx_to_class = load_model_cls(MODEL_PATH, device)
-
-@router.post("/upload")
-async def upload_image(file: UploadFile = File(...)):
-    try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Create uploads directory if not exists
-        uploads_dir = Path("uploads")
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = uploads_dir / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
+        with timer.stage("history"):
+            history_store.append(prediction_record)
+        timer.finish("cached" if cached else "ok")
         return {
-            "filename": unique_filename,
-            "path": str(file_path),
-            "message": "Image uploaded successfully"
+            "index": index,
+            **prediction_record,
+            "probabilities": {idx_to_class[i]: p for i, p in enumerate(result["probabilities"])},
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@router.post("/predict")
-async def predict_image(file: UploadFile = File(...)):
+    async def stream():
+        tasks = [asyncio.create_task(classify_item(i, name, content)) for i, (name, content) in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+        finally:
+            # Client ngắt kết nối giữa chừng: huỷ các ảnh chưa xử lý
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _parse_time(value: Optional[str], name: str) -> Optional[str]:
+    """Chuẩn hoá mốc thời gian ISO về cùng định dạng với created_at (giờ địa phương, không múi giờ)"""
+    if value is None:
+        return None
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Create uploads directory if not exists
-        uploads_dir = Path("uploads")
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = uploads_dir / unique_filename
-        
-        # Save file temporarily
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Load and predict
-        img = cv2.imread(str(file_path))
-        if img is None:
-            raise HTTPException(status_code=400, detail="Could not read image file")
-        
-        result_class = predict_class(model, idx_to_class, img)
-        
-        # Clean up - remove the temporary file after prediction
-        os.remove(file_path)
-        
-        # Create prediction record
-        prediction_record = {
-            "id": str(uuid.uuid4()),
-            "filename": unique_filename,
-            "originalFilename": file.filename,  # Lưu tên file gốc
-            "prediction": result_class,
-            "created_at": datetime.now().isoformat(),
-            "message": "Prediction completed successfully"
-        }
-        
-        # Add to prediction history
-        prediction_history.append(prediction_record)
-        
-        return prediction_record
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        return normalize_timestamp(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: expected an ISO 8601 timestamp")
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 @router.get("/predictions/history")
-async def get_prediction_history():
-    """Lấy lịch sử các dự đoán đã thực hiện"""
+async def get_prediction_history(
+    request: Request,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    prediction: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """
+    Lấy lịch sử các dự đoán, mới nhất trước, theo từng trang (keyset trên created_at/id).
+    Trang tiếp theo: truyền lại `next_cursor`. Lọc theo lớp (`prediction`) và khoảng
+    thời gian [since, until). Hỗ trợ ETag / If-None-Match: trang không đổi trả 304.
+    """
     try:
-        # Sắp xếp theo thời gian tạo, mới nhất trước
-        sorted_history = sorted(prediction_history, key=lambda x: x.get('created_at', ''), reverse=True)
-        return {"predictions": sorted_history}
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    since, until = _parse_time(since, "since"), _parse_time(until, "until")
+
+    try:
+        # Lấy thêm 1 bản ghi để biết còn trang sau hay không
+        records = await asyncio.to_thread(history_store.query, limit + 1, position, prediction, since, until)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve prediction history: {str(e)}")
 
+    page = records[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(records) > limit else None
+
+    # Bản ghi chỉ được thêm, không sửa, nên danh sách id + cursor xác định nội dung trang
+    signature = "|".join([request.url.query, next_cursor or "", *(r["id"] for r in page)])
+    etag = f'"{content_hash(signature.encode())}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content={"predictions": page, "next_cursor": next_cursor}, headers=headers)
+
+@router.get("/ready")
+async def readiness():
+    """Readiness: 200 khi model đã nạp + warm-up xong, 503 khi đang nạp hoặc lỗi"""
+    status = model_loader.status()
+    if not model_loader.ready:
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": str(INFER_RETRY_AFTER_S)})
+    return status
+
+@router.get("/inference/stats")
+async def get_inference_stats():
+    """Độ sâu hàng đợi và histogram kích thước batch của InferenceEngine"""
+    _require_model()
+    return {
+        "engine": engine.stats(),
+        "executor": executor.stats(),
+        "cache": prediction_cache.stats(),
+        "similarity_index": similarity_index.stats() if similarity_index is not None else None,
+    }
+
+def _collect_metrics():
+    """Số liệu tính lúc scrape từ stats() của engine / executor / cache / chỉ mục"""
+    yield "model_ready", "gauge", "1 nếu model đã nạp xong và sẵn sàng", [({}, float(model_loader.ready))]
+    if not model_loader.ready:
+        return
+    e, x, c = engine.stats(), executor.stats(), prediction_cache.stats()
+    yield "engine_queue_depth", "gauge", "Số request đang chờ trong hàng đợi InferenceEngine", [({}, e["queue_depth"])]
+    yield "engine_requests", "counter", "Số request đã forward qua InferenceEngine", [({}, e["total_requests"])]
+    yield "engine_batches", "counter", "Số batch đã forward", [({}, e["total_batches"])]
+    yield "executor_pending", "gauge", "Số request đang chiếm chỗ trong executor", [({}, x["pending"])]
+    yield "executor_rejected", "counter", "Số request bị từ chối vì executor quá tải (503)", [({}, x["total_rejected"])]
+    yield "cache_entries", "gauge", "Số kết quả trong cache dự đoán", [({}, c["entries"])]
+    yield "cache_lookups", "counter", "Số lần tra cache dự đoán theo kết quả", [
+        ({"result": "hit"}, c["hits"]), ({"result": "miss"}, c["misses"]), ({"result": "disk_hit"}, c["disk_hits"]),
+    ]
+    yield "cache_evictions", "counter", "Số kết quả bị đẩy khỏi cache (LRU)", [({}, c["evictions"])]
+    if similarity_index is not None:
+        yield "similarity_index_entries", "gauge", "Số ca trong chỉ mục embedding", [({}, len(similarity_index))]
+
+REGISTRY.register_collector(_collect_metrics)
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Số liệu độ trễ từng bước (upload, decode, qc, preprocess, inference, history, ...),
+    kích thước batch, cache hit... theo định dạng văn bản Prometheus.
+    """
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 @router.post("/predict-from-upload/{filename}")
-async def predict_from_uploaded_image(filename: str):
+async def predict_from_uploaded_image(
+    filename: str,
+    response: Response,
+    top_k: int = Query(PREDICT_TOP_K, ge=1, le=100, description="số lớp xác suất cao nhất trả kèm"),
+):
+    timer = StageTimer("predict_from_upload")
+    outcome = "error"
     try:
         file_path = Path(f"uploads/{filename}")
         
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="File not found")
         
-        img = cv2.imread(str(file_path))
-        if img is None:
-            raise HTTPException(status_code=400, detail="Could not read image file")
-        
-        result_class = predict_class(model, idx_to_class, img)
+        with timer.stage("read"):
+            content = await asyncio.to_thread(file_path.read_bytes)
+        with timer.stage("cache"):
+            digest = content_hash(content)
+        record_id = str(uuid.uuid4())
+        result, cached = await classify_bytes(content, digest, case={"id": record_id, "filename": filename, "originalFilename": filename}, timer=timer)
         
         # Create prediction record
         prediction_record = {
-            "id": str(uuid.uuid4()),
+            "id": record_id,
             "filename": filename,
             "originalFilename": filename,  # Trong trường hợp này, tên file chính là tên file được upload
-            "prediction": result_class,
+            "prediction": result["prediction"],
+            "confidence": result.get("confidence"),
+            "top_k": _top_k(result, top_k),
+            "temperature": result.get("temperature"),
+            "cached": cached,
+            "content_hash": digest,
+            "qc": result.get("qc"),
             "created_at": datetime.now().isoformat(),
             "message": "Prediction completed successfully"
         }
         
         # Add to prediction history
-        prediction_history.append(prediction_record)
+        with timer.stage("history"):
+            history_store.append(prediction_record)
+        outcome = "cached" if cached else "ok"
+        if METRICS_SERVER_TIMING:
+            response.headers["Server-Timing"] = timer.server_timing()
         
         return prediction_record
+    except PoolSaturatedError as e:
+        outcome = "busy"
+        raise _busy_exception(e)
+    except HTTPException as e:
+        outcome = _outcome(e)
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        timer.finish(outcome)
+
+@router.get("/explain/{record_id}", name="get_explanation")
+async def get_explanation(record_id: str, format: str = Query("png", pattern="^(png|json)$")):
+    """
+    Heatmap Grad-CAM của 1 dự đoán trong lịch sử: ảnh PNG màu (format=png, dùng làm
+    heatmapUrl cho HeatmapOverlay) hoặc mảng uint8 base64 ở độ phân giải feature map (format=json).
+    Nếu heatmap chưa có trong cache thì tính lại từ file trong uploads (nếu còn).
+    """
+    _require_model()
+    record = await asyncio.to_thread(history_store.get, record_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+
+    heatmap = None
+    digest = record.get("content_hash")
+    if digest:
+        heatmap = await heatmap_cache.aget(heatmap_cache.make_key(None, digest))
+    if heatmap is None:
+        file_path = Path("uploads") / Path(record.get("filename", "")).name
+        if not file_path.is_file():
+            raise HTTPException(status_code=404, detail="No explanation available for this prediction")
+        try:
+            content = await asyncio.to_thread(file_path.read_bytes)
+            _, _, heatmap = await explain_bytes(content)
+        except PoolSaturatedError as e:
+            raise _busy_exception(e)
+
+    if format == "json":
+        return heatmap
+    png = await asyncio.to_thread(render_heatmap_png, heatmap)
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "private, max-age=86400"})
+
+def _require_index():
+    _require_model()
+    if similarity_index is None:
+        raise HTTPException(status_code=501, detail="Embeddings are not available for this serving mode")
+
+@router.post("/embed")
+async def embed_image(file: UploadFile = File(...), k: int = Query(0, ge=0, le=100, description="số ca tương tự trả kèm")):
+    """
+    Embedding (đầu ra của EfficientNetClassifier.embedding_layer) của 1 ảnh, kèm dự đoán
+    và tuỳ chọn k ca đã phân loại gần nhất (cosine). Ảnh không được thêm vào chỉ mục.
+    """
+    _require_index()
+    try:
+        upload = await read_upload(file, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE)
+        with executor.admit():
+            x, qc, _ = await executor.run(decode_with_qc, upload.data, preprocessor, qc_thresholds)
+            _check_quality(x, qc)
+            probs, emb = await asyncio.wrap_future(engine.submit(x, with_embedding=True))
+    except (UploadTooLargeError, UnsupportedImageError) as e:
+        raise _upload_exception(e)
+    except PoolSaturatedError as e:
+        raise _busy_exception(e)
+
+    response = {
+        "prediction": idx_to_class[torch.argmax(probs).item()],
+        "dim": emb.shape[0],
+        "embedding": emb.tolist(),
+        "qc": qc,
+    }
+    if k:
+        similar = await asyncio.to_thread(similarity_index.search, emb.numpy(), k)
+        response["similar"] = similar[0]
+    return response
+
+@router.get("/similar/{record_id}")
+async def get_similar_cases(record_id: str, k: int = Query(10, ge=1, le=100)):
+    """Các ca đã phân loại gần nhất (cosine trên embedding) với 1 dự đoán trong lịch sử"""
+    _require_index()
+    record = await asyncio.to_thread(history_store.get, record_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    digest = record.get("content_hash")
+    vector = similarity_index.vector(digest) if digest else None
+    if vector is None and digest and SIMILARITY_INDEX_PATH:
+        # Ca có thể do worker khác phân loại: gộp snapshot mới nhất rồi tìm lại
+        await asyncio.to_thread(similarity_index.refresh, SIMILARITY_INDEX_PATH)
+        vector = similarity_index.vector(digest)
+    if vector is None:
+        raise HTTPException(status_code=404, detail="Prediction is not in the similarity index")
+    similar = await asyncio.to_thread(similarity_index.search, vector, k, [digest])
+    return {"id": record_id, "similar": similar[0]}
@@ -0,0 +1,163 @@
+"""
+Hiệu chỉnh độ tin cậy bằng temperature scaling và top-k từ vector xác suất.
+
+Model phục vụ trả về xác suất softmax(z); vì log p = z - logsumexp(z) nên
+softmax(log p / T) = softmax(z / T): nhiệt độ được áp lên chính vector xác suất
+của lần forward duy nhất (chạy được với cả model eager, quantize, TorchScript, ONNX)
+mà không cần logits hay forward lại. T = 1 giữ nguyên xác suất; argmax không đổi.
+
+T được fit offline (tối thiểu NLL) trên thư mục validation dạng ImageFolder
+(thư mục con = tên lớp) và ghi vào checkpoint (khoá "temperature"):
+    python -m app.ml.calibration --val-dir data/val
+    python -m app.ml.calibration --val-dir data/val --checkpoint app/ml/model/best_model.serve.pt --dry-run
+"""
+import argparse
+import json
+import os
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from app.ml.image_io import read_image
+from app.ml.preprocessing import TensorPreprocessor
+from app.ml.quantization import list_images
+
+# Chặn log(0) khi xác suất softmax underflow về 0
+_MIN_PROB = 1e-12
+# Khoảng nhiệt độ chấp nhận (tập validation nhỏ / nhãn sai có thể đẩy T ra vô cùng)
+TEMPERATURE_RANGE = (0.05, 20.0)
+
+
+def apply_temperature(probs: torch.Tensor, temperature: float) -> torch.Tensor:
+    """Xác suất [..., num_classes] → xác suất đã hiệu chỉnh với nhiệt độ T"""
+    if temperature == 1.0:
+        return probs
+    return F.softmax(probs.float().clamp_min(_MIN_PROB).log() / temperature, dim=-1)
+
+
+def top_k_classes(probabilities: List[float], idx_to_class: Dict[int, str], k: int) -> List[Dict]:
+    """k lớp có xác suất cao nhất, giảm dần"""
+    order = sorted(range(len(probabilities)), key=probabilities.__getitem__, reverse=True)
+    return [{"class": idx_to_class[i], "probability": probabilities[i]} for i in order[:k]]
+
+
+# ---------------------------------------------------------------------- #
+# Fit nhiệt độ
+# ---------------------------------------------------------------------- #
+@torch.no_grad()  # không dùng inference_mode: kết quả còn đi vào autograd khi fit T
+def collect_log_probs(
+    model,
+    val_dir: str,
+    preprocessor: TensorPreprocessor,
+    idx_to_class: Dict[int, str],
+    batch_size: int = 16,
+    limit: Optional[int] = None,
+):
+    """log xác suất [N, num_classes] và nhãn [N] của các ảnh có nhãn trong val_dir"""
+    class_to_idx = {v: k for k, v in idx_to_class.items()}
+    paths = [p for p in list_images(val_dir, limit) if p.parent.name in class_to_idx]
+    if not paths:
+        raise ValueError(f"No labeled validation images found in {val_dir} (expected one sub-folder per class)")
+
+    log_probs, labels = [], []
+    for i in range(0, len(paths), batch_size):
+        images, chunk_labels = [], []
+        for p in paths[i:i + batch_size]:
+            img = read_image(str(p))
+            if img is None:
+                continue
+            images.append(img)
+            chunk_labels.append(class_to_idx[p.parent.name])
+        if not images:
+            continue
+        out = model(preprocessor.batch(images)).float()
+        out = out.clamp_min(_MIN_PROB).log() if getattr(model, "apply_softmax", False) else F.log_softmax(out, dim=1)
+        log_probs.append(out)
+        labels.extend(chunk_labels)
+    return torch.cat(log_probs), torch.tensor(labels)
+
+
+def fit_temperature(log_probs: torch.Tensor, labels: torch.Tensor, max_iter: int = 100) -> float:
+    """T tối thiểu NLL của softmax(log_probs / T) (tối ưu log T bằng LBFGS để T luôn dương)"""
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=max_iter, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(log_probs / log_t.exp(), labels)
+        loss.backward()
+        return loss
+
+    with torch.enable_grad():
+        optimizer.step(closure)
+    low, high = TEMPERATURE_RANGE
+    return min(max(float(log_t.detach().exp()), low), high)
+
+
+def calibration_metrics(log_probs: torch.Tensor, labels: torch.Tensor, temperature: float = 1.0, bins: int = 15) -> Dict:
+    """NLL, expected calibration error (ECE, chia bin đều theo độ tin cậy) và accuracy"""
+    scaled = log_probs / temperature
+    probs = scaled.softmax(dim=1)
+    confidence, pred = probs.max(dim=1)
+    correct = (pred == labels).float()
+    bin_idx = (confidence * bins).long().clamp_(max=bins - 1)
+    conf_sum = torch.bincount(bin_idx, weights=confidence, minlength=bins)
+    acc_sum = torch.bincount(bin_idx, weights=correct, minlength=bins)
+    ece = (conf_sum - acc_sum).abs().sum() / len(labels)
+    return {
+        "nll": float(F.cross_entropy(scaled, labels)),
+        "ece": float(ece),
+        "accuracy": float(correct.mean()),
+        "mean_confidence": float(confidence.mean()),
+    }
+
+
+def write_temperature(checkpoint: str, temperature: float):
+    """Ghi nhiệt độ vào checkpoint (.pth hoặc .serve.pt), thay file một cách nguyên tử"""
+    from app.ml.serving_checkpoint import SERVING_SUFFIX
+
+    ckpt = torch.load(checkpoint, map_location="cpu", weights_only=checkpoint.endswith(SERVING_SUFFIX))
+    ckpt["temperature"] = float(temperature)
+    tmp = checkpoint + ".tmp"
+    torch.save(ckpt, tmp)
+    os.replace(tmp, checkpoint)
+
+
+def main():
+    from app.ml.loader import load_model_cls, find_model_path
+
+    parser = argparse.ArgumentParser(description="Fit temperature scaling on a validation folder and store it in the checkpoint")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--val-dir", required=True)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--dry-run", action="store_true", help="chỉ in báo cáo, không ghi checkpoint")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or find_model_path()
+    if checkpoint is None:
+        raise FileNotFoundError("No checkpoint found; pass --checkpoint")
+    model, idx_to_class = load_model_cls(checkpoint, torch.device("cpu"))
+    preprocessor = TensorPreprocessor.from_compose(model.transform)
+
+    log_probs, labels = collect_log_probs(model, args.val_dir, preprocessor, idx_to_class, args.batch_size, args.limit)
+    # log_probs là đầu ra chưa hiệu chỉnh (T = 1), không phụ thuộc nhiệt độ đang lưu
+    previous = getattr(model, "temperature", 1.0)
+    temperature = fit_temperature(log_probs, labels)
+    report = {
+        "checkpoint": checkpoint,
+        "images": len(labels),
+        "previous_temperature": previous,
+        "temperature": temperature,
+        "before": calibration_metrics(log_probs, labels, previous),
+        "after": calibration_metrics(log_probs, labels, temperature),
+    }
+    print(json.dumps(report, indent=2))
+    if not args.dry_run:
+        write_temperature(checkpoint, temperature)
+        print(f"Saved temperature={temperature:.4f} to {checkpoint}")
+
+
+if __name__ == "__main__":
+    main()
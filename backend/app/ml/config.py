@@ -0,0 +1,95 @@
+"""Cấu hình phục vụ model (có thể ghi đè bằng biến môi trường)"""
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+# Micro-batching: gom nhiều request thành 1 batch forward
+INFER_MAX_BATCH_SIZE = _env_int("INFER_MAX_BATCH_SIZE", 8)
+INFER_MAX_WAIT_MS    = _env_float("INFER_MAX_WAIT_MS", 5.0)     # thời gian chờ tối đa để gom batch
+
+# Executor cho phần việc nặng CPU (đọc ảnh, transform) để không chặn event loop
+INFER_EXECUTOR       = os.getenv("INFER_EXECUTOR", "thread")    # "thread" hoặc "process"
+INFER_WORKERS        = _env_int("INFER_WORKERS", min(4, os.cpu_count() or 1))
+INFER_MAX_PENDING    = _env_int("INFER_MAX_PENDING", 32)        # số request tối đa đang xử lý, vượt quá trả 503
+INFER_RETRY_AFTER_S  = _env_int("INFER_RETRY_AFTER_S", 1)       # giá trị header Retry-After khi quá tải
+
+# /predict giải mã ảnh trực tiếp từ bộ nhớ; bật để lưu thêm file upload vào uploads/ (chạy nền)
+PERSIST_PREDICT_UPLOADS = _env_bool("PERSIST_PREDICT_UPLOADS", False)
+
+# Gộp phép chia std của Normalize vào conv đầu tiên của backbone
+PREPROCESS_FOLD_NORMALIZE = _env_bool("PREPROCESS_FOLD_NORMALIZE", False)
+
+# Cache kết quả dự đoán theo nội dung ảnh
+PRED_CACHE_MAX_ENTRIES = _env_int("PRED_CACHE_MAX_ENTRIES", 4096)
+PRED_CACHE_TTL_S       = _env_float("PRED_CACHE_TTL_S", 24 * 3600)
+PRED_CACHE_PATH        = os.getenv("PRED_CACHE_PATH", "")           # để trống: chỉ cache trong bộ nhớ
+
+# Backend chạy forward: "eager" (checkpoint .pth), "torchscript" hoặc "onnx" (artifact từ app.ml.export)
+INFER_RUNTIME          = os.getenv("INFER_RUNTIME", "eager")
+INFER_RUNTIME_PATH     = os.getenv("INFER_RUNTIME_PATH", "")         # đường dẫn artifact .ts / .onnx
+INFER_INTRA_OP_THREADS = _env_int("INFER_INTRA_OP_THREADS", 0)       # 0: giữ mặc định của torch/onnxruntime
+
+# Chế độ phục vụ CPU với INFER_RUNTIME=eager: quantize "dynamic" / "static" (để trống: fp32) và channels_last
+INFER_QUANTIZE         = os.getenv("INFER_QUANTIZE", "")
+INFER_QUANT_CALIB_DIR  = os.getenv("INFER_QUANT_CALIB_DIR", "")      # thư mục ảnh hiệu chỉnh cho "static"
+INFER_CHANNELS_LAST    = _env_bool("INFER_CHANNELS_LAST", False)
+
+# Khởi động: nạp model ở nền để /health, /ready phản hồi ngay; warm-up trước khi báo sẵn sàng
+MODEL_BACKGROUND_LOAD  = _env_bool("MODEL_BACKGROUND_LOAD", True)
+MODEL_WARMUP_ITERS     = _env_int("MODEL_WARMUP_ITERS", 1)
+
+# Đường dẫn checkpoint (.pth hoặc .serve.pt); để trống: tự tìm trong app/ml/model
+MODEL_PATH             = os.getenv("MODEL_PATH", "")
+
+# /predict/batch: số ảnh tối đa mỗi request và số ảnh xử lý đồng thời trong 1 request
+BATCH_MAX_ITEMS        = _env_int("BATCH_MAX_ITEMS", 256)
+BATCH_CONCURRENCY      = _env_int("BATCH_CONCURRENCY", 16)
+
+# Lịch sử dự đoán: "sqlite" (file dùng chung giữa các worker) hoặc "memory" (list trong process)
+HISTORY_BACKEND        = os.getenv("HISTORY_BACKEND", "sqlite")
+HISTORY_DB_PATH        = os.getenv("HISTORY_DB_PATH", "prediction_history.db")
+HISTORY_PAGE_SIZE      = _env_int("HISTORY_PAGE_SIZE", 50)         # số bản ghi mặc định mỗi trang /predictions/history
+HISTORY_MAX_PAGE_SIZE  = _env_int("HISTORY_MAX_PAGE_SIZE", 500)
+
+# Upload: đọc theo chunk, giới hạn kích thước mỗi file (byte)
+UPLOAD_MAX_BYTES       = _env_int("UPLOAD_MAX_BYTES", 50 * 1024 * 1024)
+UPLOAD_CHUNK_SIZE      = _env_int("UPLOAD_CHUNK_SIZE", 1024 * 1024)
+BATCH_MAX_BYTES        = _env_int("BATCH_MAX_BYTES", 512 * 1024 * 1024)  # mỗi file của /predict/batch (kể cả zip/tar)
+
+# Grad-CAM (/predict?explain=true, /explain/{id}): cache heatmap theo hash nội dung ảnh
+EXPLAIN_CACHE_MAX_ENTRIES = _env_int("EXPLAIN_CACHE_MAX_ENTRIES", 1024)
+
+# Chỉ mục embedding các ca đã phân loại (/embed, /similar/{id}). Mỗi worker giữ 1 index riêng;
+# các worker dùng chung thư mục snapshot và gộp ca của nhau, nên 1 ca do worker khác phân loại
+# chỉ thấy được sau lần snapshot kế tiếp của worker đó
+SIMILARITY_INDEX_PATH     = os.getenv("SIMILARITY_INDEX_PATH", "")          # thư mục snapshot (mmap); để trống: chỉ trong bộ nhớ
+SIMILARITY_INDEX_DTYPE    = os.getenv("SIMILARITY_INDEX_DTYPE", "float32")  # "float32" hoặc "float16"
+SIMILARITY_PQ_SUBSPACES   = _env_int("SIMILARITY_PQ_SUBSPACES", 0)         # >0: bật product quantization (m byte / ca)
+SIMILARITY_SNAPSHOT_EVERY = _env_int("SIMILARITY_SNAPSHOT_EVERY", 1000)    # ghi snapshot sau mỗi N ca mới
+
+# Kiểm tra chất lượng ảnh trước khi chạy mạng: "reject" (loại ảnh không đạt, trả 422), "flag" (chỉ gắn cờ) hoặc "off"
+QC_MODE                   = os.getenv("QC_MODE", "reject")
+QC_MIN_SIDE               = _env_int("QC_MIN_SIDE", 64)              # cạnh ngắn (px) dưới mức này: loại
+QC_WARN_SIDE              = _env_int("QC_WARN_SIDE", 224)            # cạnh ngắn dưới mức này: cảnh báo
+QC_BLUR_REJECT            = _env_float("QC_BLUR_REJECT", 5.0)         # phương sai Laplacian (ảnh thu nhỏ 160px)
+QC_BLUR_WARN              = _env_float("QC_BLUR_WARN", 25.0)
+QC_DARK_REJECT            = _env_float("QC_DARK_REJECT", 10.0)        # độ sáng trung bình 0..255
+QC_BRIGHT_REJECT          = _env_float("QC_BRIGHT_REJECT", 245.0)
+QC_CLIPPED_REJECT         = _env_float("QC_CLIPPED_REJECT", 0.5)      # tỉ lệ điểm ảnh cháy sáng / tối hẳn
+
+# Số lớp xác suất cao nhất trả kèm mỗi dự đoán (top_k); có thể đổi theo request bằng ?top_k=
+PREDICT_TOP_K             = _env_int("PREDICT_TOP_K", 3)
+
+# /metrics (Prometheus); bật để trả header Server-Timing với thời gian từng bước của /predict
+METRICS_SERVER_TIMING     = _env_bool("METRICS_SERVER_TIMING", False)
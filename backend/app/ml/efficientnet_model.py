@@ -59,6 +59,15 @@ class EfficientNetClassifier(nn.Module):
             return F.softmax(logits, dim=1)
         return logits
 
+    def forward_with_embedding(self, x):
+        """Giống forward nhưng trả thêm embedding [N, embedding_dim] của cùng lần chạy"""
+        feats = self.backbone(x)
+        emb = self.embedding_layer(feats)
+        logits = self.classifier(emb)
+        if self.apply_softmax:
+            return F.softmax(logits, dim=1), emb
+        return logits, emb
+
     @torch.no_grad()
     def predict_proba(self, pil_image, device: torch.device):
         """
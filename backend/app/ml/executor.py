@@ -0,0 +1,94 @@
+"""
+Executor có giới hạn cho phần việc đồng bộ của pipeline dự đoán.
+
+Các hàm blocking (cv2, PIL, transform) được đẩy sang thread pool hoặc
+process pool để event loop của uvicorn luôn rảnh. Số request đang xử lý bị
+giới hạn bởi `max_pending`; khi đầy, `admit()` ném PoolSaturatedError ngay lập
+tức để endpoint trả 503 kèm Retry-After thay vì xếp hàng vô hạn.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict
+
+import torch
+
+
+class PoolSaturatedError(RuntimeError):
+    """Executor đã đủ số request đang xử lý"""
+    def __init__(self, retry_after: int):
+        super().__init__("Inference pool is saturated")
+        self.retry_after = retry_after
+
+
+def _init_process_worker():
+    # Mỗi process chỉ dùng 1 thread torch để các worker không tranh nhau CPU
+    torch.set_num_threads(1)
+
+
+class InferenceExecutor:
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: int = 4,
+        max_pending: int = 32,
+        retry_after: int = 1,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+
+        self._pool: Executor = self._build_pool()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.total_admitted = 0
+        self.total_rejected = 0
+
+    def _build_pool(self) -> Executor:
+        if self.kind == "process":
+            # spawn thay vì fork: fork sau khi torch đã khởi tạo thread pool dễ bị treo
+            return ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+            )
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference-io")
+
+    @contextmanager
+    def admit(self):
+        """Giữ 1 slot trong suốt vòng đời request; ném PoolSaturatedError nếu hết slot"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.total_rejected += 1
+                raise PoolSaturatedError(self.retry_after)
+            self._pending += 1
+            self.total_admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Chạy fn(*args) trong pool và chờ kết quả mà không chặn event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "total_admitted": self.total_admitted,
+                "total_rejected": self.total_rejected,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,90 @@
+"""
+Export checkpoint best_model.pth sang đồ thị tối ưu cho inference.
+
+- TorchScript: metadata (idx_to_class, kích thước ảnh, mean/std) được nhúng
+  trong file qua `_extra_files`.
+- ONNX: metadata nằm ở file `<artifact>.json` bên cạnh.
+
+Cách dùng (chạy trong thư mục backend):
+    python -m app.ml.export --checkpoint app/ml/model/best_model.pth --format torchscript onnx
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict
+
+import torch
+
+from app.ml.loader import load_model_cls, find_model_path
+from app.ml.preprocessing import TensorPreprocessor
+
+METADATA_FILE = "meta.json"
+INPUT_NAME = "input"
+OUTPUT_NAME = "probs"
+
+
+def build_metadata(model, idx_to_class) -> Dict:
+    pre = TensorPreprocessor.from_compose(model.transform)
+    return {
+        "idx_to_class": {str(k): v for k, v in idx_to_class.items()},
+        "img_size": pre.size,
+        "mean": pre.mean.flatten().tolist(),
+        "std": pre.std.flatten().tolist(),
+        "apply_softmax": bool(model.apply_softmax),
+        "temperature": float(getattr(model, "temperature", 1.0)),
+    }
+
+
+def export_torchscript(model, idx_to_class, path: str) -> str:
+    meta = build_metadata(model, idx_to_class)
+    h, w = meta["img_size"]
+    example = torch.zeros(1, 3, h, w, device=next(model.parameters()).device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+    torch.jit.save(traced, path, _extra_files={METADATA_FILE: json.dumps(meta)})
+    return path
+
+
+def export_onnx(model, idx_to_class, path: str, opset: int = 18) -> str:
+    meta = build_metadata(model, idx_to_class)
+    h, w = meta["img_size"]
+    example = torch.zeros(1, 3, h, w, device=next(model.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(),
+            (example,),
+            path,
+            input_names=[INPUT_NAME],
+            output_names=[OUTPUT_NAME],
+            dynamic_axes={INPUT_NAME: {0: "batch"}, OUTPUT_NAME: {0: "batch"}},
+            opset_version=opset,
+        )
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export classifier checkpoint to TorchScript / ONNX")
+    parser.add_argument("--checkpoint", default=None, help="đường dẫn best_model.pth (mặc định: tự tìm)")
+    parser.add_argument("--out-dir", default="app/ml/model")
+    parser.add_argument("--format", nargs="+", choices=["torchscript", "onnx"], default=["torchscript"])
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or find_model_path()
+    if checkpoint is None:
+        raise FileNotFoundError("Checkpoint not found, pass --checkpoint")
+
+    model, idx_to_class = load_model_cls(checkpoint, torch.device("cpu"))
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(checkpoint).stem
+
+    if "torchscript" in args.format:
+        print(f"TorchScript -> {export_torchscript(model, idx_to_class, str(out_dir / f'{stem}.ts'))}")
+    if "onnx" in args.format:
+        print(f"ONNX -> {export_onnx(model, idx_to_class, str(out_dir / f'{stem}.onnx'))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Grad-CAM cho EfficientNetClassifier.
+
+Bản đồ kích hoạt lấy từ `backbone.features` (lớp conv cuối). Backbone chạy 1 lần
+không cần gradient; chỉ phần head (avgpool → embedding → classifier) được chạy
+với autograd, bắt đầu từ feature map. Cùng 1 lần forward cho ra cả xác suất
+dự đoán lẫn gradient theo feature map, không cần forward lần 2.
+
+Heatmap được lưu ở độ phân giải của feature map (vd. 10x10 với ảnh 300x300),
+lượng tử hoá về uint8 — đủ nhỏ để trả trong JSON hoặc cache; ảnh PNG màu đúng
+kích thước ảnh gốc chỉ được dựng khi client yêu cầu.
+"""
+import base64
+import time
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from app.ml.image_io import decode_image
+from app.ml.preprocessing import TensorPreprocessor
+from app.ml.quality import screen_image
+
+# Cạnh dài nhất của PNG trả về
+HEATMAP_MAX_SIDE = 1024
+
+
+def _is_float_module(module: nn.Module) -> bool:
+    """Không có lớp quantize (torch.ao.nn.quantized*) và mọi tham số là số thực (có autograd)"""
+    for m in module.modules():
+        if type(m).__module__.startswith(("torch.ao.nn.quantized", "torch.ao.nn.intrinsic.quantized")):
+            return False
+    return all(p.is_floating_point() for p in module.parameters())
+
+
+def explainable_model(model) -> Optional[nn.Module]:
+    """
+    Model eager dùng được cho Grad-CAM (bỏ lớp bọc ChannelsLast), None nếu không hỗ trợ:
+    artifact TorchScript/ONNX, backbone đã quantize int8 hoặc head (embedding_layer /
+    classifier) đã quantize dynamic — các lớp quantize không lan truyền gradient.
+    """
+    inner = getattr(model, "model", model)
+    backbone = getattr(inner, "backbone", None)
+    if not isinstance(inner, nn.Module) or backbone is None or not hasattr(backbone, "features"):
+        return None
+    stem = backbone.features[0][0]
+    if not isinstance(stem, nn.Conv2d) or stem.weight.dtype != torch.float32:
+        return None
+    for name in ("embedding_layer", "classifier"):
+        head = getattr(inner, name, None)
+        if not isinstance(head, nn.Module) or not _is_float_module(head):
+            return None
+    return inner
+
+
+def grad_cam(model: nn.Module, x: torch.Tensor, target: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor, int, torch.Tensor]:
+    """
+    x: tensor [C, H, W] đã tiền xử lý.
+    Trả về (xác suất [num_classes], heatmap [h, w] trong [0, 1] ở độ phân giải feature map,
+    lớp được giải thích, embedding [embedding_dim]). Mặc định giải thích lớp có xác suất cao nhất.
+    """
+    device = next(model.parameters()).device
+    x = x.unsqueeze(0).to(device)
+    with torch.no_grad():
+        activations = model.backbone.features(x)
+    activations = activations.detach().requires_grad_(True)
+
+    with torch.enable_grad():
+        pooled = torch.flatten(model.backbone.avgpool(activations), 1)
+        emb = model.embedding_layer(pooled)
+        logits = model.classifier(emb)
+        probs = F.softmax(logits, dim=1)[0]
+        if target is None:
+            target = int(probs.argmax())
+        # Chỉ lấy gradient theo feature map, không tích luỹ .grad vào tham số (an toàn khi chạy song song)
+        (grads,) = torch.autograd.grad(logits[0, target], activations)
+
+    weights = grads.mean(dim=(2, 3), keepdim=True)
+    cam = F.relu((weights * activations.detach()).sum(dim=1))[0]
+    peak = cam.max()
+    cam = cam / peak if peak > 0 else cam
+    return probs.detach().cpu(), cam.cpu(), target, emb[0].detach().float().cpu()
+
+
+def decode_for_explain(
+    data: Union[bytes, bytearray, memoryview],
+    preprocessor: TensorPreprocessor,
+    qc_thresholds: Optional[Dict] = None,
+) -> Optional[Tuple[Optional[torch.Tensor], Optional[Dict], Tuple[int, int], Dict[str, float]]]:
+    """
+    Giải mã + kiểm tra chất lượng + tiền xử lý, giữ lại kích thước ảnh gốc (h, w) để dựng PNG.
+    Trả về (tensor hoặc None nếu bị QC loại, điểm QC, kích thước, thời gian từng bước),
+    None nếu không giải mã được.
+    """
+    t0 = time.perf_counter()
+    image = decode_image(data)
+    if image is None:
+        return None
+    timings = {"decode": time.perf_counter() - t0}
+    x, qc = screen_image(image, preprocessor, qc_thresholds, timings=timings)
+    return x, qc, image.shape[:2], timings
+
+
+def encode_heatmap(cam: torch.Tensor, target: int, class_name: str, image_size: Sequence[int]) -> Dict:
+    """Heatmap [0, 1] → dict JSON gọn: uint8 base64 ở độ phân giải feature map"""
+    data = (cam.clamp(0, 1) * 255.0).round().to(torch.uint8).numpy()
+    return {
+        "target": int(target),
+        "class": class_name,
+        "shape": list(data.shape),
+        "image_size": [int(image_size[0]), int(image_size[1])],
+        "dtype": "uint8",
+        "data": base64.b64encode(data.tobytes()).decode("ascii"),
+    }
+
+
+def heatmap_array(heatmap: Dict) -> np.ndarray:
+    raw = base64.b64decode(heatmap["data"])
+    return np.frombuffer(raw, dtype=np.uint8).reshape(heatmap["shape"])
+
+
+def render_heatmap_png(heatmap: Dict, max_side: int = HEATMAP_MAX_SIDE) -> bytes:
+    """Phóng heatmap về kích thước ảnh gốc (giới hạn cạnh dài max_side), tô màu JET, mã hoá PNG"""
+    h, w = heatmap["image_size"]
+    scale = min(1.0, max_side / max(h, w))
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    resized = cv2.resize(heatmap_array(heatmap), size, interpolation=cv2.INTER_LINEAR)
+    ok, buf = cv2.imencode(".png", cv2.applyColorMap(resized, cv2.COLORMAP_JET))
+    if not ok:
+        raise ValueError("Could not encode heatmap")
+    return buf.tobytes()
@@ -0,0 +1,296 @@
+"""
+Lưu trữ lịch sử dự đoán.
+
+- SQLiteHistoryStore: file SQLite (WAL) dùng chung giữa các worker uvicorn,
+  bản ghi chỉ được thêm (append-only), có index theo created_at. Việc ghi được
+  gom lô trên 1 thread nền nên không nằm trên đường đi của request, và bộ nhớ
+  process không tăng theo số lượng dự đoán.
+- MemoryHistoryStore: list trong process như trước đây (dev / thử nghiệm).
+"""
+import atexit
+import base64
+import bisect
+import json
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+_FLUSH = object()
+
+# Vị trí phân trang (keyset): (created_at, id) của bản ghi cuối trang trước
+Cursor = Tuple[str, str]
+
+
+def encode_cursor(record: Dict) -> str:
+    raw = f"{record.get('created_at', '')}|{record['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Cursor:
+    """ValueError nếu cursor không hợp lệ"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+    created_at, sep, record_id = raw.partition("|")
+    if not sep or not record_id:
+        raise ValueError(f"Invalid cursor: {token}")
+    return created_at, record_id
+
+
+def normalize_timestamp(value: str) -> str:
+    """
+    Mốc thời gian ISO 8601 → cùng định dạng với created_at (giờ địa phương, không có múi giờ),
+    để so sánh chuỗi được. Mốc có múi giờ (Z, +07:00) được đổi sang giờ địa phương.
+    ValueError nếu không hợp lệ.
+    """
+    if value.endswith(("Z", "z")):
+        # fromisoformat chỉ nhận "Z" từ Python 3.11
+        value = value[:-1] + "+00:00"
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt.isoformat()
+
+
+class HistoryStore:
+    """Interface chung cho các backend lưu lịch sử"""
+    def append(self, record: Dict):
+        raise NotImplementedError
+
+    def list(self) -> List[Dict]:
+        """Tất cả bản ghi, mới nhất trước"""
+        raise NotImplementedError
+
+    def query(
+        self,
+        limit: int,
+        cursor: Optional[Cursor] = None,
+        prediction: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        Tối đa `limit` bản ghi, mới nhất trước, nằm sau `cursor`.
+        Lọc theo lớp dự đoán và khoảng created_at (since <= created_at < until, chuỗi ISO).
+        """
+        raise NotImplementedError
+
+    def get(self, record_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryHistoryStore(HistoryStore):
+    def __init__(self):
+        # Luôn theo thứ tự (created_at, id) tăng dần; _keys song song với _records để bisect
+        self._records: List[Dict] = []
+        self._keys: List[Cursor] = []
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict):
+        key = (record.get("created_at", ""), record["id"])
+        with self._lock:
+            if not self._keys or key >= self._keys[-1]:
+                # Thường gặp: bản ghi được thêm theo thứ tự thời gian
+                self._records.append(record)
+                self._keys.append(key)
+            else:
+                i = bisect.bisect_right(self._keys, key)
+                self._records.insert(i, record)
+                self._keys.insert(i, key)
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return list(reversed(self._records))
+
+    def query(self, limit, cursor=None, prediction=None, since=None, until=None) -> List[Dict]:
+        # Duyệt từ bản ghi mới nhất (thứ tự (created_at, id) giảm dần, cùng thứ tự với cursor),
+        # bắt đầu ngay sau cursor và dừng khi đủ limit bản ghi
+        with self._lock:
+            end = len(self._keys) if cursor is None else bisect.bisect_left(self._keys, tuple(cursor))
+            out = []
+            for i in range(end - 1, -1, -1):
+                r = self._records[i]
+                created_at = self._keys[i][0]
+                if since is not None and created_at < since:
+                    # Các bản ghi còn lại đều cũ hơn
+                    break
+                if prediction is not None and r.get("prediction") != prediction:
+                    continue
+                if until is not None and created_at >= until:
+                    continue
+                out.append(r)
+                if len(out) >= limit:
+                    break
+        return out
+
+    def get(self, record_id: str) -> Optional[Dict]:
+        with self._lock:
+            return next((r for r in self._records if r.get("id") == record_id), None)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    def __init__(self, path: str, batch_size: int = 64, flush_interval_s: float = 0.05):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._init_schema()
+
+        # Mỗi thread dùng connection riêng; thread ghi giữ 1 connection cố định
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # ------------------------------------------------------------------ #
+    # Kết nối
+    # ------------------------------------------------------------------ #
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_history ("
+                " id TEXT PRIMARY KEY,"
+                " created_at TEXT NOT NULL,"
+                " prediction TEXT,"
+                " data TEXT NOT NULL)"
+            )
+            # Index khớp với thứ tự phân trang (created_at, id) và bộ lọc theo lớp
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_created_at ON prediction_history (created_at, id)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_history_prediction ON prediction_history (prediction, created_at, id)"
+            )
+        conn.close()
+
+    # ------------------------------------------------------------------ #
+    # Ghi (gom lô trên thread nền)
+    # ------------------------------------------------------------------ #
+    def append(self, record: Dict):
+        if self._closed:
+            raise RuntimeError("History store is closed")
+        self._queue.put(record)
+
+    def flush(self):
+        """Chờ tới khi mọi bản ghi đã append đều được ghi xuống đĩa"""
+        if self._closed or not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait()
+
+    def _write_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, events = [], []
+            while True:
+                if isinstance(item, tuple) and item[0] is _FLUSH:
+                    events.append(item[1])
+                elif item is None:
+                    stop = True
+                    break
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=self.flush_interval_s) if not events else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(conn, batch)
+            for event in events:
+                event.set()
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[Dict]):
+        rows = [
+            (r["id"], r.get("created_at", ""), r.get("prediction"), json.dumps(r, ensure_ascii=False))
+            for r in batch
+        ]
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO prediction_history (id, created_at, prediction, data) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            print(f"Failed to write {len(rows)} history records: {e}")
+
+    # ------------------------------------------------------------------ #
+    # Đọc
+    # ------------------------------------------------------------------ #
+    def list(self) -> List[Dict]:
+        self.flush()
+        rows = self._reader().execute(
+            "SELECT data FROM prediction_history ORDER BY created_at DESC, id DESC"
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def query(self, limit, cursor=None, prediction=None, since=None, until=None) -> List[Dict]:
+        self.flush()
+        where, params = [], []
+        if cursor is not None:
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params += [cursor[0], cursor[0], cursor[1]]
+        if prediction is not None:
+            where.append("prediction = ?")
+            params.append(prediction)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        sql = "SELECT data FROM prediction_history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        rows = self._reader().execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, record_id: str) -> Optional[Dict]:
+        self.flush()
+        row = self._reader().execute(
+            "SELECT data FROM prediction_history WHERE id = ?", (record_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+
+def create_history_store(backend: str, path: str) -> HistoryStore:
+    if backend == "memory":
+        return MemoryHistoryStore()
+    if backend == "sqlite":
+        return SQLiteHistoryStore(path)
+    raise ValueError(f"Unknown history backend: {backend}")
@@ -0,0 +1,166 @@
+"""
+Các bước xử lý ảnh nặng CPU (đọc, chuyển đổi, transform).
+Module này chỉ phụ thuộc cv2/PIL/torch để có thể chạy trong process pool
+mà không phải import lại router và model.
+"""
+import io
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from app.ml.preprocessing import TensorPreprocessor
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+# Chữ ký đầu file (magic bytes) của các định dạng cv2 giải mã được -> đuôi file chuẩn
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"BM", ".bmp"),
+    (b"II*\x00", ".tif"),
+    (b"MM\x00*", ".tif"),
+)
+# Số byte đầu cần có để nhận dạng (RIFF....WEBP dài nhất)
+IMAGE_SIGNATURE_LEN = 12
+
+
+def sniff_image_type(head: Union[bytes, bytearray, memoryview]) -> Optional[str]:
+    """Nhận dạng định dạng ảnh theo magic bytes, trả về đuôi file (".jpg", ...) hoặc None"""
+    head = bytes(head[:IMAGE_SIGNATURE_LEN])
+    for signature, ext in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def read_image(path: str):
+    """Đọc ảnh bằng cv2, trả về None nếu không đọc được"""
+    return cv2.imread(path)
+
+
+def decode_image(data: Union[bytes, bytearray, memoryview]):
+    """
+    Giải mã ảnh trực tiếp từ bộ nhớ, không ghi ra đĩa.
+    Kết quả giống hệt cv2.imread trên cùng nội dung file (BGR, uint8), None nếu không giải mã được.
+    """
+    buf = np.frombuffer(memoryview(data), dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def image_to_tensor(image, transform) -> torch.Tensor:
+    """Chuyển ảnh numpy (đọc bằng cv2) thành tensor [C, H, W] theo transform của model"""
+    if isinstance(transform, TensorPreprocessor):
+        # Làm việc trực tiếp trên buffer uint8, không qua PIL
+        return transform(image)
+    image_rgb = Image.fromarray(image).convert("RGB")
+    return transform(image_rgb)
+
+
+def save_bytes(path: Union[str, Path], data: bytes):
+    """Ghi nội dung upload ra đĩa (dùng làm background task); ghi vào file tạm rồi rename"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".part")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _is_image_member(name: str) -> bool:
+    path = Path(name)
+    # Bỏ qua file ẩn / metadata do macOS thêm vào khi nén
+    if any(part.startswith(".") or part == "__MACOSX" for part in path.parts):
+        return False
+    return path.suffix.lower() in IMAGE_EXTENSIONS
+
+
+class ArchiveMemberTooLargeError(ValueError):
+    """1 ảnh trong zip/tar vượt giới hạn (theo header hoặc theo số byte giải nén thực tế)"""
+    def __init__(self, max_bytes: int, total: bool = False):
+        if total:
+            super().__init__(f"Archive expands to more than {max_bytes} bytes")
+        else:
+            super().__init__(f"File exceeds the maximum upload size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+def _read_bounded(f, limit: int, chunk_size: int) -> Optional[bytes]:
+    """Đọc f theo chunk, dừng và trả về None ngay khi vượt limit byte (không tin kích thước trong header)"""
+    out = bytearray()
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return bytes(out)
+        out += chunk
+        if len(out) > limit:
+            return None
+
+
+def expand_archive(
+    data: bytes,
+    max_items: int,
+    max_member_bytes: int,
+    max_total_bytes: int,
+    chunk_size: int = 1024 * 1024,
+) -> Optional[List[Tuple[str, Union[bytes, ArchiveMemberTooLargeError]]]]:
+    """
+    Nếu data là file zip/tar (kể cả .tar.gz) thì trả về [(tên, bytes)] của các ảnh bên trong,
+    ngược lại trả về None. Ném ValueError khi số ảnh vượt quá max_items.
+
+    Chống zip / tar bomb: ảnh lớn hơn max_member_bytes, hoặc làm tổng số byte giải nén
+    vượt max_total_bytes, không được đọc vào bộ nhớ; vị trí của nó trong kết quả là
+    ArchiveMemberTooLargeError thay cho bytes (trả về như lỗi 413 của riêng ảnh đó).
+    """
+    items: List[Tuple[str, Union[bytes, ArchiveMemberTooLargeError]]] = []
+    total = 0
+
+    def add(name: str, declared: int, open_member):
+        nonlocal total
+        if len(items) >= max_items:
+            raise ValueError(f"Archive contains more than {max_items} images")
+        limit = min(max_member_bytes, max_total_bytes - total)
+        content = None
+        if declared <= limit:
+            with open_member() as f:
+                content = _read_bounded(f, limit, chunk_size)
+        if content is None:
+            if limit == max_member_bytes:
+                items.append((name, ArchiveMemberTooLargeError(max_member_bytes)))
+            else:
+                items.append((name, ArchiveMemberTooLargeError(max_total_bytes, total=True)))
+            return
+        total += len(content)
+        items.append((name, content))
+
+    buf = io.BytesIO(data)
+    if zipfile.is_zipfile(buf):
+        with zipfile.ZipFile(buf) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not _is_image_member(info.filename):
+                    continue
+                add(info.filename, info.file_size, lambda: zf.open(info))
+        return items
+
+    buf.seek(0)
+    try:
+        tf = tarfile.open(fileobj=buf, mode="r:*")
+    except tarfile.TarError:
+        return None
+    with tf:
+        for member in tf:
+            if not member.isfile() or not _is_image_member(member.name):
+                continue
+            add(member.name, member.size, lambda: tf.extractfile(member))
+    return items
@@ -0,0 +1,216 @@
+"""
+Dynamic micro-batching cho inference.
+
+Các request đơn lẻ được đưa vào hàng đợi; một thread worker gom chúng thành
+batch (tối đa `max_batch_size` ảnh hoặc chờ tối đa `max_wait_ms`) rồi chạy
+một lần `forward` duy nhất và trả kết quả riêng cho từng request.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from app.ml.metrics import ENGINE_FORWARD_SECONDS, ENGINE_BATCH_SIZE
+
+# Các mốc histogram cho độ sâu hàng đợi (giá trị cuối là +Inf)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+_STOP = object()
+
+
+class InferenceEngine:
+    """
+    Gom request thành batch và chạy trên 1 thread riêng.
+    - submit(x): x là tensor [C, H, W] đã qua transform, trả về Future chứa xác suất [num_classes].
+    - submit_views(x): x là tensor [k, C, H, W] (vd. các view TTA của 1 ảnh), k dòng luôn
+      nằm chung 1 lần forward; Future chứa xác suất [k, num_classes].
+    - with_embedding=True: Future chứa (xác suất, embedding) lấy từ cùng lần forward,
+      nếu model có `forward_with_embedding` (model eager); ngược lại embedding là None.
+    - predict(x): phiên bản blocking của submit.
+    """
+    def __init__(
+        self,
+        model,
+        device: torch.device,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+
+        self.batch_size_hist: Counter = Counter()
+        self.queue_depth_hist: Counter = Counter()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_rows = 0
+        self.max_queue_depth = 0
+
+    # ------------------------------------------------------------------ #
+    # Vòng đời
+    # ------------------------------------------------------------------ #
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._worker, name="inference-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # ------------------------------------------------------------------ #
+    # API
+    # ------------------------------------------------------------------ #
+    def submit(self, x: torch.Tensor, with_embedding: bool = False) -> Future:
+        if not self.running:
+            raise RuntimeError("InferenceEngine is not running")
+        future: Future = Future()
+        self._queue.put((x.unsqueeze(0), future, True, with_embedding))
+        return future
+
+    def submit_views(self, x: torch.Tensor, with_embedding: bool = False) -> Future:
+        if not self.running:
+            raise RuntimeError("InferenceEngine is not running")
+        future: Future = Future()
+        self._queue.put((x, future, False, with_embedding))
+        return future
+
+    @property
+    def supports_embedding(self) -> bool:
+        return hasattr(self.model, "forward_with_embedding")
+
+    def predict(self, x: torch.Tensor, timeout: Optional[float] = None) -> torch.Tensor:
+        return self.submit(x).result(timeout)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        """Số liệu để tinh chỉnh max_batch_size / max_wait_ms."""
+        with self._stats_lock:
+            depth_hist = {}
+            for bound in QUEUE_DEPTH_BUCKETS:
+                depth_hist[str(bound)] = self.queue_depth_hist.get(bound, 0)
+            depth_hist["+Inf"] = self.queue_depth_hist.get(None, 0)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "queue_depth": self.queue_depth(),
+                "max_queue_depth": self.max_queue_depth,
+                "total_requests": self.total_requests,
+                "total_batches": self.total_batches,
+                "total_rows": self.total_rows,
+                "avg_batch_size": (self.total_rows / self.total_batches) if self.total_batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_hist.items())},
+                "queue_depth_histogram": depth_hist,
+            }
+
+    # ------------------------------------------------------------------ #
+    # Worker
+    # ------------------------------------------------------------------ #
+    def _collect_batch(self) -> Tuple[List, bool]:
+        """Chờ request đầu tiên, sau đó gom thêm cho tới khi đủ batch (tính theo số dòng) hoặc hết thời gian chờ."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        items = [first]
+        rows = first[0].shape[0]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        stop = False
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            items.append(item)
+            rows += item[0].shape[0]
+        return items, stop
+
+    def _record(self, num_requests: int, batch_size: int):
+        depth = self._queue.qsize()
+        bucket = next((b for b in QUEUE_DEPTH_BUCKETS if depth <= b), None)
+        with self._stats_lock:
+            self.batch_size_hist[batch_size] += 1
+            self.queue_depth_hist[bucket] += 1
+            self.total_requests += num_requests
+            self.total_batches += 1
+            self.total_rows += batch_size
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def _run_batch(self, items: List):
+        # Bỏ qua các request đã bị huỷ trước khi chạy
+        items = [item for item in items if item[1].set_running_or_notify_cancel()]
+        if not items:
+            return
+        batch = torch.cat([item[0] for item in items]) if len(items) > 1 else items[0][0]
+        self._record(len(items), batch.shape[0])
+        ENGINE_BATCH_SIZE.observe(batch.shape[0])
+        embed = self.supports_embedding and any(item[3] for item in items)
+        t0 = time.perf_counter()
+        try:
+            batch = batch.to(self.device)
+            emb = None
+            with torch.inference_mode():
+                if embed:
+                    out, emb = self.model.forward_with_embedding(batch)
+                    emb = emb.float().cpu()
+                else:
+                    out = self.model(batch)
+                probs = out if getattr(self.model, "apply_softmax", False) else F.softmax(out, dim=1)
+            probs = probs.float().cpu()
+        except Exception as e:
+            for item in items:
+                item[1].set_exception(e)
+            return
+        ENGINE_FORWARD_SECONDS.observe(time.perf_counter() - t0)
+        start = 0
+        for x, f, single, with_embedding in items:
+            rows = slice(start, start + x.shape[0])
+            p = probs[start] if single else probs[rows]
+            if with_embedding:
+                e = None if emb is None else (emb[start] if single else emb[rows])
+                f.set_result((p, e))
+            else:
+                f.set_result(p)
+            start += x.shape[0]
+
+    def _worker(self):
+        while True:
+            items, stop = self._collect_batch()
+            if items:
+                self._run_batch(items)
+            if stop:
+                break
+        # Các request còn lại sau khi dừng sẽ nhận lỗi thay vì chờ mãi
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[1].set_exception(RuntimeError("InferenceEngine stopped"))
@@ -0,0 +1,79 @@
+"""Nạp checkpoint phân loại dùng cho phục vụ (API, export, benchmark)"""
+import os
+from pathlib import Path
+from typing import Optional
+
+import torch
+import torchvision.transforms as transforms
+
+from app.ml.efficientnet_model import EfficientNetClassifier
+from app.ml.serving_checkpoint import SERVING_SUFFIX, load_serving_checkpoint, read_checkpoint
+from app.ml.config import MODEL_PATH
+
+# Transform mặc định cho best_model.pth ("model_state_dict", không có hparams); checkpoint
+# huấn luyện không có hparams dùng training/config.py (xem serving_checkpoint.read_checkpoint)
+SERVING_IMG_SIZE = (300, 300)
+SERVING_MEAN = [0.7539897561073303, 0.5854063034057617, 0.5899980068206787]
+SERVING_STD = [0.12629127502441406, 0.14309869706630707, 0.15721528232097626]
+
+# Các vị trí có thể chứa checkpoint (ưu tiên định dạng phục vụ *.serve.pt)
+MODEL_CANDIDATE_PATHS = [
+    Path(__file__).parent / "model" / f"best_model{SERVING_SUFFIX}",
+    Path(__file__).parent / "model" / "best_model.pth",  # app/ml/model
+    Path("backend/app/ml/model/best_model.pth"),  # Đường dẫn từ thư mục gốc
+    Path(os.getcwd()) / "backend" / "app" / "ml" / "model" / "best_model.pth",  # Đường dẫn tuyệt đối từ thư mục hiện tại
+]
+
+
+def find_model_path() -> Optional[str]:
+    """Trả về đường dẫn checkpoint đầu tiên tồn tại (hoặc MODEL_PATH nếu được cấu hình), None nếu không có"""
+    if MODEL_PATH:
+        return MODEL_PATH if os.path.exists(MODEL_PATH) else None
+    # Giải quyết các đường dẫn để loại bỏ .. và .
+    for path in MODEL_CANDIDATE_PATHS:
+        path = str(path.resolve())
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _torch_load(model_path: str, device):
+    """torch.load với mmap (checkpoint định dạng zip); checkpoint kiểu cũ thì đọc bình thường"""
+    try:
+        return torch.load(model_path, map_location=device, weights_only=False, mmap=True)
+    except RuntimeError:
+        return torch.load(model_path, map_location=device, weights_only=False)
+
+
+# Load model function (copied from test.py)
+def load_model_cls(model_path: str, device):
+    if model_path.endswith(SERVING_SUFFIX):
+        return load_serving_checkpoint(model_path, device)
+
+    ckpt = _torch_load(model_path, device)
+    # best_model.pth ("model_state_dict") hoặc checkpoint từ training/train.py, EarlyStopping,
+    # save_last_ckpt ("model_state", kèm hparams img_size / norm_mean / norm_std / embedding_dim)
+    state_dict, idx_to_class, meta = read_checkpoint(ckpt, model_path)
+
+    # Trọng số đều lấy từ checkpoint: dựng kiến trúc trên meta device (không tải ImageNet,
+    # không khởi tạo ngẫu nhiên) rồi gán thẳng tensor của checkpoint vào model
+    with torch.device("meta"):
+        model = EfficientNetClassifier(
+            num_classes=len(idx_to_class),
+            embedding_dim=meta["embedding_dim"],
+            pretrained=False,
+            apply_softmax=True
+        )
+
+    model.load_state_dict(state_dict, assign=True)
+    model.to(device)
+    model.transform = transforms.Compose([
+            transforms.Resize(tuple(meta["img_size"])),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=meta["mean"], std=meta["std"]),
+    ])
+    # Nhiệt độ hiệu chỉnh (app.ml.calibration); checkpoint chưa hiệu chỉnh: 1.0
+    model.temperature = float(meta["temperature"])
+    model.eval()
+
+    return model, idx_to_class
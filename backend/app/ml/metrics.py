@@ -0,0 +1,200 @@
+"""
+Số liệu độ trễ / thông lượng theo định dạng văn bản Prometheus (không cần prometheus_client).
+
+- Counter / Histogram có nhãn, cập nhật dưới 1 lock riêng (vài trăm ns mỗi lần ghi);
+  histogram dùng mốc cố định và bisect, không lưu từng mẫu.
+- Collector: hàm trả về các series tính lúc scrape từ stats() sẵn có
+  (độ sâu hàng đợi, executor, cache, ...), không tốn gì trên đường xử lý request.
+- StageTimer: đo từng bước của 1 request bằng time.perf_counter, ghi vào histogram
+  khi xong và dựng header Server-Timing.
+
+Mỗi process có số liệu riêng; khi chạy nhiều worker (serve.py) mỗi lần scrape
+trả về số liệu của 1 worker, phân biệt bằng nhãn `pid`.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Mốc (giây) cho các bước của request: từ vài trăm micro giây (QC) tới vài giây (forward CPU)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (tên, kiểu, mô tả, [(nhãn, giá trị)]) do collector trả về
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple, object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _header(self) -> List[str]:
+        # Định dạng văn bản 0.0.4: HELP/TYPE mang đúng tên series (có hậu tố _total)
+        return [f"# HELP {self.name}_total {self.help}", f"# TYPE {self.name}_total counter"]
+
+    def inc(self, value: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + value
+
+    def render(self, const: Dict[str, str]) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            labels = {**const, **dict(zip(self.labelnames, key))}
+            lines.append(f"{self.name}_total{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [số mẫu theo từng mốc (không cộng dồn) + mốc +Inf, tổng, số mẫu]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, const: Dict[str, str]) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            series = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = {**const, **dict(zip(self.labelnames, key))}
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = _format_labels({**labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(self.prefix + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(self.prefix + name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        # pid đọc lại mỗi lần: registry có thể được tạo trước khi fork worker
+        const = {"pid": str(os.getpid())}
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(const))
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                name = self.prefix + name + ("_total" if kind == "counter" else "")
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels({**const, **labels})} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(prefix="skin_api_")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_seconds", "Thời gian từng bước xử lý request (giây)", ("endpoint", "stage"),
+)
+PREDICTIONS = REGISTRY.counter(
+    "predictions", "Số request dự đoán theo kết quả (ok, cached, rejected, invalid, busy, error)", ("endpoint", "outcome"),
+)
+# Ghi từ thread worker của InferenceEngine
+ENGINE_FORWARD_SECONDS = REGISTRY.histogram(
+    "engine_forward_seconds", "Thời gian forward mỗi batch của InferenceEngine (giây)",
+)
+ENGINE_BATCH_SIZE = REGISTRY.histogram(
+    "engine_batch_size", "Số dòng (ảnh / view) mỗi batch forward", buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+class StageTimer:
+    """Đo các bước của 1 request; cùng tên bước gọi nhiều lần thì cộng dồn"""
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def finish(self, outcome: Optional[str] = None):
+        """Ghi các bước (và tổng thời gian) vào histogram; outcome: đếm vào PREDICTIONS"""
+        self.stages["total"] = time.perf_counter() - self.started
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, endpoint=self.endpoint, stage=name)
+        if outcome is not None:
+            PREDICTIONS.inc(endpoint=self.endpoint, outcome=outcome)
+
+    def server_timing(self) -> str:
+        """Giá trị header Server-Timing (mili giây)"""
+        return ", ".join(f"{name};dur={seconds * 1000.0:.3f}" for name, seconds in self.stages.items())
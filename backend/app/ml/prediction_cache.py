@@ -0,0 +1,195 @@
+"""
+Cache kết quả dự đoán theo nội dung ảnh.
+
+Khoá = hash(bytes ảnh) + fingerprint của checkpoint, nên cùng một ảnh gửi lại
+(qua /predict hay /predict-from-upload) sẽ không chạy lại model; đổi checkpoint
+thì cache cũ tự động không còn khớp.
+
+- Bộ nhớ có giới hạn: tối đa `max_entries` bản ghi, loại bỏ theo LRU.
+- TTL: bản ghi quá `ttl_s` giây bị coi là miss.
+- Tuỳ chọn lưu xuống SQLite (`persist_path`) để cache còn sau khi khởi động lại;
+  việc ghi đĩa chạy trên 1 thread riêng, không nằm trên đường đi của request;
+  aget đọc đĩa trên thread pool nên không chặn event loop.
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+
+def file_fingerprint(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash nội dung file checkpoint (đọc theo từng chunk)"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_hash(data) -> str:
+    return hashlib.blake2b(memoryview(data), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    def __init__(
+        self,
+        model_fingerprint: str,
+        max_entries: int = 4096,
+        ttl_s: float = 86400.0,
+        persist_path: Optional[str] = None,
+    ):
+        self.model_fingerprint = model_fingerprint
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.persist_path = persist_path
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        if persist_path:
+            self._open_db(persist_path)
+
+    # ------------------------------------------------------------------ #
+    # Khoá
+    # ------------------------------------------------------------------ #
+    def make_key(self, data, digest: Optional[str] = None, variant: str = "") -> str:
+        """
+        digest: content_hash(data) nếu đã tính sẵn (vd. trong lúc đọc upload).
+        variant: cách dự đoán khác mặc định (vd. "tta4"), cho kết quả khác nên khoá khác.
+        """
+        key = f"{digest or content_hash(data)}:{self.model_fingerprint}"
+        return f"{key}:{variant}" if variant else key
+
+    # ------------------------------------------------------------------ #
+    # API
+    # ------------------------------------------------------------------ #
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Tra bộ nhớ rồi SQLite (blocking); trong code async dùng aget"""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is None:
+            value = self._disk_lookup(key, now)
+        return value
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Như get, nhưng truy vấn SQLite chạy trên thread pool để không chặn event loop"""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is None:
+            if self._db is not None:
+                value = await asyncio.to_thread(self._disk_lookup, key, now)
+            else:
+                value = self._disk_lookup(key, now)
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        created_at = time.time()
+        with self._lock:
+            self._insert(key, value, created_at)
+        if self._writer is not None:
+            self._writer.submit(self._disk_put, key, value, created_at)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def _memory_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if now - created_at <= self.ttl_s:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        return None
+
+    def _disk_lookup(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        """Sau khi miss trong bộ nhớ: đọc SQLite (nếu có) và cập nhật thống kê"""
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._insert(key, *entry)
+        return entry[0]
+
+    def _insert(self, key: str, value: Dict[str, Any], created_at: float):
+        self._entries[key] = (value, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ------------------------------------------------------------------ #
+    # Lưu trữ SQLite
+    # ------------------------------------------------------------------ #
+    def _open_db(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prediction_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Dọn các bản ghi đã hết hạn khi khởi động
+            self._db.execute("DELETE FROM prediction_cache WHERE created_at < ?", (time.time() - self.ttl_s,))
+            self._db.commit()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prediction-cache")
+
+    def _disk_get(self, key: str, now: float):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM prediction_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or now - row[1] > self.ttl_s:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _disk_put(self, key: str, value: Dict[str, Any], created_at: float):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO prediction_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), created_at),
+            )
+            self._db.commit()
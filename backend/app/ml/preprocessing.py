@@ -0,0 +1,112 @@
+"""
+Tiền xử lý ảnh dạng tensor, thay cho chuỗi numpy → PIL → ToTensor → Normalize.
+
+Ảnh uint8 (HWC, đọc bằng cv2) được resize trực tiếp trên tensor uint8, sau
+đó Normalize được gộp thành một phép nhân-cộng duy nhất trên cả batch:
+
+    (x / 255 - mean) / std  =  x * scale + shift,   scale = 1 / (255 * std), shift = -mean / std
+
+Tuỳ chọn `fold_into(model)` gộp luôn `scale` vào trọng số conv đầu tiên của
+backbone, khi đó đầu vào chỉ cần trừ `255 * mean` (vẫn chính xác ở viền vì
+giá trị 0 sau khi trừ tương ứng với 0 sau Normalize, trùng với zero padding).
+"""
+from typing import List, Sequence, Union
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torchvision.transforms as transforms
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+
+class TensorPreprocessor:
+    """
+    Resize + Normalize trên tensor uint8.
+    - __call__(image): 1 ảnh (numpy HWC uint8 hoặc PIL) → tensor [C, H, W] float32.
+    - batch(images): nhiều ảnh → tensor [N, C, H, W], normalize 1 lần cho cả batch.
+    """
+    def __init__(self, size: Sequence[int], mean: Sequence[float], std: Sequence[float]):
+        self.size = [int(size[0]), int(size[1])]
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        self.std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.folded = False
+        self._update_affine()
+
+    @classmethod
+    def from_compose(cls, compose: transforms.Compose) -> "TensorPreprocessor":
+        """Lấy size/mean/std từ Compose(Resize, ToTensor, Normalize) mà load_model_cls gắn vào model"""
+        size = mean = std = None
+        for t in compose.transforms:
+            if isinstance(t, transforms.Resize):
+                size = t.size if isinstance(t.size, (list, tuple)) else (t.size, t.size)
+            elif isinstance(t, transforms.Normalize):
+                mean, std = t.mean, t.std
+        if size is None or mean is None:
+            raise ValueError("Compose must contain Resize and Normalize")
+        return cls(size, mean, std)
+
+    def _update_affine(self):
+        if self.folded:
+            # scale đã nằm trong conv đầu tiên, chỉ còn trừ mean (đơn vị 0..255)
+            self.scale = torch.ones_like(self.std)
+            self.shift = -255.0 * self.mean
+        else:
+            self.scale = 1.0 / (255.0 * self.std)
+            self.shift = -self.mean / self.std
+
+    # ------------------------------------------------------------------ #
+    # Resize
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _to_uint8_chw(image) -> torch.Tensor:
+        if isinstance(image, Image.Image):
+            image = np.asarray(image.convert("RGB"))
+        if image.ndim == 2:
+            image = np.repeat(image[:, :, None], 3, axis=2)
+        elif image.shape[2] == 4:
+            image = image[:, :, :3]
+        # from_numpy không copy; permute chỉ đổi stride
+        return torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1)
+
+    def _resize(self, x: torch.Tensor) -> torch.Tensor:
+        if list(x.shape[-2:]) == self.size:
+            return x
+        # bilinear + antialias cho kết quả gần như trùng với PIL Resize
+        return TF.resize(x, self.size, interpolation=transforms.InterpolationMode.BILINEAR, antialias=True)
+
+    def resize_uint8(self, images: Union[torch.Tensor, List]) -> torch.Tensor:
+        """Resize về tensor uint8 [N, C, H, W]; tensor [N, H, W, C] cùng kích thước được resize 1 lần"""
+        if isinstance(images, torch.Tensor):
+            return self._resize(images.permute(0, 3, 1, 2))
+        return torch.stack([self._resize(self._to_uint8_chw(img)) for img in images])
+
+    # ------------------------------------------------------------------ #
+    # Normalize
+    # ------------------------------------------------------------------ #
+    def normalize(self, x: torch.Tensor) -> torch.Tensor:
+        """uint8 [N, C, H, W] → float32, 1 phép nhân-cộng cho cả batch"""
+        out = x.to(torch.float32, copy=True)
+        return torch.addcmul(self.shift, out, self.scale, out=out)
+
+    def batch(self, images: Union[torch.Tensor, List]) -> torch.Tensor:
+        return self.normalize(self.resize_uint8(images))
+
+    def __call__(self, image) -> torch.Tensor:
+        return self.batch([image])[0]
+
+    # ------------------------------------------------------------------ #
+    # Gộp normalize vào conv đầu tiên
+    # ------------------------------------------------------------------ #
+    def fold_into(self, model: nn.Module) -> nn.Module:
+        """Nhân 1 / (255 * std) vào trọng số conv stem của EfficientNetClassifier.backbone (in-place)"""
+        if self.folded:
+            return model
+        stem = model.backbone.features[0][0]
+        if not isinstance(stem, nn.Conv2d) or stem.in_channels != 3:
+            raise ValueError("Expected a 3-channel Conv2d as the first backbone layer")
+        with torch.no_grad():
+            stem.weight.mul_((1.0 / (255.0 * self.std)).view(1, 3, 1, 1).to(stem.weight))
+        self.folded = True
+        self._update_affine()
+        return model
@@ -0,0 +1,163 @@
+"""
+Kiểm tra chất lượng ảnh (QC) trước khi chạy mạng.
+
+Các phép đo đều là phép toán OpenCV vector hoá trên 1 bản thu nhỏ (cạnh dài
+QC_ANALYSIS_SIDE px, lấy mẫu INTER_NEAREST) của ảnh đã giải mã, nên tốn cỡ vài trăm
+micro giây và gần như không phụ thuộc độ phân giải gốc. Độ nét được đo ở tỉ lệ gần
+với kích thước đầu vào của model: ảnh lớn hơi mờ nhưng thu nhỏ về 300px vẫn nét thì không bị loại.
+- blur      : phương sai Laplacian của ảnh xám (càng lớn càng nét)
+- brightness: độ sáng trung bình 0..255; clippedLow / clippedHigh là tỉ lệ điểm ảnh
+              gần đen / gần trắng (từ histogram)
+- contrast  : độ lệch chuẩn độ sáng / 127.5 (0..1)
+- skinRatio : tỉ lệ điểm ảnh có màu da theo ngưỡng YCrCb (chỉ cảnh báo)
+- width / height: độ phân giải gốc
+
+Tên trường khớp với QualityControlResults của frontend (QCIndicator.tsx).
+"""
+from typing import Dict, Optional, Tuple, Union
+
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from app.ml.config import (
+    QC_MODE, QC_MIN_SIDE, QC_WARN_SIDE, QC_BLUR_REJECT, QC_BLUR_WARN,
+    QC_DARK_REJECT, QC_BRIGHT_REJECT, QC_CLIPPED_REJECT,
+)
+from app.ml.image_io import decode_image, image_to_tensor
+from app.ml.tta import augment_views
+
+QC_ANALYSIS_SIDE = 160
+
+DEFAULT_THRESHOLDS = {
+    "reject": QC_MODE == "reject",  # False: chỉ gắn cờ, vẫn chạy mạng
+    "min_side": QC_MIN_SIDE,
+    "warn_side": QC_WARN_SIDE,
+    "blur_reject": QC_BLUR_REJECT,
+    "blur_warn": QC_BLUR_WARN,
+    "dark_reject": QC_DARK_REJECT,
+    "dark_warn": 50.0,
+    "bright_reject": QC_BRIGHT_REJECT,
+    "bright_warn": 200.0,
+    "clipped_reject": QC_CLIPPED_REJECT,
+    "clipped_warn": 0.15,
+    "contrast_reject": 0.03,         # độ lệch chuẩn độ sáng / 127.5
+    "contrast_warn": 0.1,
+    "skin_warn": 0.2,                # tỉ lệ điểm ảnh màu da
+}
+
+
+def _analysis_image(image: np.ndarray) -> np.ndarray:
+    h, w = image.shape[:2]
+    scale = QC_ANALYSIS_SIDE / max(h, w)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_NEAREST)
+
+
+def assess(image: np.ndarray, thresholds: Optional[Dict] = None) -> Dict:
+    """Đo chất lượng ảnh BGR uint8 (như cv2.imdecode trả về)"""
+    t = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    h, w = image.shape[:2]
+    small = _analysis_image(image)
+    if small.ndim == 2:
+        small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    _, lap_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    blur = float(lap_std[0, 0]) ** 2
+    mean, std = cv2.meanStdDev(gray)
+    brightness, contrast = float(mean[0, 0]), float(std[0, 0]) / 127.5
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    clipped_low, clipped_high = float(hist[:6].sum()), float(hist[250:].sum())
+    ycrcb = cv2.cvtColor(small, cv2.COLOR_BGR2YCrCb)
+    skin = cv2.inRange(ycrcb, (0, 133, 77), (255, 173, 127))
+    skin_ratio = float(cv2.countNonZero(skin)) / gray.size
+
+    errors, warnings = [], []
+
+    def check(value, reject_if, warn_if, reject_msg, warn_msg):
+        if reject_if(value):
+            errors.append(reject_msg)
+        elif warn_if(value):
+            warnings.append(warn_msg)
+
+    side = min(h, w)
+    check(side, lambda v: v < t["min_side"], lambda v: v < t["warn_side"],
+          f"Resolution too low ({w}x{h})", f"Low resolution ({w}x{h})")
+    check(blur, lambda v: v < t["blur_reject"], lambda v: v < t["blur_warn"],
+          "Image is too blurry", "Image may be blurry")
+    check(brightness, lambda v: v < t["dark_reject"], lambda v: v < t["dark_warn"],
+          "Image is too dark", "Image is dark")
+    check(brightness, lambda v: v > t["bright_reject"], lambda v: v > t["bright_warn"],
+          "Image is overexposed", "Image is bright")
+    check(max(clipped_low, clipped_high), lambda v: v > t["clipped_reject"], lambda v: v > t["clipped_warn"],
+          "Too many clipped pixels", "Some pixels are clipped")
+    check(contrast, lambda v: v < t["contrast_reject"], lambda v: v < t["contrast_warn"],
+          "Image has almost no contrast", "Low contrast")
+    if skin_ratio < t["skin_warn"]:
+        warnings.append("Little skin detected")
+
+    return {
+        "brightness": brightness,
+        "contrast": contrast,
+        "blur": blur,
+        "clippedLow": clipped_low,
+        "clippedHigh": clipped_high,
+        "skinRatio": skin_ratio,
+        "width": int(w),
+        "height": int(h),
+        "isAcceptable": not errors,
+        "errors": errors,
+        "warnings": warnings,
+    }
+
+
+def screen_image(
+    image: np.ndarray,
+    transform,
+    thresholds: Optional[Dict] = None,
+    views: int = 1,
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[Optional[torch.Tensor], Optional[Dict]]:
+    """
+    Kiểm tra chất lượng rồi mới transform ảnh đã giải mã. thresholds=None: bỏ qua QC.
+    Trả về (tensor, qc); tensor là None nếu ảnh bị QC loại (thresholds["reject"]).
+    views > 1: tensor là batch các view TTA [views, C, H, W].
+    timings: nếu có, ghi thời gian (giây) của bước "qc" và "preprocess".
+    """
+    t0 = time.perf_counter()
+    qc = assess(image, thresholds) if thresholds is not None else None
+    t1 = time.perf_counter()
+    if qc is not None and thresholds.get("reject", True) and not qc["isAcceptable"]:
+        x = None
+    else:
+        x = image_to_tensor(image, transform)
+        if views > 1:
+            x = augment_views(x, views, transform)
+    if timings is not None:
+        timings["qc"] = t1 - t0
+        timings["preprocess"] = time.perf_counter() - t1
+    return x, qc
+
+
+def decode_with_qc(
+    data: Union[bytes, bytearray, memoryview],
+    transform,
+    thresholds: Optional[Dict] = None,
+    views: int = 1,
+) -> Tuple[Optional[torch.Tensor], Optional[Dict], Dict[str, float]]:
+    """
+    Giải mã + kiểm tra chất lượng + transform trong 1 lần gọi (chạy trong executor).
+    Trả về (tensor, qc, thời gian từng bước "decode" / "qc" / "preprocess" tính bằng giây).
+    (None, None, ...): không giải mã được; (None, qc, ...): bị QC loại, không transform / không chạy mạng.
+    """
+    t0 = time.perf_counter()
+    image = decode_image(data)
+    timings = {"decode": time.perf_counter() - t0}
+    if image is None:
+        return None, None, timings
+    x, qc = screen_image(image, transform, thresholds, views, timings)
+    return x, qc, timings
@@ -0,0 +1,221 @@
+"""
+Chế độ phục vụ INT8 / channels_last cho CPU, xây trên model từ load_model_cls.
+
+- dynamic: quantize động các lớp Linear của `embedding_layer` và `classifier`.
+- static : quantize tĩnh backbone bằng FX graph mode, hiệu chỉnh (calibrate)
+           trên một thư mục ảnh mẫu; phần head vẫn quantize động.
+- channels_last: đổi layout bộ nhớ của model và đầu vào sang NHWC.
+
+Báo cáo độ lệch so với model fp32 trên thư mục validation:
+    python -m app.ml.quantization --mode static --calib-dir data/calib --val-dir data/val --channels-last
+"""
+import argparse
+import copy
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from app.ml.image_io import read_image
+from app.ml.preprocessing import TensorPreprocessor
+
+QUANT_MODES = ("dynamic", "static")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+
+
+class ChannelsLast(nn.Module):
+    """Bọc model để đầu vào luôn ở dạng channels_last (NHWC)"""
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+        self.apply_softmax = getattr(model, "apply_softmax", False)
+        self.transform = getattr(model, "transform", None)
+        self.temperature = getattr(model, "temperature", 1.0)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+    def forward_with_embedding(self, x):
+        return self.model.forward_with_embedding(x.contiguous(memory_format=torch.channels_last))
+
+
+def list_images(folder: str, limit: Optional[int] = None) -> List[Path]:
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return paths[:limit] if limit else paths
+
+
+def _load_batches(paths: List[Path], preprocessor: TensorPreprocessor, batch_size: int):
+    for i in range(0, len(paths), batch_size):
+        images = [img for img in (read_image(str(p)) for p in paths[i:i + batch_size]) if img is not None]
+        if images:
+            yield preprocessor.batch(images)
+
+
+def quantize_head_dynamic(model: nn.Module) -> nn.Module:
+    """Quantize động (int8 weight, activation quantize lúc chạy) cho Linear ở head"""
+    model.embedding_layer = quantize_dynamic(model.embedding_layer, {nn.Linear}, dtype=torch.qint8)
+    model.classifier = quantize_dynamic(model.classifier, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def quantize_backbone_static(
+    model: nn.Module,
+    calib_dir: str,
+    preprocessor: TensorPreprocessor,
+    num_calib: int = 256,
+    batch_size: int = 16,
+    backend: str = "x86",
+) -> nn.Module:
+    """FX graph mode: chèn observer, chạy ảnh hiệu chỉnh, rồi chuyển backbone sang int8"""
+    paths = list_images(calib_dir, num_calib)
+    if not paths:
+        raise ValueError(f"No calibration images found in {calib_dir}")
+
+    torch.backends.quantized.engine = backend
+    h, w = preprocessor.size
+    example = (torch.zeros(1, 3, h, w),)
+    prepared = prepare_fx(model.backbone.eval(), get_default_qconfig_mapping(backend), example)
+    with torch.inference_mode():
+        for x in _load_batches(paths, preprocessor, batch_size):
+            prepared(x)
+    model.backbone = convert_fx(prepared)
+    return model
+
+
+def build_quantized_model(
+    model: nn.Module,
+    mode: str,
+    preprocessor: TensorPreprocessor,
+    calib_dir: Optional[str] = None,
+    num_calib: int = 256,
+) -> nn.Module:
+    """Trả về bản sao đã quantize của model fp32 (model gốc không bị thay đổi)"""
+    if mode not in QUANT_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode} (expected one of {QUANT_MODES})")
+    qmodel = copy.deepcopy(model).cpu().eval()
+    if mode == "static":
+        if not calib_dir:
+            raise ValueError("Static quantization requires a calibration image folder")
+        qmodel = quantize_backbone_static(qmodel, calib_dir, preprocessor, num_calib)
+    return quantize_head_dynamic(qmodel)
+
+
+# ---------------------------------------------------------------------- #
+# Báo cáo độ lệch
+# ---------------------------------------------------------------------- #
+def _probs(model, x):
+    out = model(x)
+    return out if getattr(model, "apply_softmax", False) else F.softmax(out, dim=1)
+
+
+@torch.inference_mode()
+def drift_report(
+    ref_model: nn.Module,
+    model: nn.Module,
+    val_dir: str,
+    preprocessor: TensorPreprocessor,
+    idx_to_class: Dict[int, str],
+    batch_size: int = 16,
+    limit: Optional[int] = None,
+) -> Dict:
+    """
+    So sánh model (quantize / channels_last) với model fp32 trên cùng ảnh.
+    Nếu val_dir có dạng ImageFolder (thư mục con = tên lớp) thì tính thêm accuracy.
+    """
+    class_to_idx = {v: k for k, v in idx_to_class.items()}
+    paths = list_images(val_dir, limit)
+    if not paths:
+        raise ValueError(f"No validation images found in {val_dir}")
+
+    n = agree = ref_correct = correct = labeled = 0
+    sum_abs, max_abs = 0.0, 0.0
+    ref_time = time_ = 0.0
+    for i in range(0, len(paths), batch_size):
+        chunk = paths[i:i + batch_size]
+        images, labels = [], []
+        for p in chunk:
+            img = read_image(str(p))
+            if img is None:
+                continue
+            images.append(img)
+            labels.append(class_to_idx.get(p.parent.name, -1))
+        if not images:
+            continue
+        x = preprocessor.batch(images)
+
+        t0 = time.perf_counter()
+        p_ref = _probs(ref_model, x).float()
+        t1 = time.perf_counter()
+        p_q = _probs(model, x).float()
+        t2 = time.perf_counter()
+        ref_time += t1 - t0
+        time_ += t2 - t1
+
+        diff = (p_ref - p_q).abs()
+        sum_abs += diff.sum(dim=1).sum().item()
+        max_abs = max(max_abs, diff.max().item())
+        pred_ref, pred_q = p_ref.argmax(1), p_q.argmax(1)
+        agree += (pred_ref == pred_q).sum().item()
+        y = torch.tensor(labels)
+        mask = y >= 0
+        labeled += mask.sum().item()
+        ref_correct += (pred_ref[mask] == y[mask]).sum().item()
+        correct += (pred_q[mask] == y[mask]).sum().item()
+        n += len(images)
+
+    report = {
+        "images": n,
+        "top1_agreement": agree / n,
+        "mean_l1_prob_diff": sum_abs / n,
+        "max_abs_prob_diff": max_abs,
+        "fp32_ms_per_image": ref_time * 1000.0 / n,
+        "ms_per_image": time_ * 1000.0 / n,
+        "speedup": ref_time / time_ if time_ else 0.0,
+    }
+    if labeled:
+        report["labeled_images"] = labeled
+        report["fp32_accuracy"] = ref_correct / labeled
+        report["accuracy"] = correct / labeled
+    return report
+
+
+def main():
+    from app.ml.loader import load_model_cls, find_model_path
+
+    parser = argparse.ArgumentParser(description="Quantize classifier and report drift against fp32")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--mode", choices=["none", *QUANT_MODES], default="dynamic")
+    parser.add_argument("--calib-dir", default=None)
+    parser.add_argument("--num-calib", type=int, default=256)
+    parser.add_argument("--val-dir", required=True)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--out", default=None, help="ghi báo cáo ra file JSON")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or find_model_path()
+    model, idx_to_class = load_model_cls(checkpoint, torch.device("cpu"))
+    preprocessor = TensorPreprocessor.from_compose(model.transform)
+
+    candidate = model if args.mode == "none" else build_quantized_model(
+        model, args.mode, preprocessor, args.calib_dir, args.num_calib
+    )
+    if args.channels_last:
+        candidate = ChannelsLast(copy.deepcopy(candidate) if candidate is model else candidate)
+
+    report = drift_report(model, candidate, args.val_dir, preprocessor, idx_to_class, limit=args.limit)
+    report.update({"mode": args.mode, "channels_last": args.channels_last})
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
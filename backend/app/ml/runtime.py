@@ -0,0 +1,72 @@
+"""
+Các backend chạy forward cho InferenceEngine.
+
+Mỗi runtime là một callable nhận batch [N, 3, H, W] float32 và trả về xác suất
+[N, num_classes], kèm thông tin `idx_to_class`, `img_size`, `mean`, `std` lấy từ
+artifact do app.ml.export tạo ra.
+"""
+import json
+from typing import Dict
+
+import torch
+
+from app.ml.export import METADATA_FILE, INPUT_NAME
+from app.ml.preprocessing import TensorPreprocessor
+
+RUNTIMES = ("eager", "torchscript", "onnx")
+
+
+class _ArtifactRuntime:
+    apply_softmax = True
+
+    def __init__(self, meta: Dict):
+        self.meta = meta
+        self.idx_to_class = {int(k): v for k, v in meta["idx_to_class"].items()}
+        self.apply_softmax = meta.get("apply_softmax", True)
+        self.temperature = float(meta.get("temperature", 1.0))
+
+    def preprocessor(self) -> TensorPreprocessor:
+        return TensorPreprocessor(self.meta["img_size"], self.meta["mean"], self.meta["std"])
+
+
+class TorchScriptRuntime(_ArtifactRuntime):
+    def __init__(self, path: str, device: torch.device):
+        extra = {METADATA_FILE: ""}
+        module = torch.jit.load(path, map_location=device, _extra_files=extra)
+        super().__init__(json.loads(extra[METADATA_FILE]))
+        # freeze: gộp tham số thành hằng số; optimize_for_inference: fuse conv-bn, bỏ dropout...
+        self.module = torch.jit.optimize_for_inference(torch.jit.freeze(module.eval()))
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        return self.module(x)
+
+
+class OnnxRuntime(_ArtifactRuntime):
+    def __init__(self, path: str, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("INFER_RUNTIME=onnx requires the onnxruntime package") from e
+        with open(path + ".json", encoding="utf-8") as f:
+            super().__init__(json.load(f))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.session.run(None, {INPUT_NAME: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+
+def load_runtime(kind: str, path: str, device: torch.device, num_threads: int = 0):
+    """Nạp artifact đã export; `eager` không dùng hàm này mà dùng load_model_cls"""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if kind == "torchscript":
+        return TorchScriptRuntime(path, device)
+    if kind == "onnx":
+        return OnnxRuntime(path, num_threads)
+    raise ValueError(f"Unknown runtime: {kind} (expected one of {RUNTIMES})")
@@ -0,0 +1,123 @@
+"""
+Dựng model phục vụ theo cấu hình và nạp nền (background warm-up).
+
+`build_serving_model` gom các lựa chọn runtime / quantize / channels_last;
+`ModelLoader` chạy việc nạp + warm-up trên 1 thread riêng để server có thể
+nhận request (/health, /ready) ngay khi khởi động.
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import torch
+
+from app.ml.loader import load_model_cls, find_model_path, MODEL_CANDIDATE_PATHS
+from app.ml.runtime import load_runtime
+from app.ml.quantization import build_quantized_model, ChannelsLast
+from app.ml.preprocessing import TensorPreprocessor
+from app.ml.prediction_cache import file_fingerprint
+from app.ml.config import (
+    PREPROCESS_FOLD_NORMALIZE,
+    INFER_RUNTIME, INFER_RUNTIME_PATH, INFER_INTRA_OP_THREADS,
+    INFER_QUANTIZE, INFER_QUANT_CALIB_DIR, INFER_CHANNELS_LAST,
+)
+
+
+class ServingModel:
+    """Model sẵn sàng phục vụ cùng các thông tin đi kèm"""
+    def __init__(self, model, idx_to_class, preprocessor: TensorPreprocessor, device: torch.device, model_path: str):
+        self.model = model
+        # Nhiệt độ hiệu chỉnh xác suất (app.ml.calibration), đọc từ checkpoint / metadata artifact
+        self.temperature = float(getattr(model, "temperature", 1.0))
+        self.idx_to_class = idx_to_class
+        self.preprocessor = preprocessor
+        self.device = device
+        self.model_path = model_path
+        # Kết quả int8 khác fp32 nên chế độ quantize cũng nằm trong fingerprint
+        self.fingerprint = f"{file_fingerprint(model_path)}-{INFER_QUANTIZE or 'fp32'}"
+
+
+def build_serving_model(device: torch.device) -> ServingModel:
+    if INFER_INTRA_OP_THREADS > 0:
+        torch.set_num_threads(INFER_INTRA_OP_THREADS)
+
+    if INFER_RUNTIME != "eager":
+        # Phục vụ từ artifact TorchScript/ONNX, metadata đi kèm artifact
+        model = load_runtime(INFER_RUNTIME, INFER_RUNTIME_PATH, device, INFER_INTRA_OP_THREADS)
+        return ServingModel(model, model.idx_to_class, model.preprocessor(), device, INFER_RUNTIME_PATH)
+
+    model_path = find_model_path()
+    if model_path is None:
+        raise FileNotFoundError(f"Model file not found at any of the expected paths: {[str(p) for p in MODEL_CANDIDATE_PATHS]}")
+    model, idx_to_class = load_model_cls(model_path, device)
+
+    # Tiền xử lý trên tensor uint8, cùng size/mean/std với model.transform
+    preprocessor = TensorPreprocessor.from_compose(model.transform)
+    if PREPROCESS_FOLD_NORMALIZE:
+        preprocessor.fold_into(model)
+        # predict_proba cũng phải dùng đầu vào chưa chia std
+        model.transform = preprocessor
+
+    if INFER_QUANTIZE:
+        # Model int8 chỉ chạy trên CPU
+        device = torch.device("cpu")
+        model = build_quantized_model(model, INFER_QUANTIZE, preprocessor, INFER_QUANT_CALIB_DIR or None)
+    if INFER_CHANNELS_LAST:
+        model = ChannelsLast(model)
+    return ServingModel(model, idx_to_class, preprocessor, device, model_path)
+
+
+@torch.inference_mode()
+def warmup(serving: ServingModel, iters: int = 1):
+    """Chạy vài forward giả để khởi tạo kernel / bộ nhớ trước request đầu tiên"""
+    h, w = serving.preprocessor.size
+    x = torch.zeros(1, 3, h, w, device=serving.device)
+    for _ in range(iters):
+        serving.model(x)
+
+
+class ModelLoader:
+    """Chạy hàm nạp model (1 lần) ở nền và theo dõi trạng thái sẵn sàng"""
+    def __init__(self, load_fn: Callable[[], None]):
+        self._load_fn = load_fn
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        """Nạp ở nền, trả về ngay"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.load, name="model-loader", daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """Nạp đồng bộ (dùng khi không bật chế độ nạp nền)"""
+        self.started_at = time.monotonic()
+        try:
+            self._load_fn()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"Model loading failed: {self.error}")
+            raise
+        finally:
+            self.load_seconds = time.monotonic() - self.started_at
+        self._ready.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def status(self) -> Dict:
+        if self.ready:
+            state = "ready"
+        elif self.error:
+            state = "failed"
+        else:
+            state = "loading"
+        return {"status": state, "load_seconds": self.load_seconds, "error": self.error}
@@ -0,0 +1,165 @@
+"""
+Định dạng checkpoint dành cho phục vụ (*.serve.pt).
+
+Chỉ chứa trọng số + idx_to_class + thông số transform (kích thước ảnh, mean/std)
++ nhiệt độ hiệu chỉnh (temperature scaling, app.ml.calibration),
+không có optimizer/scheduler và không có object Python tuỳ ý, nên:
+- nạp được bằng `torch.load(weights_only=True)` (không unpickle code lạ);
+- nạp bằng `mmap=True`: tensor trỏ thẳng vào file, các worker uvicorn trên cùng
+  máy dùng chung trang nhớ qua page cache của OS thay vì mỗi process một bản.
+
+Chuyển từ checkpoint huấn luyện (training/checkpoint.py, EarlyStopping) hoặc best_model.pth:
+    python -m app.ml.serving_checkpoint ../training/checkpoints/skin2/best_skin.pth app/ml/model/best_model.serve.pt
+"""
+import argparse
+import runpy
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torchvision.transforms as transforms
+
+from app.ml.efficientnet_model import EfficientNetClassifier
+
+SERVING_FORMAT = "skin-lesion-serving-v1"
+SERVING_SUFFIX = ".serve.pt"
+
+# training/config.py: nguồn mean/std/IMG_SIZE cho checkpoint huấn luyện
+TRAINING_CONFIG = Path(__file__).resolve().parents[3] / "training" / "config.py"
+
+
+def save_serving_checkpoint(
+    path: str,
+    state_dict: Dict[str, torch.Tensor],
+    idx_to_class: Dict[int, str],
+    img_size: Sequence[int],
+    mean: Sequence[float],
+    std: Sequence[float],
+    embedding_dim: int = 256,
+    temperature: float = 1.0,
+):
+    torch.save(
+        {
+            "format": SERVING_FORMAT,
+            "arch": "efficientnet_b3",
+            "state_dict": {k: v.detach().cpu().contiguous() for k, v in state_dict.items()},
+            "idx_to_class": {int(k): str(v) for k, v in idx_to_class.items()},
+            "num_classes": len(idx_to_class),
+            "embedding_dim": int(embedding_dim),
+            "img_size": [int(img_size[0]), int(img_size[1])],
+            "mean": [float(m) for m in mean],
+            "std": [float(s) for s in std],
+            "temperature": float(temperature),
+        },
+        path,
+    )
+
+
+def load_serving_checkpoint(path: str, device):
+    """Giống load_model_cls: trả về (model đã eval, có model.transform, idx_to_class)"""
+    ckpt = torch.load(path, map_location=device, weights_only=True, mmap=True)
+    if ckpt.get("format") != SERVING_FORMAT:
+        raise ValueError(f"{path} is not a serving checkpoint ({SERVING_FORMAT})")
+
+    with torch.device("meta"):
+        model = EfficientNetClassifier(
+            num_classes=ckpt["num_classes"],
+            embedding_dim=ckpt["embedding_dim"],
+            pretrained=False,
+            apply_softmax=True,
+        )
+    # assign=True: tham số dùng luôn storage mmap của file, không copy
+    model.load_state_dict(ckpt["state_dict"], assign=True)
+    model.to(device)
+    model.transform = transforms.Compose([
+        transforms.Resize(tuple(ckpt["img_size"])),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=ckpt["mean"], std=ckpt["std"]),
+    ])
+    model.temperature = float(ckpt.get("temperature", 1.0))
+    model.eval()
+    return model, ckpt["idx_to_class"]
+
+
+def _strip_prefixes(state_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    # "module." (DistributedDataParallel) và "_orig_mod." (torch.compile)
+    out = {}
+    for k, v in state_dict.items():
+        for prefix in ("module.", "_orig_mod."):
+            if k.startswith(prefix):
+                k = k[len(prefix):]
+        out[k] = v
+    return out
+
+
+def read_checkpoint(
+    ckpt: Dict,
+    src: str = "checkpoint",
+    img_size: Optional[List[int]] = None,
+    mean: Optional[List[float]] = None,
+    std: Optional[List[float]] = None,
+) -> Tuple[Dict[str, torch.Tensor], Dict[int, str], Dict]:
+    """
+    Tách (state_dict, idx_to_class, meta) từ checkpoint huấn luyện ("model_state") hoặc
+    best_model.pth ("model_state_dict"); state_dict đã bỏ tiền tố module. / _orig_mod.
+    Thông số transform lấy theo thứ tự: tham số truyền vào, hparams trong checkpoint,
+    training/config.py (checkpoint huấn luyện) hoặc transform mặc định của loader (best_model.pth).
+    """
+    if "model_state" in ckpt:
+        state_dict = ckpt["model_state"]
+        defaults = runpy.run_path(str(TRAINING_CONFIG))
+        default_size = [defaults["IMG_SIZE"], defaults["IMG_SIZE"]]
+        default_mean, default_std = defaults["NORM_MEAN"], defaults["NORM_STD"]
+    elif "model_state_dict" in ckpt:
+        from app.ml.loader import SERVING_IMG_SIZE, SERVING_MEAN, SERVING_STD
+        state_dict = ckpt["model_state_dict"]
+        default_size, default_mean, default_std = list(SERVING_IMG_SIZE), SERVING_MEAN, SERVING_STD
+    else:
+        raise KeyError(f"{src} has neither 'model_state' nor 'model_state_dict'")
+
+    idx_to_class = ckpt.get("idx_to_class")
+    if not idx_to_class:
+        raise KeyError(f"{src} has no idx_to_class")
+    hparams = ckpt.get("hparams") or {}
+
+    meta = {
+        "img_size": img_size or hparams.get("img_size") or default_size,
+        "mean": mean or hparams.get("norm_mean") or default_mean,
+        "std": std or hparams.get("norm_std") or default_std,
+        "embedding_dim": hparams.get("embedding_dim", 256),
+        "temperature": ckpt.get("temperature", 1.0),
+    }
+    if isinstance(meta["img_size"], int):
+        meta["img_size"] = [meta["img_size"], meta["img_size"]]
+    return _strip_prefixes(state_dict), idx_to_class, meta
+
+
+def convert_checkpoint(
+    src: str,
+    dst: str,
+    img_size: Optional[List[int]] = None,
+    mean: Optional[List[float]] = None,
+    std: Optional[List[float]] = None,
+) -> Dict:
+    """Đọc checkpoint huấn luyện hoặc best_model.pth (xem read_checkpoint) và ghi ra định dạng phục vụ"""
+    ckpt = torch.load(src, map_location="cpu", weights_only=False)
+    state_dict, idx_to_class, meta = read_checkpoint(ckpt, src, img_size, mean, std)
+    save_serving_checkpoint(dst, state_dict, idx_to_class, **meta)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a training checkpoint to the serving format")
+    parser.add_argument("src")
+    parser.add_argument("dst", help=f"file đích, nên có đuôi {SERVING_SUFFIX}")
+    parser.add_argument("--img-size", type=int, nargs=2, default=None)
+    parser.add_argument("--mean", type=float, nargs=3, default=None)
+    parser.add_argument("--std", type=float, nargs=3, default=None)
+    args = parser.parse_args()
+
+    meta = convert_checkpoint(args.src, args.dst, args.img_size, args.mean, args.std)
+    print(f"Saved {args.dst}: img_size={meta['img_size']} mean={meta['mean']} std={meta['std']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Chỉ mục láng giềng gần nhất (cosine) cho embedding của các ca đã phân loại.
+
+- Vector được chuẩn hoá L2 và lưu trong 1 ma trận liên tục float32 hoặc float16
+  (float16: 512 byte / ca với embedding 256 chiều). Tìm kiếm = 1 phép nhân ma trận
+  theo từng khối cho cả batch truy vấn, rồi argpartition lấy top-k.
+- Product quantization (tuỳ chọn): mỗi vector được mã hoá thành `m` byte; truy vấn
+  quét mã bằng bảng tra (ADC) rồi xếp hạng lại các ứng viên tốt nhất bằng vector gốc.
+- Snapshot ra thư mục các file .npy; khi nạp lại, ma trận được mở bằng mmap (chỉ đọc),
+  các ca mới được thêm vào 1 đoạn đuôi trong RAM.
+
+Nhiều worker (serve.py): mỗi process giữ 1 index riêng trong bộ nhớ, chỉ gồm các ca do
+chính worker đó phân loại cộng với các ca đã có trong snapshot. Các worker dùng chung 1 thư
+mục snapshot: ghi dưới khoá file (fcntl.flock, 1 writer tại 1 thời điểm), trước khi ghi thì
+gộp các ca worker khác đã ghi vào index của mình, nên snapshot luôn là hợp của mọi worker và
+các file trong đó khớp nhau. refresh() gộp snapshot mới nhất khi cần (vd. /similar/{id} không
+thấy ca); ca mà worker phân loại nó chưa ghi snapshot thì các worker khác chưa thấy.
+"""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: không có khoá file, chỉ an toàn khi 1 process ghi snapshot
+    fcntl = None
+
+SNAPSHOT_VERSION = 1
+LOCK_FILE = ".lock"
+# Số dòng mỗi khối khi nhân ma trận (giới hạn bộ nhớ tạm khi lưu float16)
+SEARCH_CHUNK_ROWS = 65536
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+@contextmanager
+def _snapshot_lock(root: Path, exclusive: bool):
+    """Khoá thư mục snapshot giữa các process: ghi dùng khoá độc quyền, đọc dùng khoá chia sẻ"""
+    if fcntl is None:
+        yield
+        return
+    with open(root / LOCK_FILE, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_info(root: Path) -> Optional[Dict]:
+    info_path = root / "index.json"
+    if not info_path.exists():
+        return None
+    info = json.loads(info_path.read_text(encoding="utf-8"))
+    return info if info.get("version") == SNAPSHOT_VERSION else None
+
+
+class ProductQuantizer:
+    """Chia vector thành m đoạn, mỗi đoạn lượng tử hoá bằng k-means 256 tâm (1 byte)"""
+    def __init__(self, dim: int, m: int, ksub: int = 256):
+        if dim % m:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by {m} subspaces")
+        self.dim = dim
+        self.m = m
+        self.ksub = ksub
+        self.dsub = dim // m
+        self.codebooks: Optional[np.ndarray] = None    # [m, ksub, dsub]
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, x: np.ndarray, iters: int = 15, seed: int = 0, max_samples: int = 20000):
+        rng = np.random.default_rng(seed)
+        x = np.asarray(x, dtype=np.float32)
+        if len(x) > max_samples:
+            x = x[rng.choice(len(x), max_samples, replace=False)]
+        k = min(self.ksub, len(x))
+        codebooks = np.zeros((self.m, self.ksub, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            sub = x[:, j * self.dsub:(j + 1) * self.dsub]
+            centroids = sub[rng.choice(len(sub), k, replace=False)].copy()
+            for _ in range(iters):
+                assign = self._nearest(sub, centroids)
+                counts = np.bincount(assign, minlength=k)[:, None]
+                sums = np.stack([np.bincount(assign, weights=sub[:, d], minlength=k) for d in range(self.dsub)], axis=1)
+                # Tâm rỗng giữ nguyên vị trí cũ
+                centroids = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+            codebooks[j, :k] = centroids
+            if k < self.ksub:
+                codebooks[j, k:] = centroids[0]
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, bỏ ||x||^2 vì không đổi theo c
+        d = (centroids * centroids).sum(1)[None, :] - 2.0 * (x @ centroids.T)
+        return d.argmin(1)
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = self._nearest(x[:, j * self.dsub:(j + 1) * self.dsub], self.codebooks[j])
+        return codes
+
+    def lookup_tables(self, q: np.ndarray) -> np.ndarray:
+        """Tích vô hướng từng đoạn của truy vấn với các tâm: [nq, m, ksub]"""
+        q = q.reshape(len(q), self.m, self.dsub)
+        return np.einsum("qmd,mkd->qmk", q, self.codebooks)
+
+    def scores(self, lut: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Điểm xấp xỉ của 1 truy vấn (lut [m, ksub]) với các mã [n, m]"""
+        return lut[np.arange(self.m)[None, :], codes].sum(axis=1)
+
+
+class SimilarityIndex:
+    """
+    add(key, vector, meta): thêm 1 ca (bỏ qua nếu key đã có, vd. cùng hash ảnh).
+    search(queries, k): top-k ca gần nhất theo cosine cho mỗi truy vấn.
+    """
+    def __init__(
+        self,
+        dim: int,
+        dtype: str = "float32",
+        fingerprint: str = "",
+        pq_subspaces: int = 0,
+        pq_train_size: int = 20000,
+        rerank: int = 32,
+    ):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.fingerprint = fingerprint
+        self.pq = ProductQuantizer(dim, pq_subspaces) if pq_subspaces else None
+        self.pq_train_size = pq_train_size
+        self.rerank = rerank
+
+        # RLock: train_pq đọc lại vector (cần lock) trong lúc đang giữ lock
+        self._lock = threading.RLock()
+        # Đoạn gốc (có thể là mmap từ snapshot, chỉ đọc) + đoạn đuôi trong RAM, tăng gấp đôi khi đầy
+        self._base = np.empty((0, dim), dtype=self.dtype)
+        self._tail = np.empty((1024, dim), dtype=self.dtype)
+        self._tail_n = 0
+        self._codes = np.empty((1024, pq_subspaces), dtype=np.uint8)
+        self._codes_n = 0
+        self._meta: List[Dict] = []
+        self._rows: Dict[str, int] = {}
+        self._training: Optional[threading.Thread] = None
+        self._snapshot_mtime: Optional[int] = None
+        self.added_since_snapshot = 0
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    # ------------------------------------------------------------------ #
+    # Thêm
+    # ------------------------------------------------------------------ #
+    def add(self, key: str, vector: Sequence[float], meta: Optional[Dict] = None) -> bool:
+        return self._add(key, vector, meta)
+
+    def _add(self, key: str, vector: Sequence[float], meta: Optional[Dict] = None, count: bool = True) -> bool:
+        """count=False: ca đã có trong snapshot (gộp từ worker khác), không tính là chưa lưu"""
+        v = _normalize(np.asarray(vector, dtype=np.float32).reshape(1, self.dim))
+        with self._lock:
+            if key in self._rows:
+                return False
+            if self._tail_n == len(self._tail):
+                grown = np.empty((2 * len(self._tail), self.dim), dtype=self.dtype)
+                grown[:self._tail_n] = self._tail[:self._tail_n]
+                self._tail = grown
+            self._tail[self._tail_n] = v[0]
+            self._tail_n += 1
+            self._rows[key] = len(self._meta)
+            self._meta.append({"key": key, **(meta or {})})
+            if count:
+                self.added_since_snapshot += 1
+            if self.pq is not None and self.pq.trained:
+                self._append_codes(self.pq.encode(v))
+            if (self.pq is not None and not self.pq.trained and self._training is None
+                    and len(self._meta) >= self.pq_train_size):
+                # Huấn luyện codebook ở nền; trong lúc đó vẫn tìm kiếm chính xác trên ma trận vector
+                self._training = threading.Thread(target=self.train_pq, name="pq-train", daemon=True)
+                self._training.start()
+        return True
+
+    def _append_codes(self, codes: np.ndarray):
+        if self._codes_n + len(codes) > len(self._codes):
+            grown = np.empty((max(2 * len(self._codes), self._codes_n + len(codes)), codes.shape[1]), dtype=np.uint8)
+            grown[:self._codes_n] = self._codes[:self._codes_n]
+            self._codes = grown
+        self._codes[self._codes_n:self._codes_n + len(codes)] = codes
+        self._codes_n += len(codes)
+
+    def train_pq(self):
+        """Huấn luyện codebook trên toàn bộ vector hiện có rồi mã hoá lại"""
+        if self.pq is None:
+            raise ValueError("Index was created without product quantization")
+        vectors = self._matrix_rows(np.arange(len(self)))
+        pq = ProductQuantizer(self.dim, self.pq.m, self.pq.ksub)
+        pq.train(vectors)
+        codes = pq.encode(vectors)
+        with self._lock:
+            # Các ca thêm trong lúc huấn luyện
+            extra = len(self._meta) - len(codes)
+            if extra:
+                codes = np.concatenate([codes, pq.encode(self._matrix_rows(np.arange(len(codes), len(self._meta))))])
+            self.pq, self._codes_n = pq, 0
+            self._append_codes(codes)
+
+    # ------------------------------------------------------------------ #
+    # Tìm kiếm
+    # ------------------------------------------------------------------ #
+    def _segments(self):
+        with self._lock:
+            return self._base, self._tail[:self._tail_n], self._codes[:self._codes_n], list(self._meta)
+
+    def _matrix_rows(self, rows: np.ndarray) -> np.ndarray:
+        base, tail, _, _ = self._segments()
+        rows = np.asarray(rows)
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        in_base = rows < len(base)
+        out[in_base] = base[rows[in_base]]
+        out[~in_base] = tail[rows[~in_base] - len(base)]
+        return out
+
+    def vector(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        return None if row is None else self._matrix_rows(np.array([row]))[0]
+
+    @staticmethod
+    def _dot(matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """[n, d] (float16/32) x [d, nq] → [n, nq] float32, theo từng khối"""
+        out = np.empty((len(matrix), q.shape[1]), dtype=np.float32)
+        for start in range(0, len(matrix), SEARCH_CHUNK_ROWS):
+            block = matrix[start:start + SEARCH_CHUNK_ROWS]
+            out[start:start + len(block)] = block.astype(np.float32, copy=False) @ q
+        return out
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Chỉ số top-k theo điểm giảm dần cho mỗi cột"""
+        k = min(k, len(scores))
+        idx = np.argpartition(-scores, k - 1, axis=0)[:k]
+        order = np.take_along_axis(scores, idx, axis=0).argsort(axis=0)[::-1]
+        return np.take_along_axis(idx, order, axis=0)
+
+    def search(self, queries: np.ndarray, k: int = 10, exclude: Optional[Sequence[str]] = None) -> List[List[Dict]]:
+        """
+        queries: [nq, dim] (hoặc [dim]). Trả về với mỗi truy vấn danh sách
+        {"score": cosine, **meta} theo thứ tự giảm dần.
+        """
+        q = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        base, tail, codes, meta = self._segments()
+        n = len(base) + len(tail)
+        if n == 0:
+            return [[] for _ in range(len(q))]
+        excluded = set(exclude or ())
+        fetch = k + len(excluded)
+
+        if self.pq is not None and self.pq.trained and len(codes) == n:
+            # Quét mã PQ, rồi xếp hạng lại bằng vector gốc
+            candidates = []
+            for lut in self.pq.lookup_tables(q):
+                approx = self.pq.scores(lut, codes)
+                candidates.append(self._top_k(approx[:, None], max(fetch * self.rerank, 256))[:, 0])
+            results = []
+            for qi, rows in enumerate(candidates):
+                exact = self._matrix_rows(rows) @ q[qi]
+                order = rows[np.argsort(-exact)]
+                results.append(self._format(order, dict(zip(rows.tolist(), exact.tolist())), meta, excluded, k))
+            return results
+
+        scores = np.concatenate([self._dot(base, q.T), self._dot(tail, q.T)])
+        top = self._top_k(scores, fetch)
+        return [
+            self._format(top[:, qi], {int(r): float(scores[r, qi]) for r in top[:, qi]}, meta, excluded, k)
+            for qi in range(len(q))
+        ]
+
+    @staticmethod
+    def _format(rows, scores: Dict[int, float], meta: List[Dict], excluded, k: int) -> List[Dict]:
+        out = []
+        for row in rows:
+            row = int(row)
+            if meta[row]["key"] in excluded:
+                continue
+            out.append({"score": scores[row], **meta[row]})
+            if len(out) >= k:
+                break
+        return out
+
+    # ------------------------------------------------------------------ #
+    # Snapshot
+    # ------------------------------------------------------------------ #
+    def save(self, path: str):
+        """
+        Ghi snapshot dưới khoá độc quyền: gộp các ca trong snapshot hiện có (do worker
+        khác ghi) vào index, rồi ghi từng file ra file tạm tên duy nhất và rename;
+        index.json ghi cuối cùng.
+        """
+        root = Path(path)
+        root.mkdir(parents=True, exist_ok=True)
+        with _snapshot_lock(root, exclusive=True):
+            self._merge_snapshot(root)
+            with self._lock:
+                pending = self.added_since_snapshot
+            base, tail, codes, meta = self._segments()
+
+            def write(name: str, fn):
+                fd, tmp = tempfile.mkstemp(prefix=name + ".", suffix=".part", dir=root)
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        fn(f)
+                    os.replace(tmp, root / name)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+
+            write("vectors.npy", lambda f: np.save(f, np.concatenate([base, tail]).astype(self.dtype, copy=False)))
+            write("meta.jsonl", lambda f: f.writelines((json.dumps(m, ensure_ascii=False) + "\n").encode() for m in meta))
+            pq_trained = self.pq is not None and self.pq.trained and len(codes) == len(meta)
+            if pq_trained:
+                write("pq_codebooks.npy", lambda f: np.save(f, self.pq.codebooks))
+                write("pq_codes.npy", lambda f: np.save(f, codes))
+            info = {
+                "version": SNAPSHOT_VERSION,
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+                "count": len(meta),
+                "fingerprint": self.fingerprint,
+                "pq_subspaces": self.pq.m if self.pq is not None else 0,
+                "pq_trained": pq_trained,
+            }
+            write("index.json", lambda f: f.write(json.dumps(info, indent=2).encode()))
+            self._snapshot_mtime = (root / "index.json").stat().st_mtime_ns
+        with self._lock:
+            self.added_since_snapshot -= pending
+
+    def refresh(self, path: str) -> int:
+        """Gộp các ca worker khác đã ghi vào snapshot (bỏ qua nếu snapshot không đổi từ lần đọc trước)"""
+        root = Path(path)
+        info_path = root / "index.json"
+        if not info_path.exists() or info_path.stat().st_mtime_ns == self._snapshot_mtime:
+            return 0
+        with _snapshot_lock(root, exclusive=False):
+            return self._merge_snapshot(root)
+
+    def _merge_snapshot(self, root: Path) -> int:
+        """Thêm các ca có trong snapshot mà index chưa có (gọi khi đang giữ khoá); trả về số ca thêm"""
+        info_path = root / "index.json"
+        self._snapshot_mtime = info_path.stat().st_mtime_ns if info_path.exists() else None
+        info = _read_info(root)
+        if info is None or info["dim"] != self.dim or info.get("fingerprint") != self.fingerprint:
+            return 0
+        count = info["count"]
+        vectors = np.load(root / "vectors.npy", mmap_mode="r")
+        added = 0
+        with open(root / "meta.jsonl", encoding="utf-8") as f:
+            for i, line in zip(range(count), f):
+                meta = json.loads(line)
+                key = meta.pop("key")
+                if key not in self._rows:
+                    added += self._add(key, vectors[i], meta, count=False)
+        return added
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str = "", **kwargs) -> Optional["SimilarityIndex"]:
+        """
+        Mở snapshot, ma trận vector được mmap. Trả về None nếu không có snapshot hoặc
+        snapshot thuộc checkpoint khác (embedding không còn so sánh được).
+        """
+        root = Path(path)
+        if not (root / "index.json").exists():
+            return None
+        # Khoá chia sẻ: không đọc lẫn file của 2 lần ghi; file bị thay bằng rename nên mmap vẫn hợp lệ sau khi nhả khoá
+        with _snapshot_lock(root, exclusive=False):
+            mtime = (root / "index.json").stat().st_mtime_ns
+            info = _read_info(root)
+            if info is None or (fingerprint and info.get("fingerprint") != fingerprint):
+                return None
+            kwargs.setdefault("pq_subspaces", info["pq_subspaces"])
+            # Kiểu dữ liệu do snapshot quyết định
+            kwargs.pop("dtype", None)
+            index = cls(info["dim"], dtype=info["dtype"], fingerprint=info["fingerprint"], **kwargs)
+
+            count = info["count"]
+            index._base = np.load(root / "vectors.npy", mmap_mode="r")[:count]
+            with open(root / "meta.jsonl", encoding="utf-8") as f:
+                index._meta = [json.loads(line) for _, line in zip(range(count), f)]
+            index._rows = {m["key"]: i for i, m in enumerate(index._meta)}
+            if info.get("pq_trained") and index.pq is not None and index.pq.m == info["pq_subspaces"]:
+                index.pq.codebooks = np.load(root / "pq_codebooks.npy")
+                index._codes_n = 0
+                index._append_codes(np.load(root / "pq_codes.npy")[:count])
+        index._snapshot_mtime = mtime
+        index.added_since_snapshot = 0
+        return index
+
+    def stats(self) -> Dict:
+        base, tail, codes, _ = self._segments()
+        return {
+            "entries": len(self),
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "mmap_rows": len(base),
+            "memory_rows": len(tail),
+            "pq_subspaces": self.pq.m if self.pq is not None else 0,
+            "pq_trained": bool(self.pq is not None and self.pq.trained),
+            "added_since_snapshot": self.added_since_snapshot,
+        }
+
+
+def open_index(path: str, dim: int, fingerprint: str, **kwargs) -> SimilarityIndex:
+    """Nạp snapshot nếu có và khớp checkpoint, ngược lại tạo index rỗng"""
+    index = SimilarityIndex.load(path, fingerprint, **kwargs) if path else None
+    if index is None:
+        index = SimilarityIndex(dim, fingerprint=fingerprint, **kwargs)
+    return index
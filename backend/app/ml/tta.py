@@ -0,0 +1,49 @@
+"""
+Test-time augmentation (TTA) cho /predict.
+
+Các view dùng đúng các phép biến đổi hình học của pipeline huấn luyện
+(training/train.py, build_loaders: RandomHorizontalFlip + RandomRotation(10)):
+ảnh gốc, lật ngang, xoay ±10°, lật ngang + xoay ±10°. TTA-k dùng k view đầu tiên.
+
+Các view được tạo từ tensor đã tiền xử lý thành 1 batch [k, C, H, W] để chạy
+1 lần forward; xác suất của các view được lấy trung bình.
+"""
+from typing import List, Tuple
+
+import torch
+import torchvision.transforms.functional as TF
+from torchvision.transforms import InterpolationMode
+
+from app.ml.preprocessing import TensorPreprocessor
+
+ROTATION_DEGREES = 10.0
+
+# (lật ngang, góc xoay)
+TTA_VIEWS: List[Tuple[bool, float]] = [
+    (False, 0.0),
+    (True, 0.0),
+    (False, ROTATION_DEGREES),
+    (False, -ROTATION_DEGREES),
+    (True, ROTATION_DEGREES),
+    (True, -ROTATION_DEGREES),
+]
+MAX_TTA_VIEWS = len(TTA_VIEWS)
+
+
+def augment_views(x: torch.Tensor, k: int, preprocessor: TensorPreprocessor) -> torch.Tensor:
+    """
+    x: tensor [C, H, W] đã qua preprocessor → batch [k, C, H, W].
+    Vùng trống sau khi xoay được tô bằng giá trị của pixel đen sau normalize
+    (giống RandomRotation trên ảnh PIL lúc huấn luyện).
+    """
+    if not 1 <= k <= MAX_TTA_VIEWS:
+        raise ValueError(f"TTA views must be between 1 and {MAX_TTA_VIEWS}")
+    fill = preprocessor.shift.flatten().tolist()
+    flipped = TF.hflip(x) if any(flip for flip, _ in TTA_VIEWS[:k]) else None
+    views = []
+    for flip, angle in TTA_VIEWS[:k]:
+        view = flipped if flip else x
+        if angle:
+            view = TF.rotate(view, angle, interpolation=InterpolationMode.NEAREST, fill=fill)
+        views.append(view)
+    return torch.stack(views)
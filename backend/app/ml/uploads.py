@@ -0,0 +1,120 @@
+"""
+Đọc file upload theo từng chunk.
+
+Thay cho `await file.read()` (nạp toàn bộ file vào bộ nhớ trước khi kiểm tra):
+- từ chối sớm theo kích thước khai báo và theo magic bytes của chunk đầu,
+  không tin `content_type` do client gửi;
+- dừng ngay khi vượt `max_bytes`, nên RAM mỗi request bị chặn trên;
+- hash nội dung (cùng hàm với content_hash của cache) được tính dần trong lúc đọc.
+"""
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+from app.ml.image_io import sniff_image_type, IMAGE_SIGNATURE_LEN
+
+
+class UploadTooLargeError(ValueError):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class UnsupportedImageError(ValueError):
+    def __init__(self):
+        super().__init__("File must be an image")
+
+
+class StreamedUpload:
+    """Nội dung upload đã đọc xong cùng hash và định dạng nhận dạng được"""
+    def __init__(self, data: bytearray, digest: str, image_type: Optional[str]):
+        self.data = data
+        self.digest = digest
+        self.image_type = image_type
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+async def _chunks(file, max_bytes: int, chunk_size: int, require_image: bool):
+    """
+    Sinh (chunk, image_type) từ UploadFile. image_type được xác định từ các byte đầu
+    (None nếu không phải ảnh và require_image=False).
+    """
+    declared = getattr(file, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+
+    total = 0
+    head = b""
+    image_type = None
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLargeError(max_bytes)
+        if len(head) < IMAGE_SIGNATURE_LEN:
+            head += chunk[:IMAGE_SIGNATURE_LEN - len(head)]
+            image_type = sniff_image_type(head)
+            if require_image and image_type is None and len(head) >= IMAGE_SIGNATURE_LEN:
+                raise UnsupportedImageError()
+        yield chunk, image_type
+
+    if require_image and image_type is None:
+        # File ngắn hơn IMAGE_SIGNATURE_LEN byte và không khớp chữ ký nào
+        raise UnsupportedImageError()
+
+
+async def read_upload(file, max_bytes: int, chunk_size: int = 1 << 20, require_image: bool = True) -> StreamedUpload:
+    """Đọc upload vào 1 buffer (để giải mã trong bộ nhớ), kiểm tra kích thước + magic bytes"""
+    h = hashlib.blake2b(digest_size=16)
+    data = bytearray()
+    image_type = None
+    async for chunk, image_type in _chunks(file, max_bytes, chunk_size, require_image):
+        h.update(chunk)
+        data += chunk
+    return StreamedUpload(data, h.hexdigest(), image_type)
+
+
+def _open_for_write(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "wb")
+
+
+def _commit_file(f, tmp_path: Path, path: Path):
+    f.close()
+    os.replace(tmp_path, path)
+
+
+async def stream_upload_to(
+    file,
+    path: Union[str, Path],
+    max_bytes: int,
+    chunk_size: int = 1 << 20,
+) -> StreamedUpload:
+    """
+    Ghi upload thẳng ra đĩa theo từng chunk (không giữ cả file trong RAM) vào file tạm
+    rồi rename; file dở dang bị xoá khi upload bị từ chối. `data` của kết quả để trống.
+    Mở / ghi / rename chạy trên thread pool, không chặn event loop.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".part")
+    h = hashlib.blake2b(digest_size=16)
+    image_type = None
+    f = await asyncio.to_thread(_open_for_write, tmp_path)
+    try:
+        async for chunk, image_type in _chunks(file, max_bytes, chunk_size, require_image=True):
+            h.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+        await asyncio.to_thread(_commit_file, f, tmp_path, path)
+    except BaseException:
+        # Dọn dẹp đồng bộ: await ở đây có thể bị huỷ tiếp (CancelledError) và bỏ lại file tạm
+        f.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return StreamedUpload(bytearray(), h.hexdigest(), image_type)
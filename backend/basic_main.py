@@ -1,3 +1,4 @@
+import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -25,6 +26,7 @@ app.add_middleware(
 app.include_router(ml_router, prefix="/api/v1/ml", tags=["machine learning"])
 
 # Mount thư mục uploads để phục vụ file tĩnh
+os.makedirs("./uploads", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="./uploads"), name="uploads")
 
 @app.get("/")
@@ -0,0 +1,75 @@
+"""
+So sánh độ trễ p50/p99 giữa eager, TorchScript và ONNX Runtime trên CPU.
+
+Chạy trong thư mục backend:
+    python benchmarks/bench_runtime.py --checkpoint app/ml/model/best_model.pth --iters 50 --batch-sizes 1 8
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ml.loader import load_model_cls, find_model_path
+from app.ml.export import export_torchscript, export_onnx
+from app.ml.runtime import load_runtime
+
+
+def measure(fn, x, iters: int, warmup: int = 3):
+    with torch.inference_mode():
+        for _ in range(warmup):
+            fn(x)
+        times = []
+        for _ in range(iters):
+            t0 = time.perf_counter()
+            fn(x)
+            times.append((time.perf_counter() - t0) * 1000.0)
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--threads", type=int, default=0, help="số intra-op threads (0: mặc định)")
+    parser.add_argument("--runtimes", nargs="+", default=["eager", "torchscript", "onnx"])
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    checkpoint = args.checkpoint or find_model_path()
+    model, idx_to_class = load_model_cls(checkpoint, device)
+
+    runners = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in args.runtimes:
+            if kind == "eager":
+                runners[kind] = model
+            elif kind == "torchscript":
+                path = export_torchscript(model, idx_to_class, str(Path(tmp) / "model.ts"))
+                runners[kind] = load_runtime(kind, path, device, args.threads)
+            elif kind == "onnx":
+                path = export_onnx(model, idx_to_class, str(Path(tmp) / "model.onnx"))
+                runners[kind] = load_runtime(kind, path, device, args.threads)
+
+        print(f"threads={torch.get_num_threads()} iters={args.iters}")
+        print(f"{'runtime':<12} {'batch':>5} {'p50 ms':>9} {'p99 ms':>9} {'img/s':>8}")
+        for bs in args.batch_sizes:
+            x = torch.randn(bs, 3, 300, 300)
+            base = None
+            for kind, fn in runners.items():
+                p50, p99 = measure(fn, x, args.iters)
+                base = base or p50
+                print(f"{kind:<12} {bs:>5} {p50:>9.2f} {p99:>9.2f} {bs * 1000.0 / p50:>8.1f}  (x{base / p50:.2f})")
+
+
+if __name__ == "__main__":
+    main()
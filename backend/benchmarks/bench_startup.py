@@ -0,0 +1,82 @@
+"""
+Đo thời gian khởi động server và thời gian nạp model.
+
+- import_s: thời gian import basic_main (server bắt đầu phục vụ được /health)
+- ready_s : thời gian tới khi model nạp + warm-up xong (/api/v1/ml/ready trả 200)
+- load_model_cls: so sánh cách nạp cũ (torch.load đầy đủ + khởi tạo ngẫu nhiên + load_state_dict)
+  với cách hiện tại (mmap + meta device + assign)
+
+Mỗi phép đo chạy trong 1 process mới. Chạy trong thư mục backend:
+    python benchmarks/bench_startup.py --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+SERVER_CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import basic_main
+from app.api.v1.endpoints import ml
+t_import = time.perf_counter() - t0
+ml.model_loader.wait()
+print(json.dumps({"import_s": t_import, "ready_s": time.perf_counter() - t0}))
+"""
+
+LOADER_CHILD = r"""
+import json, sys, time, torch
+from app.ml.loader import load_model_cls, find_model_path
+from app.ml.efficientnet_model import EfficientNetClassifier
+path = find_model_path()
+device = torch.device("cpu")
+t0 = time.perf_counter()
+if sys.argv[1] == "legacy":
+    ckpt = torch.load(path, map_location=device, weights_only=False)
+    model = EfficientNetClassifier(num_classes=len(ckpt["idx_to_class"]), pretrained=False, apply_softmax=True)
+    model.load_state_dict(ckpt["model_state_dict"])
+    model.eval()
+else:
+    load_model_cls(path, device)
+print(json.dumps({"load_s": time.perf_counter() - t0}))
+"""
+
+
+def run_child(code: str, args=(), env=None):
+    out = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=BACKEND_DIR, env={**os.environ, **(env or {})},
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(name, runs, key):
+    values = [r[key] for r in runs]
+    print(f"{name:<32} {key:<9} median={np.median(values):.3f}s  min={min(values):.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for background in ("0", "1"):
+        runs = [run_child(SERVER_CHILD, env={"MODEL_BACKGROUND_LOAD": background}) for _ in range(args.repeat)]
+        name = f"server MODEL_BACKGROUND_LOAD={background}"
+        summarize(name, runs, "import_s")
+        summarize(name, runs, "ready_s")
+
+    for mode in ("legacy", "current"):
+        runs = [run_child(LOADER_CHILD, args=(mode,)) for _ in range(args.repeat)]
+        summarize(f"load_model_cls ({mode})", runs, "load_s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Chi phí độ trễ của TTA-k so với k=1 (1 ảnh, CPU).
+
+- batched   : tạo k view thành 1 batch và chạy 1 lần forward (cách /predict?tta=k dùng)
+- sequential: gọi model k lần, mỗi lần 1 view (như gọi predict_proba lặp lại)
+
+Thời gian đo gồm cả bước tạo view (lật / xoay) từ tensor đã tiền xử lý.
+
+Chạy trong thư mục backend:
+    python benchmarks/bench_tta.py --iters 20 --views 1 2 4 6
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# Thêm thư mục backend vào path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.ml.loader import load_model_cls, find_model_path
+from app.ml.preprocessing import TensorPreprocessor
+from app.ml.tta import augment_views, MAX_TTA_VIEWS
+
+
+def measure(fn, iters: int, warmup: int = 2):
+    with torch.inference_mode():
+        for _ in range(warmup):
+            fn()
+        times = []
+        for _ in range(iters):
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000.0)
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--views", type=int, nargs="+", default=[1, 2, 4, MAX_TTA_VIEWS])
+    parser.add_argument("--threads", type=int, default=0, help="số intra-op threads (0: mặc định)")
+    parser.add_argument("--sequential", action="store_true", help="đo thêm cách chạy k lần forward")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    model, _ = load_model_cls(args.checkpoint or find_model_path(), torch.device("cpu"))
+    preprocessor = TensorPreprocessor.from_compose(model.transform)
+
+    rng = np.random.default_rng(0)
+    x = preprocessor(rng.integers(0, 256, size=(450, 600, 3), dtype=np.uint8))
+
+    print(f"threads={torch.get_num_threads()} iters={args.iters}")
+    print(f"{'mode':<11} {'k':>3} {'p50 ms':>9} {'p99 ms':>9} {'vs k=1':>7}")
+    base = None
+    for k in args.views:
+        modes = {"batched": lambda: model(augment_views(x, k, preprocessor))}
+        if args.sequential and k > 1:
+            modes["sequential"] = lambda: [model(v.unsqueeze(0)) for v in augment_views(x, k, preprocessor)]
+        for name, fn in modes.items():
+            p50, p99 = measure(fn, args.iters)
+            base = base or p50
+            print(f"{name:<11} {k:>3} {p50:>9.2f} {p99:>9.2f} {p50 / base:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+So sánh throughput / độ trễ của serve.py với 1, 2, 4, 8 worker.
+
+Mỗi cấu hình khởi động serve.py trong 1 process mới, chờ mọi worker sẵn sàng rồi gửi
+/predict đồng thời với các ảnh ngẫu nhiên khác nhau (tắt cache dự đoán để mọi request
+đều chạy model). Báo cáo:
+- req/s, p50/p99 độ trễ;
+- agreement: tỉ lệ ảnh có cùng kết quả với cấu hình 1 worker;
+- pss_mb: tổng PSS (bộ nhớ chia đều phần dùng chung) của các worker, Linux.
+
+Chạy trong thư mục backend:
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --requests 200
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def make_images(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(n):
+        img = rng.integers(0, 256, size=(300, 400, 3), dtype=np.uint8)
+        ok, buf = cv2.imencode(".jpg", img)
+        images.append(buf.tobytes())
+    return images
+
+
+def descendants(pid: int):
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+    out, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            out.append(child)
+            stack.append(child)
+    return out
+
+
+def pss_mb(pids) -> float:
+    total_kb = 0
+    for pid in pids:
+        try:
+            for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Pss:"):
+                    total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024.0
+
+
+def wait_ready(base: str, workers: int, timeout: float):
+    """Chờ tới khi /ready trả 200 liên tiếp đủ nhiều lần để chắc mọi worker đã nạp xong"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            ok = requests.get(f"{base}/api/v1/ml/ready", timeout=2).status_code == 200
+        except requests.RequestException:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if streak >= 4 * workers:
+            return
+        time.sleep(0.1 if ok else 0.5)
+    raise TimeoutError(f"Server with {workers} workers was not ready after {timeout}s")
+
+
+def run_config(workers: int, images, num_requests: int, concurrency: int, port: int, timeout: float):
+    env = {**os.environ, "PRED_CACHE_MAX_ENTRIES": "0", "HISTORY_BACKEND": "memory"}
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--host", "127.0.0.1"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base, workers, timeout)
+
+        def predict(i: int):
+            data = images[i % len(images)]
+            t0 = time.perf_counter()
+            r = requests.post(f"{base}/api/v1/ml/predict", files={"file": (f"{i}.jpg", data, "image/jpeg")}, timeout=120)
+            r.raise_for_status()
+            return i % len(images), r.json()["prediction"], time.perf_counter() - t0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # Warm-up: mỗi worker nhận vài request đầu
+            list(pool.map(predict, range(2 * workers)))
+            t0 = time.perf_counter()
+            results = list(pool.map(predict, range(num_requests)))
+            elapsed = time.perf_counter() - t0
+        memory = pss_mb(descendants(server.pid))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies = np.array([r[2] for r in results]) * 1000.0
+    predictions = {}
+    for index, label, _ in results:
+        predictions.setdefault(index, label)
+    return {
+        "workers": workers,
+        "req_per_s": num_requests / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "pss_mb": memory,
+        "predictions": predictions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=0, help="0: 2 x số worker (tối thiểu 4)")
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--out", default=None, help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    images = make_images(args.images)
+    reports, baseline = [], None
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'agree':>6} {'pss MB':>8}")
+    for workers in args.workers:
+        concurrency = args.concurrency or max(4, 2 * workers)
+        report = run_config(workers, images, args.requests, concurrency, args.port, args.timeout)
+        predictions = report.pop("predictions")
+        if baseline is None:
+            baseline = predictions
+        common = [i for i in predictions if i in baseline]
+        report["agreement"] = sum(predictions[i] == baseline[i] for i in common) / max(len(common), 1)
+        reports.append(report)
+        print(f"{workers:>7} {report['req_per_s']:>8.2f} {report['p50_ms']:>8.1f} {report['p99_ms']:>8.1f} "
+              f"{report['agreement']:>6.3f} {report['pss_mb']:>8.0f}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Chạy server ở chế độ production: N process uvicorn, mỗi process gắn với 1 tập core riêng.
+
+- Process cha mở socket lắng nghe 1 lần rồi spawn các worker dùng chung socket đó;
+  kernel phân phối kết nối (accept) cho worker đang rảnh.
+- Mỗi worker được gán (sched_setaffinity) 1 tập core không giao nhau, số thread
+  intra-op của torch = số core của worker, nên các worker không tranh nhau CPU.
+- Trọng số dùng chung giữa các worker: checkpoint *.serve.pt được nạp bằng mmap
+  (xem app/ml/serving_checkpoint.py), các process cùng đọc 1 bản trong page cache
+  thay vì mỗi process giữ 1 bản riêng.
+- Worker chết bất thường sẽ được khởi động lại trên đúng tập core cũ, chờ lâu dần nếu
+  chết liên tục; quá --max-restarts lần liên tục thì dừng server với mã thoát 1.
+
+Chạy trong thư mục backend (run_server.py vẫn dùng cho phát triển, có reload):
+    python serve.py --workers 4 --port 8000
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+# Không import torch / app ở đây: các biến môi trường về thread phải được đặt
+# trong từng worker trước khi torch được import.
+import uvicorn
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(num_workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """
+    Chia các core thành num_workers tập liên tiếp, không giao nhau.
+    Nếu có ít core hơn worker thì các worker dùng chung core theo vòng tròn.
+    """
+    cores = list(cores if cores is not None else available_cores())
+    if num_workers <= len(cores):
+        size, extra = divmod(len(cores), num_workers)
+        sets, start = [], 0
+        for i in range(num_workers):
+            end = start + size + (1 if i < extra else 0)
+            sets.append(cores[start:end])
+            start = end
+        return sets
+    return [[cores[i % len(cores)]] for i in range(num_workers)]
+
+
+def _worker_main(config: uvicorn.Config, sockets, cores: List[int]):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    threads = str(len(cores))
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = threads
+    os.environ["INFER_INTRA_OP_THREADS"] = threads
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.chdir(BACKEND_DIR)
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor:
+    """
+    Khởi động lại worker chết bất thường, chờ lâu dần (backoff luỹ thừa) nếu worker của
+    cùng 1 slot chết liên tục. Worker chạy được stable_after_s giây thì coi như ổn định
+    (đếm lại từ đầu). Quá max_restarts lần chết liên tục (vd. checkpoint hỏng, lỗi import):
+    dừng mọi worker, run() trả về mã thoát 1.
+    """
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        core_sets: List[List[int]],
+        max_restarts: int = 5,
+        backoff_s: float = 1.0,
+        max_backoff_s: float = 60.0,
+        stable_after_s: float = 60.0,
+        poll_s: float = 0.5,
+        target=_worker_main,
+    ):
+        self.config = config
+        self.core_sets = core_sets
+        self.max_restarts = max_restarts
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.stable_after_s = stable_after_s
+        self.poll_s = poll_s
+        self.target = target
+        self.ctx = multiprocessing.get_context("spawn")
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * len(core_sets)
+        # Theo từng slot: thời điểm khởi động, số lần chết liên tục, thời điểm được khởi động lại
+        self.started_at = [0.0] * len(core_sets)
+        self.failures = [0] * len(core_sets)
+        self.restart_at: List[Optional[float]] = [None] * len(core_sets)
+        self.sockets = [config.bind_socket()]
+        self._stopping = False
+
+    def _spawn(self, i: int):
+        process = self.ctx.Process(
+            target=self.target,
+            args=(self.config, self.sockets, self.core_sets[i]),
+            name=f"serve-worker-{i}",
+        )
+        process.start()
+        self.processes[i] = process
+        self.started_at[i] = time.monotonic()
+        self.restart_at[i] = None
+        print(f"Worker {i} (pid {process.pid}) on cores {self.core_sets[i]}")
+
+    def _handle_signal(self, signum, frame):
+        self._stopping = True
+
+    def _check(self, i: int, now: float) -> bool:
+        """Theo dõi 1 slot; False nếu worker của slot chết liên tục quá max_restarts lần"""
+        process = self.processes[i]
+        if process is None:
+            if now >= self.restart_at[i]:
+                self._spawn(i)
+            return True
+        if process.is_alive():
+            return True
+
+        uptime = now - self.started_at[i]
+        self.failures[i] = 1 if uptime >= self.stable_after_s else self.failures[i] + 1
+        self.processes[i] = None
+        if self.failures[i] > self.max_restarts:
+            print(f"Worker {i} exited with code {process.exitcode} {self.failures[i]} times in a row, giving up")
+            return False
+        delay = min(self.max_backoff_s, self.backoff_s * 2 ** (self.failures[i] - 1))
+        print(f"Worker {i} exited with code {process.exitcode} after {uptime:.1f}s, restarting in {delay:.1f}s")
+        self.restart_at[i] = now + delay
+        return True
+
+    def run(self) -> int:
+        """Chạy tới khi nhận SIGINT / SIGTERM (trả về 0) hoặc 1 worker crash-loop (trả về 1)"""
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        for i in range(len(self.core_sets)):
+            self._spawn(i)
+
+        exit_code = 0
+        while not self._stopping:
+            time.sleep(self.poll_s)
+            for i in range(len(self.processes)):
+                if self._stopping:
+                    break
+                if not self._check(i, time.monotonic()):
+                    exit_code = 1
+                    self._stopping = True
+
+        running = [p for p in self.processes if p is not None]
+        for process in running:
+            process.terminate()
+        for process in running:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+        for sock in self.sockets:
+            sock.close()
+        return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process production server")
+    parser.add_argument("--host", default=os.getenv("SERVE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVE_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", "0")),
+                        help="số process (0: mỗi core 1 process)")
+    parser.add_argument("--cores-per-worker", type=int, default=0,
+                        help="số core mỗi worker; số worker = số core / giá trị này")
+    parser.add_argument("--max-restarts", type=int, default=int(os.getenv("SERVE_MAX_RESTARTS", "5")),
+                        help="số lần 1 worker được chết liên tục trước khi dừng server (mã thoát 1)")
+    args = parser.parse_args()
+
+    cores = available_cores()
+    workers = args.workers
+    if args.cores_per_worker > 0:
+        workers = max(1, len(cores) // args.cores_per_worker)
+    if workers <= 0:
+        workers = len(cores)
+    if workers > len(cores):
+        print(f"Warning: {workers} workers on {len(cores)} cores, workers will share cores")
+
+    config = uvicorn.Config("basic_main:app", host=args.host, port=args.port, workers=workers)
+    sys.exit(Supervisor(config, partition_cores(workers, cores), max_restarts=args.max_restarts).run())
+
+
+if __name__ == "__main__":
+    main()
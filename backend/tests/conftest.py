@@ -0,0 +1,17 @@
+import os
+
+# Không ghi lịch sử / cache ra đĩa khi import app trong test
+os.environ.setdefault("HISTORY_BACKEND", "memory")
+os.environ.setdefault("PRED_CACHE_PATH", "")
+
+import pytest
+import torch
+
+from app.ml.efficientnet_model import EfficientNetClassifier
+
+
+@pytest.fixture(scope="session")
+def fp32_model():
+    """EfficientNetClassifier khởi tạo ngẫu nhiên (không tải trọng số ImageNet)"""
+    torch.manual_seed(0)
+    return EfficientNetClassifier(num_classes=7, embedding_dim=256, pretrained=False, apply_softmax=True).eval()
@@ -0,0 +1,23 @@
+import torch
+
+from app.ml.gradcam import explainable_model, grad_cam
+from app.ml.preprocessing import TensorPreprocessor
+from app.ml.quantization import build_quantized_model
+
+
+def test_fp32_model_is_explainable(fp32_model):
+    model = explainable_model(fp32_model)
+    assert model is fp32_model
+    probs, cam, target, emb = grad_cam(model, torch.rand(3, 64, 64))
+    assert probs.shape == (7,)
+    assert 0 <= target < 7
+    assert float(cam.min()) >= 0.0 and float(cam.max()) <= 1.0
+    assert emb.shape == (256,)
+
+
+def test_dynamic_quantized_head_is_not_explainable(fp32_model):
+    # INFER_QUANTIZE=dynamic: backbone vẫn fp32 nhưng Linear ở head đã quantize (không có autograd)
+    preprocessor = TensorPreprocessor.from_compose(fp32_model.transform)
+    qmodel = build_quantized_model(fp32_model, "dynamic", preprocessor)
+    assert qmodel.backbone.features[0][0].weight.dtype == torch.float32
+    assert explainable_model(qmodel) is None
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from app.ml.history_store import (
+    MemoryHistoryStore, SQLiteHistoryStore, decode_cursor, encode_cursor, normalize_timestamp,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = MemoryHistoryStore() if request.param == "memory" else SQLiteHistoryStore(str(tmp_path / "history.db"))
+    for i in range(10):
+        store.append({
+            "id": f"id{i}",
+            "created_at": f"2026-01-{i + 1:02d}T10:00:00",
+            "prediction": "nv" if i % 2 else "mel",
+        })
+    yield store
+    store.close()
+
+
+def test_cursor_round_trip():
+    record = {"id": "abc", "created_at": "2026-01-01T10:00:00"}
+    assert decode_cursor(encode_cursor(record)) == ("2026-01-01T10:00:00", "abc")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_list_and_get(store):
+    assert [r["id"] for r in store.list()] == [f"id{i}" for i in reversed(range(10))]
+    assert store.get("id3")["prediction"] == "nv"
+    assert store.get("missing") is None
+
+
+def test_pages_cover_all_records_once(store):
+    seen, cursor = [], None
+    while True:
+        page = store.query(3, cursor)
+        if not page:
+            break
+        seen += [r["id"] for r in page]
+        cursor = decode_cursor(encode_cursor(page[-1]))
+    assert seen == [f"id{i}" for i in reversed(range(10))]
+
+
+def test_filters(store):
+    assert [r["id"] for r in store.query(10, prediction="mel")] == ["id8", "id6", "id4", "id2", "id0"]
+    window = store.query(10, since="2026-01-03T00:00:00", until="2026-01-06T00:00:00")
+    assert [r["id"] for r in window] == ["id4", "id3", "id2"]
+
+
+def test_late_and_tied_records_keep_page_order(store):
+    # Bản ghi thêm trễ hoặc trùng created_at vẫn nằm đúng chỗ theo (created_at, id)
+    store.append({"id": "late", "created_at": "2026-01-04T12:00:00", "prediction": "nv"})
+    store.append({"id": "id3a", "created_at": "2026-01-04T10:00:00", "prediction": "nv"})
+    seen, cursor = [], None
+    while True:
+        page = store.query(2, cursor, since="2026-01-03T00:00:00", until="2026-01-06T00:00:00")
+        if not page:
+            break
+        seen += [r["id"] for r in page]
+        cursor = decode_cursor(encode_cursor(page[-1]))
+    assert seen == ["id4", "late", "id3a", "id3", "id2"]
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "history.db")
+    a, b = SQLiteHistoryStore(path), SQLiteHistoryStore(path)
+    a.append({"id": "x", "created_at": "2026-01-01T00:00:00", "prediction": "nv"})
+    a.flush()
+    assert b.get("x")["prediction"] == "nv"
+    a.close()
+    b.close()
+
+
+@pytest.fixture
+def local_tz_plus7(monkeypatch):
+    # created_at lưu giờ địa phương không múi giờ; cố định giờ địa phương = UTC+7
+    monkeypatch.setenv("TZ", "Asia/Ho_Chi_Minh")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_normalize_timestamp_converts_aware_times_to_local(local_tz_plus7):
+    assert normalize_timestamp("2026-01-03T10:00:00") == "2026-01-03T10:00:00"
+    assert normalize_timestamp("2026-01-03") == "2026-01-03T00:00:00"
+    assert normalize_timestamp("2026-01-03T03:00:00Z") == "2026-01-03T10:00:00"
+    assert normalize_timestamp("2026-01-03T03:00:00+00:00") == "2026-01-03T10:00:00"
+    assert normalize_timestamp("2026-01-03T10:00:00+07:00") == "2026-01-03T10:00:00"
+    assert normalize_timestamp("2026-01-03T12:00:00+09:00") == "2026-01-03T10:00:00"
+    with pytest.raises(ValueError):
+        normalize_timestamp("yesterday")
+
+
+def test_filter_with_utc_bounds(store, local_tz_plus7):
+    # 10:00 giờ địa phương = 03:00Z: [03:00Z ngày 3, 03:00Z ngày 6) gồm ngày 3, 4, 5
+    since, until = normalize_timestamp("2026-01-03T03:00:00Z"), normalize_timestamp("2026-01-06T03:00:00Z")
+    assert [r["id"] for r in store.query(10, since=since, until=until)] == ["id4", "id3", "id2"]
@@ -0,0 +1,82 @@
+import io
+import tarfile
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+from app.ml.image_io import ArchiveMemberTooLargeError, _read_bounded, expand_archive, sniff_image_type
+
+MB = 1024 * 1024
+
+
+def _png() -> bytes:
+    return cv2.imencode(".png", np.full((8, 8, 3), 128, dtype=np.uint8))[1].tobytes()
+
+
+def _zip(members) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def _tar_gz(members) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def test_sniff_image_type():
+    assert sniff_image_type(_png()) == ".png"
+    assert sniff_image_type(b"\xff\xd8\xff\xe0") == ".jpg"
+    assert sniff_image_type(b"PK\x03\x04") is None
+
+
+def test_plain_image_is_not_an_archive():
+    assert expand_archive(_png(), 10, MB, 10 * MB) is None
+
+
+@pytest.mark.parametrize("pack", [_zip, _tar_gz])
+def test_expand_archive_skips_non_images(pack):
+    png = _png()
+    data = pack([("a.png", png), ("notes.txt", b"x"), ("__MACOSX/._a.png", png), ("dir/b.png", png)])
+    assert expand_archive(data, 10, MB, 10 * MB) == [("a.png", png), ("dir/b.png", png)]
+
+
+@pytest.mark.parametrize("pack", [_zip, _tar_gz])
+def test_too_many_images_raises(pack):
+    with pytest.raises(ValueError):
+        expand_archive(pack([(f"{i}.png", _png()) for i in range(3)]), 2, MB, 10 * MB)
+
+
+@pytest.mark.parametrize("pack", [_zip, _tar_gz])
+def test_bomb_member_is_reported_not_read(pack):
+    # 64 MB số 0 nén còn vài chục KB
+    bomb = b"\0" * (64 * MB)
+    data = pack([("bomb.png", bomb), ("ok.png", _png())])
+    assert len(data) < MB
+    items = expand_archive(data, 10, MB, 10 * MB)
+    assert [name for name, _ in items] == ["bomb.png", "ok.png"]
+    assert isinstance(items[0][1], ArchiveMemberTooLargeError)
+    assert items[0][1].max_bytes == MB
+    assert items[1][1] == _png()
+
+
+def test_total_expanded_size_is_bounded():
+    part = b"\0" * (3 * MB)
+    items = expand_archive(_zip([(f"{i}.png", part) for i in range(4)]), 10, 4 * MB, 10 * MB)
+    assert [isinstance(c, bytes) for _, c in items] == [True, True, True, False]
+    assert "Archive expands to more than" in str(items[3][1])
+
+
+def test_read_bounded_ignores_declared_size():
+    # Header có thể khai sai: giới hạn áp trên số byte thực đọc được
+    assert _read_bounded(io.BytesIO(b"x" * 10), 10, 3) == b"x" * 10
+    assert _read_bounded(io.BytesIO(b"x" * 11), 10, 3) is None
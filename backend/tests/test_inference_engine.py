@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+import torch
+
+from app.ml.inference_engine import InferenceEngine
+
+
+@pytest.fixture
+def engine(fp32_model):
+    engine = InferenceEngine(fp32_model, torch.device("cpu"), max_batch_size=4, max_wait_ms=50)
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def test_batched_results_match_single_forward(engine, fp32_model):
+    torch.manual_seed(1)
+    xs = [torch.rand(3, 64, 64) for _ in range(6)]
+    futures = [engine.submit(x) for x in xs]
+    with torch.no_grad():
+        ref = fp32_model(torch.stack(xs))
+    for f, expected in zip(futures, ref):
+        assert torch.allclose(f.result(30), expected, atol=1e-5)
+    stats = engine.stats()
+    assert stats["total_requests"] == 6
+    # 6 request gửi liền nhau, tối đa 4 ảnh / lần forward
+    assert stats["total_batches"] < 6
+    assert max(int(k) for k in stats["batch_size_histogram"]) <= 4
+
+
+def test_views_and_embeddings_stay_with_their_request(engine, fp32_model):
+    torch.manual_seed(2)
+    views, single = torch.rand(3, 3, 64, 64), torch.rand(3, 64, 64)
+    f_views = engine.submit_views(views, with_embedding=True)
+    f_single = engine.submit(single)
+    probs, emb = f_views.result(30)
+    assert probs.shape == (3, 7) and emb.shape == (3, 256)
+    with torch.no_grad():
+        ref_probs, ref_emb = fp32_model.forward_with_embedding(views)
+    assert torch.allclose(probs, ref_probs, atol=1e-5)
+    assert torch.allclose(emb, ref_emb, atol=1e-5)
+    assert f_single.result(30).shape == (7,)
+
+
+def test_concurrent_predict_from_threads(engine):
+    results = []
+
+    def call():
+        results.append(engine.predict(torch.rand(3, 64, 64), timeout=30))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8
+    assert all(torch.isclose(p.sum(), torch.tensor(1.0), atol=1e-4) for p in results)
+
+
+def test_submit_requires_running_engine(fp32_model):
+    engine = InferenceEngine(fp32_model, torch.device("cpu"))
+    with pytest.raises(RuntimeError):
+        engine.submit(torch.rand(3, 64, 64))
@@ -0,0 +1,69 @@
+import importlib.util
+from pathlib import Path
+
+import torch
+import torch.optim as optim
+import torchvision.transforms as transforms
+
+from app.ml.loader import SERVING_MEAN, SERVING_STD, load_model_cls
+
+TRAINING_DIR = Path(__file__).resolve().parents[2] / "training"
+IDX_TO_CLASS = {i: c for i, c in enumerate(["akiec", "bcc", "bkl", "df", "mel", "nv", "vasc"])}
+HPARAMS = {
+    "arch": "efficientnet_b3",
+    "num_classes": 7,
+    "embedding_dim": 256,
+    "img_size": [224, 224],
+    "norm_mean": [0.7, 0.55, 0.6],
+    "norm_std": [0.15, 0.16, 0.17],
+}
+
+
+def _training_module(name: str):
+    spec = importlib.util.spec_from_file_location(f"training_{name}", TRAINING_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _transform_params(model):
+    resize = next(t for t in model.transform.transforms if isinstance(t, transforms.Resize))
+    normalize = next(t for t in model.transform.transforms if isinstance(t, transforms.Normalize))
+    return [list(resize.size), list(normalize.mean), list(normalize.std)]
+
+
+def _same_weights(a, b) -> bool:
+    sa, sb = a.state_dict(), b.state_dict()
+    return sa.keys() == sb.keys() and all(torch.equal(sa[k], sb[k]) for k in sa)
+
+
+def test_loads_save_last_ckpt_with_hparams(tmp_path, fp32_model):
+    save_last_ckpt = _training_module("checkpoint").save_last_ckpt
+    path = tmp_path / "last.pth"
+    optimizer = optim.AdamW(fp32_model.parameters())
+    save_last_ckpt(str(path), 3, fp32_model, optimizer, None, None, "finetune", IDX_TO_CLASS, HPARAMS, 10)
+
+    model, idx_to_class = load_model_cls(str(path), torch.device("cpu"))
+    assert idx_to_class == IDX_TO_CLASS
+    assert _same_weights(model, fp32_model)
+    # Transform theo hparams của checkpoint, không phải giá trị mặc định của loader
+    assert _transform_params(model) == [HPARAMS["img_size"], HPARAMS["norm_mean"], HPARAMS["norm_std"]]
+    assert model.temperature == 1.0
+
+
+def test_strips_ddp_and_compile_prefixes(tmp_path, fp32_model):
+    # EarlyStopping lưu model.state_dict(); model bọc DDP / torch.compile có tiền tố
+    state = {f"module._orig_mod.{k}": v for k, v in fp32_model.state_dict().items()}
+    path = tmp_path / "best.pth"
+    torch.save({"model_state": state, "idx_to_class": IDX_TO_CLASS, "hparams": HPARAMS}, path)
+    model, _ = load_model_cls(str(path), torch.device("cpu"))
+    assert _same_weights(model, fp32_model)
+
+
+def test_legacy_best_model_uses_default_transform(tmp_path, fp32_model):
+    path = tmp_path / "best_model.pth"
+    torch.save({"model_state_dict": fp32_model.state_dict(), "idx_to_class": IDX_TO_CLASS, "temperature": 1.5}, path)
+    model, _ = load_model_cls(str(path), torch.device("cpu"))
+    assert _same_weights(model, fp32_model)
+    assert _transform_params(model) == [[300, 300], SERVING_MEAN, SERVING_STD]
+    assert model.temperature == 1.5
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+from app.ml.prediction_cache import PredictionCache, content_hash
+
+
+def test_key_depends_on_content_checkpoint_and_variant():
+    cache = PredictionCache("ckpt-a")
+    key = cache.make_key(b"image")
+    assert key == cache.make_key(b"", digest=content_hash(b"image"))
+    assert key != PredictionCache("ckpt-b").make_key(b"image")
+    assert key != cache.make_key(b"image", variant="tta4")
+
+
+def test_lru_eviction():
+    cache = PredictionCache("ckpt", max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.put("c", {"v": 3})
+    # "b" ít dùng gần đây nhất
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1} and cache.get("c") == {"v": 3}
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 1
+
+
+def test_ttl_expiry():
+    cache = PredictionCache("ckpt", ttl_s=0.05)
+    cache.put("a", {"v": 1})
+    assert cache.get("a") == {"v": 1}
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_persistent_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = PredictionCache("ckpt", persist_path=path)
+    cache.put("a", {"prediction": "nv"})
+    cache.close()
+
+    reopened = PredictionCache("ckpt", persist_path=path)
+    assert reopened.get("a") == {"prediction": "nv"}
+    assert reopened.stats()["disk_hits"] == 1
+    # Lần sau lấy từ bộ nhớ
+    assert reopened.get("a") == {"prediction": "nv"}
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_aget_reads_disk_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = PredictionCache("ckpt", persist_path=path)
+    cache.put("a", {"prediction": "nv"})
+    cache.close()
+    reopened = PredictionCache("ckpt", persist_path=path)
+
+    threads = []
+    disk_get = reopened._disk_get
+
+    def recording_disk_get(key, now):
+        threads.append(threading.get_ident())
+        return disk_get(key, now)
+
+    reopened._disk_get = recording_disk_get
+
+    async def lookups():
+        loop_thread = threading.get_ident()
+        first = await reopened.aget("a")
+        missing = await reopened.aget("b")
+        # Lần 2 trúng bộ nhớ, không đọc đĩa
+        again = await reopened.aget("a")
+        return loop_thread, first, missing, again
+
+    loop_thread, first, missing, again = asyncio.run(lookups())
+    assert first == again == {"prediction": "nv"} and missing is None
+    assert len(threads) == 2 and loop_thread not in threads
+    stats = reopened.stats()
+    assert stats["disk_hits"] == 1 and stats["misses"] == 1
+    reopened.close()
+
+
+def test_aget_without_persistence():
+    cache = PredictionCache("ckpt")
+    cache.put("a", {"v": 1})
+    assert asyncio.run(cache.aget("a")) == {"v": 1}
+    assert asyncio.run(cache.aget("b")) is None
+    assert cache.stats()["misses"] == 1
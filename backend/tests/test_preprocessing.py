@@ -0,0 +1,102 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from app.ml.preprocessing import TensorPreprocessor
+
+# Transform mà load_model_cls gắn vào model
+MEAN = [0.7539897561073303, 0.5854063034057617, 0.5899980068206787]
+STD = [0.12629127502441406, 0.14309869706630707, 0.15721528232097626]
+SIZE = (300, 300)
+
+# Resize bilinear + antialias trên tensor uint8 khác PIL tối đa 1 mức xám (làm tròn),
+# sau Normalize 1 mức = 1 / (255 * std); thêm 1e-5 cho sai số float32
+PARITY_TOL = 1.0 / (255.0 * min(STD)) + 1e-5
+
+
+@pytest.fixture(scope="module")
+def compose():
+    return transforms.Compose([
+        transforms.Resize(SIZE),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=MEAN, std=STD),
+    ])
+
+
+def check_parity(compose, preprocessor, images) -> float:
+    """Sai số tuyệt đối lớn nhất giữa Compose (qua PIL) và TensorPreprocessor trên cùng ảnh"""
+    ref = torch.stack([compose(Image.fromarray(img).convert("RGB")) for img in images])
+    out = preprocessor.batch(images)
+    return (ref - out).abs().max().item()
+
+
+def _images(shapes, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=shape, dtype=np.uint8) for shape in shapes]
+
+
+def test_from_compose_reads_size_mean_std(compose):
+    pre = TensorPreprocessor.from_compose(compose)
+    assert pre.size == list(SIZE)
+    assert torch.allclose(pre.mean.flatten(), torch.tensor(MEAN))
+    assert torch.allclose(pre.std.flatten(), torch.tensor(STD))
+
+
+def test_from_compose_requires_resize_and_normalize():
+    with pytest.raises(ValueError):
+        TensorPreprocessor.from_compose(transforms.Compose([transforms.ToTensor()]))
+
+
+@pytest.mark.parametrize("shape", [(300, 300, 3), (450, 600, 3), (200, 150, 3), (1024, 768, 3)])
+def test_parity_with_pil_compose(compose, shape):
+    pre = TensorPreprocessor.from_compose(compose)
+    assert check_parity(compose, pre, _images([shape])) <= PARITY_TOL
+
+
+def test_same_size_image_is_exact(compose):
+    # Không resize: chỉ còn sai số của phép nhân-cộng gộp
+    pre = TensorPreprocessor.from_compose(compose)
+    assert check_parity(compose, pre, _images([(300, 300, 3)])) < 1e-4
+
+
+def test_grayscale_and_rgba_inputs(compose):
+    pre = TensorPreprocessor.from_compose(compose)
+    gray, rgba = _images([(120, 80), (120, 80, 4)])
+    assert pre(gray).shape == (3, *SIZE)
+    assert torch.equal(pre(rgba), pre(np.ascontiguousarray(rgba[:, :, :3])))
+    assert torch.equal(pre(gray), pre(np.repeat(gray[:, :, None], 3, axis=2)))
+
+
+def test_batch_matches_single_images(compose):
+    pre = TensorPreprocessor.from_compose(compose)
+    images = _images([(300, 300, 3), (450, 600, 3), (200, 150, 3)])
+    batch = pre.batch(images)
+    assert batch.shape == (3, 3, *SIZE)
+    for img, row in zip(images, batch):
+        assert torch.equal(pre(img), row)
+
+
+def test_uint8_tensor_batch_is_resized_at_once(compose):
+    pre = TensorPreprocessor.from_compose(compose)
+    images = _images([(200, 150, 3), (200, 150, 3)])
+    stacked = torch.from_numpy(np.stack(images))
+    assert torch.equal(pre.batch(stacked), pre.batch(images))
+
+
+def test_fold_into_gives_same_output(fp32_model):
+    pre = TensorPreprocessor.from_compose(fp32_model.transform)
+    folded_pre = TensorPreprocessor.from_compose(fp32_model.transform)
+    folded_model = folded_pre.fold_into(copy.deepcopy(fp32_model))
+    assert folded_pre.folded
+    # Gọi lần 2 không nhân thêm vào trọng số
+    assert folded_pre.fold_into(folded_model) is folded_model
+
+    images = _images([(160, 200, 3), (300, 300, 3)])
+    with torch.no_grad():
+        ref = fp32_model(pre.batch(images))
+        out = folded_model(folded_pre.batch(images))
+    assert torch.allclose(ref, out, atol=1e-4)
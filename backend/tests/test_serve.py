@@ -0,0 +1,45 @@
+import os
+import re
+import threading
+
+import uvicorn
+
+from serve import Supervisor, partition_cores
+
+
+def _crashing_worker(config, sockets, cores):
+    # Như worker không nạp được checkpoint: chết ngay khi khởi động
+    os._exit(3)
+
+
+def _supervisor(**kwargs) -> Supervisor:
+    config = uvicorn.Config("basic_main:app", host="127.0.0.1", port=0)
+    return Supervisor(config, [[0]], target=_crashing_worker, poll_s=0.05, **kwargs)
+
+
+def test_partition_cores():
+    assert partition_cores(2, [0, 1, 2, 3, 4]) == [[0, 1, 2], [3, 4]]
+    assert partition_cores(3, [0, 1]) == [[0], [1], [0]]
+
+
+def test_crash_loop_backs_off_then_gives_up(capsys):
+    supervisor = _supervisor(max_restarts=3, backoff_s=0.1, stable_after_s=60)
+    assert supervisor.run() == 1
+    out = capsys.readouterr().out
+    # 1 lần khởi động + 3 lần khởi động lại, thời gian chờ tăng gấp đôi
+    assert len(re.findall(r"Worker 0 \(pid \d+\)", out)) == 4
+    assert re.findall(r"restarting in ([\d.]+)s", out) == ["0.1", "0.2", "0.4"]
+    assert "giving up" in out
+    assert all(p is None for p in supervisor.processes)
+
+
+def test_worker_that_ran_long_enough_is_restarted_without_limit(capsys):
+    # stable_after_s=0: mỗi lần chết đều sau 1 thời gian "ổn định", không tính là crash-loop
+    supervisor = _supervisor(max_restarts=1, backoff_s=0.01, stable_after_s=0)
+    timer = threading.Timer(1.5, lambda: setattr(supervisor, "_stopping", True))
+    timer.start()
+    assert supervisor.run() == 0
+    timer.join()
+    out = capsys.readouterr().out
+    assert len(re.findall(r"Worker 0 \(pid \d+\)", out)) > 2
+    assert "giving up" not in out
@@ -0,0 +1,111 @@
+import json
+import multiprocessing
+
+import numpy as np
+
+from app.ml.similarity_index import SimilarityIndex, open_index
+
+DIM = 16
+
+
+def _vector(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def _worker(path: str, worker: int, rounds: int):
+    # Mỗi process giữ 1 index riêng, ghi snapshot vào cùng thư mục như các worker của serve.py
+    index = open_index(path, DIM, fingerprint="ckpt")
+    for r in range(rounds):
+        for i in range(5):
+            index.add(f"w{worker}-{r}-{i}", _vector(1000 * worker + 10 * r + i), {"worker": worker})
+        index.save(path)
+
+
+def test_search_returns_nearest_first():
+    index = SimilarityIndex(DIM)
+    for i in range(50):
+        index.add(f"k{i}", _vector(i))
+    assert not index.add("k0", _vector(0))
+    hits = index.search(_vector(7), k=3)[0]
+    assert hits[0]["key"] == "k7"
+    assert abs(hits[0]["score"] - 1.0) < 1e-5
+    assert [h["key"] for h in index.search(_vector(7), k=3, exclude=["k7"])[0]][0] != "k7"
+
+
+def test_save_merges_entries_written_by_other_index(tmp_path):
+    a = SimilarityIndex(DIM, fingerprint="ckpt")
+    b = SimilarityIndex(DIM, fingerprint="ckpt")
+    a.add("a", _vector(1), {"worker": 0})
+    b.add("b", _vector(2), {"worker": 1})
+    a.save(str(tmp_path))
+    b.save(str(tmp_path))
+
+    # b gộp ca của a trước khi ghi: cả index trong bộ nhớ lẫn snapshot đều có 2 ca
+    assert b.vector("a") is not None
+    assert b.added_since_snapshot == 0
+    loaded = SimilarityIndex.load(str(tmp_path), fingerprint="ckpt")
+    assert sorted(m["key"] for m in loaded._meta) == ["a", "b"]
+    assert loaded.search(_vector(1), k=1)[0][0]["worker"] == 0
+
+
+def test_snapshot_of_other_checkpoint_is_not_merged(tmp_path):
+    old = SimilarityIndex(DIM, fingerprint="old")
+    old.add("a", _vector(1))
+    old.save(str(tmp_path))
+    new = SimilarityIndex(DIM, fingerprint="new")
+    new.add("b", _vector(2))
+    new.save(str(tmp_path))
+    assert SimilarityIndex.load(str(tmp_path), fingerprint="old") is None
+    assert [m["key"] for m in SimilarityIndex.load(str(tmp_path), fingerprint="new")._meta] == ["b"]
+
+
+def test_concurrent_workers_write_consistent_snapshot(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_worker, args=(str(tmp_path), w, 4)) for w in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    info = json.loads((tmp_path / "index.json").read_text())
+    vectors = np.load(tmp_path / "vectors.npy")
+    meta = [json.loads(line) for line in (tmp_path / "meta.jsonl").read_text().splitlines()]
+    assert info["count"] == len(vectors) == len(meta) == 3 * 4 * 5
+    assert not list(tmp_path.glob("*.part"))
+
+    # Mỗi dòng vector khớp với key của nó (không lẫn vectors.npy / meta.jsonl của 2 lần ghi)
+    loaded = SimilarityIndex.load(str(tmp_path), fingerprint="ckpt")
+    for m in meta:
+        w, r, i = (int(x) for x in m["key"][1:].split("-"))
+        assert loaded.search(_vector(1000 * w + 10 * r + i), k=1)[0][0]["key"] == m["key"]
+
+
+def test_refresh_picks_up_cases_snapshotted_by_other_worker(tmp_path):
+    a = open_index(str(tmp_path), DIM, fingerprint="ckpt")
+    b = open_index(str(tmp_path), DIM, fingerprint="ckpt")
+    b.add("b", _vector(2))
+    assert a.refresh(str(tmp_path)) == 0
+    b.save(str(tmp_path))
+    assert a.vector("b") is None
+    assert a.refresh(str(tmp_path)) == 1
+    assert a.vector("b") is not None
+    # Snapshot không đổi: không đọc lại
+    assert a.refresh(str(tmp_path)) == 0
+
+
+def test_merged_cases_do_not_count_as_unsaved(tmp_path):
+    a = open_index(str(tmp_path), DIM, fingerprint="ckpt")
+    b = open_index(str(tmp_path), DIM, fingerprint="ckpt")
+    for i in range(3):
+        b.add(f"b{i}", _vector(i))
+    b.save(str(tmp_path))
+    a.add("a", _vector(10))
+    assert a.refresh(str(tmp_path)) == 3
+    # Chỉ ca của chính a chưa được lưu
+    assert a.added_since_snapshot == 1
+    a.save(str(tmp_path))
+    assert a.added_since_snapshot == 0
+    # b gộp ca của a khi refresh nhưng không có gì mới để ghi
+    assert b.refresh(str(tmp_path)) == 1
+    assert b.added_since_snapshot == 0
@@ -0,0 +1,83 @@
+import asyncio
+import io
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from app.ml import uploads
+from app.ml.prediction_cache import content_hash
+from app.ml.uploads import UnsupportedImageError, UploadTooLargeError, read_upload, stream_upload_to
+
+
+class FakeUpload:
+    """Giống UploadFile của Starlette: read(n) async, size khai báo (có thể None)"""
+    def __init__(self, data: bytes, size=None):
+        self._buf = io.BytesIO(data)
+        self.size = size
+
+    async def read(self, n: int = -1) -> bytes:
+        return self._buf.read(n)
+
+
+def _png(side: int = 64) -> bytes:
+    rng = np.random.default_rng(0)
+    return cv2.imencode(".png", rng.integers(0, 256, (side, side, 3), dtype=np.uint8))[1].tobytes()
+
+
+def test_read_upload_hashes_while_reading():
+    data = _png()
+    upload = asyncio.run(read_upload(FakeUpload(data), max_bytes=len(data), chunk_size=100))
+    assert bytes(upload.data) == data
+    assert upload.digest == content_hash(data)
+    assert upload.image_type == ".png"
+
+
+def test_read_upload_rejects_non_images_and_oversize():
+    with pytest.raises(UnsupportedImageError):
+        asyncio.run(read_upload(FakeUpload(b"%PDF-1.7 not an image"), max_bytes=1000))
+    with pytest.raises(UnsupportedImageError):
+        asyncio.run(read_upload(FakeUpload(b"tiny"), max_bytes=1000))
+    data = _png()
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(read_upload(FakeUpload(data), max_bytes=len(data) - 1, chunk_size=100))
+    # Kích thước khai báo vượt giới hạn: từ chối trước khi đọc
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(read_upload(FakeUpload(data, size=10 ** 9), max_bytes=len(data)))
+    assert asyncio.run(read_upload(FakeUpload(b"PK\x03\x04zip"), 1000, require_image=False)).image_type is None
+
+
+def test_stream_upload_to_writes_off_the_event_loop(tmp_path, monkeypatch):
+    data = _png(256)
+    threads = []
+    open_for_write = uploads._open_for_write
+
+    class RecordingFile:
+        def __init__(self, f):
+            self._f = f
+
+        def write(self, chunk):
+            threads.append(threading.get_ident())
+            return self._f.write(chunk)
+
+        def close(self):
+            self._f.close()
+
+    monkeypatch.setattr(uploads, "_open_for_write", lambda path: RecordingFile(open_for_write(path)))
+
+    async def upload():
+        return threading.get_ident(), await stream_upload_to(FakeUpload(data), tmp_path / "sub" / "a.png", len(data), 1000)
+
+    loop_thread, result = asyncio.run(upload())
+    assert (tmp_path / "sub" / "a.png").read_bytes() == data
+    assert result.digest == content_hash(data) and result.size == 0
+    assert len(threads) == -(-len(data) // 1000) and loop_thread not in threads
+    assert not list((tmp_path / "sub").glob("*.part"))
+
+
+def test_stream_upload_to_removes_partial_file(tmp_path):
+    data = _png(256)
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(stream_upload_to(FakeUpload(data), tmp_path / "a.png", len(data) // 2, 1000))
+    assert list(tmp_path.iterdir()) == []
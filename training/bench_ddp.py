@@ -0,0 +1,110 @@
+"""
+Hiệu suất mở rộng của DDP (distributed.py) với 1 / 2 / 4 process trên máy hiện tại.
+
+Mỗi process train EfficientNetClassifier trên batch ngẫu nhiên cố định (BATCH_SIZE ảnh / process,
+tức weak scaling như khi chạy torchrun với train.py), gradient all-reduce qua DDP_BACKEND.
+    thông lượng  = world size * batch / thời gian 1 bước (bước chậm nhất giữa các rank)
+    speedup      = thông lượng(N) / thông lượng(1)
+    hiệu suất    = speedup / N
+Thread mỗi process mặc định = số CPU / N để các process không tranh nhau core.
+
+    python bench_ddp.py
+    python bench_ddp.py --world-sizes 1 2 4 8 --batch-size 16 --img-size 160
+"""
+import argparse
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+
+from config import *
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank: int, world_size: int, port: int, args, results):
+    os.environ.update({
+        "MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port),
+        "RANK": str(rank), "WORLD_SIZE": str(world_size), "LOCAL_RANK": str(rank),
+    })
+    # Import sau khi đặt biến môi trường của process con
+    from distributed import cleanup, init_distributed, wrap_ddp
+    from models import EfficientNetClassifier
+    from precision import configure_threads, prepare_model, to_device
+
+    configure_threads(args.threads or max(1, (os.cpu_count() or 1) // world_size))
+    init_distributed()
+    device = torch.device("cpu")
+    torch.manual_seed(SEED)
+    model = EfficientNetClassifier(args.num_classes, EMBEDDING_DIM, pretrained=False)
+    prepare_model(model, compile=False)
+    ddp_model = wrap_ddp(model, device) if world_size > 1 else model
+    optimizer = optim.AdamW(model.parameters(), lr=LR_FULL, weight_decay=WEIGHT_DECAY)
+    criterion = nn.CrossEntropyLoss(label_smoothing=0.1)
+    torch.manual_seed(SEED + rank)
+    x = to_device(torch.randn(args.batch_size, 3, args.img_size, args.img_size), device)
+    y = torch.randint(0, args.num_classes, (args.batch_size,))
+    ddp_model.train()
+
+    times = []
+    for i in range(args.warmup + args.steps):
+        t0 = time.perf_counter()
+        optimizer.zero_grad(set_to_none=True)
+        criterion(ddp_model(x), y).backward()
+        optimizer.step()
+        if i >= args.warmup:
+            times.append(time.perf_counter() - t0)
+    step = sorted(times)[len(times) // 2]
+    if world_size > 1:
+        # Bước của cả nhóm bằng bước của rank chậm nhất
+        t = torch.tensor([step], dtype=torch.float64)
+        dist.all_reduce(t, op=dist.ReduceOp.MAX)
+        step = float(t.item())
+    if rank == 0:
+        results[world_size] = (step, torch.get_num_threads())
+    cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DDP scaling efficiency for 1/2/4 processes")
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="ảnh / process / bước")
+    parser.add_argument("--img-size", type=int, default=IMG_SIZE)
+    parser.add_argument("--num-classes", type=int, default=7)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=0, help="thread mỗi process (0: số CPU / world size)")
+    args = parser.parse_args()
+
+    results = mp.Manager().dict()
+    for world_size in args.world_sizes:
+        mp.spawn(_worker, args=(world_size, _free_port(), args, results), nprocs=world_size, join=True)
+
+    print(
+        f"backend={DDP_BACKEND} cpus={os.cpu_count()} batch/process={args.batch_size} "
+        f"img={args.img_size} steps={args.steps}"
+    )
+    print(f"{'processes':>9} {'threads':>8} {'step s':>8} {'img/s':>8} {'speedup':>8} {'efficiency':>10}")
+    # Thông lượng / process của cấu hình đầu tiên (thường là 1 process) làm mốc
+    base = None
+    for world_size in args.world_sizes:
+        step, threads = results[world_size]
+        ips = world_size * args.batch_size / step
+        base = base or ips / world_size
+        print(
+            f"{world_size:>9} {threads:>8} {step:>8.3f} {ips:>8.1f} "
+            f"{ips / base:>7.2f}x {ips / (world_size * base):>9.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
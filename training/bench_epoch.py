@@ -0,0 +1,60 @@
+"""
+Thời gian 1 epoch của pipeline dữ liệu: ImageFolder (giải mã JPEG mỗi epoch) so với
+dataset đã đóng gói (packed_dataset.py, đọc uint8 từ mmap).
+
+Chỉ đo phần DataLoader (đọc + giải mã + augment + gom batch), không chạy model,
+để thấy rõ phần việc CPU mà GPU phải chờ. Epoch đầu của dataset đóng gói có thể
+chậm hơn các epoch sau nếu shard chưa nằm trong page cache.
+
+    python packed_dataset.py                     # đóng gói 1 lần
+    python bench_epoch.py --epochs 3 --workers 4
+"""
+import argparse
+import time
+
+from torch.utils.data import DataLoader
+
+from config import *
+from train import build_datasets
+
+
+def time_epochs(dataset, epochs: int, batch_size: int, workers: int):
+    loader = DataLoader(
+        dataset, batch_size, shuffle=True,
+        num_workers=workers, persistent_workers=workers > 0,
+    )
+    times = []
+    for _ in range(epochs):
+        t0 = time.perf_counter()
+        for x, y in loader:
+            pass
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--split", choices=["train", "val"], default="train")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    args = parser.parse_args()
+
+    results = {}
+    for name, packed in (("imagefolder", False), ("packed", True)):
+        train_ds, val_ds = build_datasets(packed=packed)
+        dataset = train_ds if args.split == "train" else val_ds
+        times = time_epochs(dataset, args.epochs, args.batch_size, args.workers)
+        results[name] = (len(dataset), times)
+
+    print(f"split={args.split} workers={args.workers} batch={args.batch_size}")
+    print(f"{'dataset':<12} {'images':>7} {'epoch 1 s':>10} {'best s':>8} {'img/s':>8}")
+    for name, (n, times) in results.items():
+        best = min(times)
+        print(f"{name:<12} {n:>7} {times[0]:>10.2f} {best:>8.2f} {n / best:>8.1f}")
+    speedup = min(results["imagefolder"][1]) / min(results["packed"][1])
+    print(f"speedup (best epoch): {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
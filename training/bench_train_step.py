@@ -0,0 +1,105 @@
+"""
+Thông lượng 1 bước train (forward + backward + optimizer.step, ảnh/giây) của
+EfficientNetClassifier với từng cấu hình precision / layout / compile (precision.py).
+
+Dữ liệu là batch ngẫu nhiên cố định nên chỉ đo phần tính toán, không đo DataLoader
+(xem bench_epoch.py). Bước compile / warmup không tính vào thời gian.
+"amp" luôn bật autocast nếu thiết bị hỗ trợ (bfloat16 trên CPU), bất kể CPU_AMP.
+
+    python bench_train_step.py
+    python bench_train_step.py --batch-size 16 --steps 10 --threads 8
+    python bench_train_step.py --configs fp32 amp+cl --phase head
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from config import *
+from models import EfficientNetClassifier
+from precision import amp_dtype, autocast, configure_threads, make_scaler, prepare_model, to_device
+
+# tên → (autocast, channels_last, compile)
+CONFIGS = {
+    "fp32": (False, False, False),
+    "fp32+cl": (False, True, False),
+    "amp": (True, False, False),
+    "amp+cl": (True, True, False),
+    "amp+cl+compile": (True, True, True),
+}
+
+
+def bench_config(amp: bool, channels_last: bool, compile: bool, args, device):
+    torch.manual_seed(SEED)
+    model = EfficientNetClassifier(args.num_classes, EMBEDDING_DIM, pretrained=False).to(device)
+    if args.phase == "head":
+        for n, p in model.named_parameters():
+            p.requires_grad = "backbone" not in n
+    step_model = prepare_model(model, channels_last, compile)
+    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=LR_FULL, weight_decay=WEIGHT_DECAY)
+    scaler = make_scaler(device, amp)
+    criterion = nn.CrossEntropyLoss(label_smoothing=0.1)
+    x = to_device(torch.randn(args.batch_size, 3, IMG_SIZE, IMG_SIZE), device, channels_last)
+    y = torch.randint(0, args.num_classes, (args.batch_size,), device=device)
+    step_model.train()
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        with autocast(device, amp):
+            loss = criterion(step_model(x), y)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
+        return loss.detach()
+
+    t0 = time.perf_counter()
+    for _ in range(args.warmup):
+        step()
+    warmup = time.perf_counter() - t0
+
+    times = []
+    for _ in range(args.steps):
+        t0 = time.perf_counter()
+        loss = step()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - t0)
+    return warmup, sorted(times)[len(times) // 2], loss.item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-step training throughput for each precision/compile configuration")
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--phase", choices=["finetune", "head"], default="finetune")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--num-classes", type=int, default=7)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=NUM_THREADS)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    configure_threads(args.threads)
+    device = torch.device(args.device)
+    dtype = amp_dtype(device)
+    print(
+        f"device={device.type} amp={str(dtype).replace('torch.', '') if dtype else 'unsupported'} "
+        f"threads={torch.get_num_threads()} batch={args.batch_size} img={IMG_SIZE} phase={args.phase}"
+    )
+    print(f"{'config':<16} {'warmup s':>9} {'step s':>8} {'img/s':>8} {'speedup':>8}")
+    base = None
+    for name in args.configs:
+        warmup, step_s, loss = bench_config(*CONFIGS[name], args, device)
+        ips = args.batch_size / step_s
+        base = base or ips
+        print(f"{name:<16} {warmup:>9.2f} {step_s:>8.3f} {ips:>8.1f} {ips / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ def save_last_ckpt(
     training_phase,
     idx_to_class=None,
     hparams=None,
+    steps_per_epoch=None,
 ):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     torch.save(
@@ -24,6 +25,7 @@ def save_last_ckpt(
             "training_phase": training_phase,
             "idx_to_class": idx_to_class,
             "hparams": hparams,
+            "steps_per_epoch": steps_per_epoch,
         },
         path,
     )
@@ -36,6 +38,7 @@ def load_last_ckpt(
     scheduler,
     scaler,
     device,
+    steps_per_epoch=None,
 ):
     if not os.path.exists(path):
         return None
@@ -46,7 +49,11 @@ def load_last_ckpt(
     optimizer.load_state_dict(ckpt["optimizer_state"])
 
     if scheduler and ckpt.get("scheduler_state") is not None:
-        scheduler.load_state_dict(ckpt["scheduler_state"])
+        state = ckpt["scheduler_state"]
+        saved_steps = ckpt.get("steps_per_epoch")
+        if steps_per_epoch and saved_steps and saved_steps != steps_per_epoch:
+            state = rescale_onecycle_state(state, saved_steps, steps_per_epoch)
+        scheduler.load_state_dict(state)
 
     if scaler and ckpt.get("scaler_state") is not None:
         scaler.load_state_dict(ckpt["scaler_state"])
@@ -57,3 +64,24 @@ def load_last_ckpt(
         "idx_to_class": ckpt.get("idx_to_class"),
         "hparams": ckpt.get("hparams"),
     }
+
+
+def rescale_onecycle_state(state, old_steps_per_epoch, new_steps_per_epoch):
+    """
+    State của OneCycleLR khi số bước / epoch đổi (world size, batch size): giữ nguyên tiến độ
+    theo epoch. Checkpoint lưu ở cuối epoch nên last_epoch là bội của old_steps_per_epoch.
+    """
+    if "total_steps" not in state:
+        return state
+    old_total = state["total_steps"]
+    new_total = old_total // old_steps_per_epoch * new_steps_per_epoch
+    state = dict(state)
+    state["total_steps"] = new_total
+    state["last_epoch"] = state["last_epoch"] // old_steps_per_epoch * new_steps_per_epoch
+    state["_step_count"] = state["last_epoch"] + 1
+    # Mốc cuối mỗi pha: float(pct_start * total_steps) - 1 (và total_steps - 1)
+    state["_schedule_phases"] = [
+        {**phase, "end_step": (phase["end_step"] + 1) * new_total / old_total - 1}
+        for phase in state["_schedule_phases"]
+    ]
+    return state
@@ -1,7 +1,12 @@
 DATA_DIR = r"data_skin"        
+PACKED_DIR      = r"data_skin_packed"   # ảnh đã giải mã sẵn (python packed_dataset.py); chưa có thì đọc DATA_DIR
+PACK_TRAIN_SIZE = 256                   # cạnh ngắn ảnh train khi đóng gói, giữ tỉ lệ gốc (> IMG_SIZE để còn RandomResizedCrop)
 
 EPOCHS         = 100              #tổng epoch
 FREEZE_EPOCHS  = 10               # số epoch train HEAD trước
+FEATURE_CACHE  = True             # phase HEAD train trên đặc trưng backbone tính sẵn (feature_cache.py)
+FEATURE_CACHE_VIEWS = 3           # số lượt augment tập train được cache
+FEATURE_CACHE_DIR   = r"./checkpoints/skin2/features"
 
 BATCH_SIZE     = 32           
 NUM_WORKERS    = 4               
@@ -13,7 +18,13 @@ WEIGHT_DECAY   = 1e-4
 
 EMBEDDING_DIM  = 256
 PRETRAINED    = True             
-USE_AMP        = True             
+USE_AMP        = True             # CUDA: float16 + GradScaler (precision.py)
+CPU_AMP        = False            # CPU: bfloat16 autocast nếu hỗ trợ; bật khi bench_train_step.py cho thấy nhanh hơn
+CHANNELS_LAST  = True             # model + batch ảnh layout NHWC
+COMPILE        = False            # torch.compile model (lần đầu mất vài phút compile)
+NUM_THREADS    = 0                # thread intra-op của PyTorch trên CPU (0: mặc định)
+NUM_INTEROP_THREADS = 0
+DDP_BACKEND    = "gloo"           # torchrun nhiều process (distributed.py); gloo chạy được trên CPU
 IMG_SIZE       = 224             
 
 NORM_MEAN = [
@@ -1,50 +1,199 @@
+"""
+Tính mean / std theo kênh RGB của dataset (cho NORM_MEAN / NORM_STD).
+
+- Mỗi process worker xử lý 1 shard ảnh: giải mã + resize như lúc train rồi cộng
+  các moment của từng ảnh bằng số nguyên (chính xác tuyệt đối);
+- các shard được gộp theo công thức Chan (Welford song song) trên float64,
+  không cộng dồn tổng bình phương float32 như trước;
+- --sample: chỉ lấy ngẫu nhiên N ảnh; --tol: dừng sớm khi mean/std thay đổi
+  dưới tol qua vài shard liên tiếp (ảnh được xáo trộn nên mỗi shard là 1 mẫu ngẫu nhiên).
+
+Ghi kết quả vào training/config.py (--write-config) và/hoặc hparams của checkpoint
+(--checkpoint, khoá norm_mean / norm_std mà backend đọc khi nạp model):
+    python dataset.py --data-dir data_skin/train --write-config
+    python dataset.py --data-dir data_skin/train --sample 5000 --tol 1e-4 --checkpoint checkpoints/skin2/best_skin.pth
+"""
+import argparse
 import os
+import random
+import re
+from multiprocessing import Pool
+
+import numpy as np
 import torch
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
+from PIL import Image
+from torchvision import datasets
 from tqdm import tqdm
 
+from config import *
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.py")
+
+
+class RunningStats:
+    """count / mean / M2 (tổng bình phương độ lệch) theo kênh, float64, gộp được theo Chan et al."""
+    def __init__(self, channels: int = 3):
+        self.count = 0
+        self.mean = np.zeros(channels, dtype=np.float64)
+        self.m2 = np.zeros(channels, dtype=np.float64)
+
+    def add_moments(self, n: int, mean: np.ndarray, m2: np.ndarray):
+        if n == 0:
+            return
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+
+    def merge(self, other: "RunningStats"):
+        self.add_moments(other.count, other.mean, other.m2)
+
+    @property
+    def std(self) -> np.ndarray:
+        # std của toàn bộ điểm ảnh (chia N, như công thức cũ)
+        return np.sqrt(self.m2 / max(self.count, 1))
+
+
+def _image_moments(path: str, size):
+    """(số điểm ảnh, mean, M2) của 1 ảnh sau resize, giá trị trong [0, 1]"""
+    with Image.open(path) as img:
+        # Cùng phép resize với transforms.Resize((h, w)) trên ảnh PIL
+        img = img.convert("RGB").resize((size[1], size[0]), Image.BILINEAR)
+        u = np.asarray(img, dtype=np.uint8).reshape(-1, 3)
+    n = u.shape[0]
+    s1 = u.sum(axis=0, dtype=np.int64)
+    s2 = np.einsum("ij,ij->j", u.astype(np.int64), u.astype(np.int64))
+    # n*M2 = n*Σu² - (Σu)² tính bằng số nguyên nên không bị triệt tiêu số học
+    m2 = np.array([(n * int(b) - int(a) ** 2) / n for a, b in zip(s1, s2)], dtype=np.float64)
+    return n, s1 / n / 255.0, m2 / 255.0 ** 2
+
 
-def compute_mean_std(data_dir: str, batch_size: int = 64, num_workers: int = 4):
+def _shard_stats(args):
+    paths, size = args
+    stats = RunningStats()
+    for path in paths:
+        stats.add_moments(*_image_moments(path, size))
+    return stats, len(paths)
+
+
+def stream_stats(
+    data_dir: str,
+    img_size: int = IMG_SIZE,
+    num_workers: int = NUM_WORKERS,
+    shard_images: int = 64,
+    sample: int = None,
+    tol: float = None,
+    patience: int = 3,
+    seed: int = SEED,
+):
+    """
+    Thống kê mean / std của mọi ảnh trong data_dir (ImageFolder hoặc thư mục cha chứa train/val).
+    Trả về (RunningStats, số ảnh đã đọc, có dừng sớm hay không).
+    """
+    paths = [path for path, _ in datasets.ImageFolder(data_dir).samples]
+    if sample is not None or tol is not None:
+        random.Random(seed).shuffle(paths)
+    if sample is not None:
+        paths = paths[:sample]
+    shards = [(paths[i:i + shard_images], (img_size, img_size)) for i in range(0, len(paths), shard_images)]
+
+    stats = RunningStats()
+    images, stable, stopped = 0, 0, False
+    with Pool(max(1, num_workers)) as pool:
+        for shard, n in tqdm(pool.imap_unordered(_shard_stats, shards), total=len(shards), desc="mean/std"):
+            prev_mean, prev_std = stats.mean, stats.std
+            first = stats.count == 0
+            stats.merge(shard)
+            images += n
+            if tol is None or first:
+                continue
+            change = max(np.abs(stats.mean - prev_mean).max(), np.abs(stats.std - prev_std).max())
+            stable = stable + 1 if change < tol else 0
+            if stable >= patience:
+                stopped = True
+                pool.terminate()
+                break
+    return stats, images, stopped
+
+
+def compute_mean_std(data_dir: str, num_workers: int = NUM_WORKERS, **kwargs):
     """
     Tính mean và std cho toàn bộ dataset (3 kênh RGB).
     """
-    # Transform: chỉ resize + tensor, KHÔNG normalize
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),  # hoặc giữ nguyên nếu muốn
-        transforms.ToTensor()
-    ])
+    stats, _, _ = stream_stats(data_dir, num_workers=num_workers, **kwargs)
+    return torch.from_numpy(stats.mean), torch.from_numpy(stats.std)
+
+
+# ---------------------------------------------------------------------- #
+# Ghi kết quả
+# ---------------------------------------------------------------------- #
+def _format_list(name: str, values) -> str:
+    body = ",\n".join(f"    {float(v)!r}" for v in values)
+    return f"{name} = [\n{body}\n]"
+
+
+def write_config(mean, std, path: str = CONFIG_PATH):
+    """Thay khối NORM_MEAN = [...] / NORM_STD = [...] trong config.py"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    for name, values in (("NORM_MEAN", mean), ("NORM_STD", std)):
+        text, n = re.subn(rf"^{name}\s*=\s*\[[^\]]*\]", _format_list(name, values), text, count=1, flags=re.M)
+        if n == 0:
+            text = text.rstrip("\n") + "\n\n" + _format_list(name, values) + "\n"
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
 
-    dataset = datasets.ImageFolder(data_dir, transform=transform)
-    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False,
-                        num_workers=num_workers, pin_memory=True)
 
-    n_images = 0
-    mean = torch.zeros(3)
-    std = torch.zeros(3)
+def write_checkpoint(checkpoint: str, mean, std, img_size: int = IMG_SIZE):
+    """Ghi norm_mean / norm_std / img_size vào hparams của checkpoint"""
+    ckpt = torch.load(checkpoint, map_location="cpu", weights_only=False)
+    hparams = dict(ckpt.get("hparams") or {})
+    hparams.update({
+        "img_size": [img_size, img_size],
+        "norm_mean": [float(v) for v in mean],
+        "norm_std": [float(v) for v in std],
+    })
+    ckpt["hparams"] = hparams
+    tmp = checkpoint + ".tmp"
+    torch.save(ckpt, tmp)
+    os.replace(tmp, checkpoint)
 
-    print("▶ Đang tính mean và std ...")
-    for images, _ in tqdm(loader):
-        # images shape: [B, C, H, W]
-        b, c, h, w = images.shape
-        n_pixels = b * h * w
 
-        mean += images.sum(dim=[0, 2, 3])
-        std += (images ** 2).sum(dim=[0, 2, 3])
-        n_images += n_pixels
+def main():
+    parser = argparse.ArgumentParser(description="Streaming per-channel mean/std of an image dataset")
+    parser.add_argument("--data-dir", default=os.path.join(DATA_DIR, "train"))
+    parser.add_argument("--img-size", type=int, default=IMG_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--shard-images", type=int, default=64)
+    parser.add_argument("--sample", type=int, default=None, help="chỉ dùng N ảnh ngẫu nhiên")
+    parser.add_argument("--tol", type=float, default=None, help="dừng sớm khi mean/std thay đổi < tol")
+    parser.add_argument("--patience", type=int, default=3)
+    parser.add_argument("--write-config", action="store_true", help="ghi vào training/config.py")
+    parser.add_argument("--checkpoint", default=None, help="ghi vào hparams của checkpoint")
+    args = parser.parse_args()
 
-    mean /= n_images
-    std = torch.sqrt(std / n_images - mean ** 2)
+    stats, images, stopped = stream_stats(
+        args.data_dir, args.img_size, args.workers, args.shard_images,
+        args.sample, args.tol, args.patience,
+    )
+    mean, std = stats.mean.tolist(), stats.std.tolist()
+    print(f"\n✅ {images} ảnh, {stats.count} điểm ảnh" + (" (dừng sớm)" if stopped else ""))
+    print(f"✅ Mean: {mean}")
+    print(f"✅ Std:  {std}\n")
 
-    return mean, std
+    if args.write_config:
+        write_config(mean, std)
+        print(f"💾 Đã ghi NORM_MEAN / NORM_STD vào {CONFIG_PATH}")
+    if args.checkpoint:
+        write_checkpoint(args.checkpoint, mean, std, args.img_size)
+        print(f"💾 Đã ghi norm_mean / norm_std vào hparams của {args.checkpoint}")
+    if not args.write_config and not args.checkpoint:
+        print("Bạn có thể copy vào Normalize như sau:")
+        print(f"transforms.Normalize(mean={mean}, std={std})")
 
 
 if __name__ == "__main__":
-    # ví dụ: data/train hoặc data toàn bộ
-    data_dir = r"C:\Users\PC\Downloads\output_class"
-
-    mean, std = compute_mean_std(data_dir)
-    print(f"\n✅ Mean: {mean.tolist()}")
-    print(f"✅ Std:  {std.tolist()}\n")
-    print("Bạn có thể copy vào Normalize như sau:")
-    print(f"transforms.Normalize(mean={mean.tolist()}, std={std.tolist()})")
+    main()
@@ -0,0 +1,128 @@
+"""
+Huấn luyện song song dữ liệu (DistributedDataParallel) cho train.py.
+
+Mỗi process giữ 1 bản model và 1 phần dữ liệu (DistributedSampler); gradient được
+all-reduce sau mỗi backward. Backend mặc định gloo (DDP_BACKEND) nên chạy được trên
+máy chỉ có CPU; BatchNorm giữ thống kê batch riêng từng process (SyncBatchNorm cần GPU),
+running stats đồng bộ từ rank 0 mỗi lần forward (mặc định của DDP). Chỉ rank 0 ghi
+checkpoint / log.
+
+Không có biến môi trường của torchrun (WORLD_SIZE) thì train.py chạy 1 process như cũ.
+    torchrun --standalone --nproc_per_node 4 train.py
+    torchrun --nnodes 2 --node_rank 0 --master_addr 10.0.0.1 --master_port 29500 --nproc_per_node 4 train.py
+
+Mỗi process dùng BATCH_SIZE ảnh / bước, tức batch toàn cục = BATCH_SIZE * world size.
+"""
+import os
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DistributedSampler, Sampler
+
+from config import *
+
+
+def init_distributed():
+    """Khởi tạo process group nếu chạy qua torchrun; trả về (rank, world_size, local_rank)"""
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group(DDP_BACKEND)
+    return get_rank(), get_world_size(), int(os.environ.get("LOCAL_RANK", "0"))
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main() -> bool:
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def wrap_ddp(module, device: torch.device):
+    """
+    Bọc DDP khi chạy phân tán. DDP chỉ đồng bộ tham số requires_grad tại lúc bọc,
+    nên phải bọc lại sau mỗi lần freeze / unfreeze.
+    """
+    if not is_distributed():
+        return module
+    device_ids = [device.index] if device.type == "cuda" else None
+    return DistributedDataParallel(module, device_ids=device_ids)
+
+
+class ShardSampler(Sampler):
+    """Chia dataset theo rank (i ≡ rank mod world size), không lặp mẫu để đủ số như DistributedSampler"""
+    def __init__(self, dataset, rank: int = None, world_size: int = None):
+        self.n = len(dataset)
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+
+    def __iter__(self):
+        return iter(range(self.rank, self.n, self.world_size))
+
+    def __len__(self):
+        return len(range(self.rank, self.n, self.world_size))
+
+
+def make_sampler(dataset, shuffle: bool):
+    """
+    None khi chạy 1 process. Train: DistributedSampler (mọi rank cùng số batch, bắt buộc với DDP);
+    đánh giá: ShardSampler (mỗi mẫu đúng 1 lần, kết quả gom lại bằng gather_lists).
+    """
+    if not is_distributed():
+        return None
+    if shuffle:
+        return DistributedSampler(dataset, shuffle=True, seed=SEED)
+    return ShardSampler(dataset)
+
+
+def set_epoch(loader, epoch: int):
+    """Đổi thứ tự xáo trộn của DistributedSampler theo epoch"""
+    sampler = getattr(loader, "sampler", None)
+    if hasattr(sampler, "set_epoch"):
+        sampler.set_epoch(epoch)
+
+
+def all_reduce_sum(*values):
+    """Tổng các số qua mọi rank (float64)"""
+    if not is_distributed():
+        return values
+    t = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(t)
+    return tuple(t.tolist())
+
+
+def gather_lists(values: list) -> list:
+    """Nối list của mọi rank"""
+    if not is_distributed():
+        return values
+    out = [None] * get_world_size()
+    dist.all_gather_object(out, values)
+    return [v for part in out for v in part]
+
+
+def broadcast_flag(flag: bool) -> bool:
+    """Giá trị của rank 0 cho mọi rank (ví dụ quyết định early stopping)"""
+    if not is_distributed():
+        return flag
+    t = torch.tensor([int(flag)])
+    dist.broadcast(t, src=0)
+    return bool(t.item())
@@ -0,0 +1,159 @@
+"""
+Cache đặc trưng backbone cho phase HEAD (backbone đóng băng).
+
+Trong FREEZE_EPOCHS epoch đầu chỉ embedding_layer + classifier được cập nhật, nên
+forward EfficientNet-B3 trên từng batch mỗi epoch là lặp lại. Ở đây backbone chạy 1 lần
+(eval, inference_mode) trên FEATURE_CACHE_VIEWS lượt augment của tập train (+ 1 lượt val)
+và đặc trưng pooled [D] được ghi vào file .npy memory-mapped; các epoch HEAD chỉ còn
+forward / backward head trên đặc trưng đọc từ mmap.
+
+Khác với train trên ảnh: backbone ở chế độ eval (BatchNorm dùng running stats,
+không dropout / stochastic depth) và mỗi ảnh chỉ có FEATURE_CACHE_VIEWS lượt augment
+cố định (mỗi epoch chọn ngẫu nhiên 1 lượt cho từng ảnh).
+
+Cấu trúc FEATURE_CACHE_DIR:
+    meta.json           fingerprint (kiến trúc, transform, precision, số ảnh, checksum backbone), ghi cuối cùng
+    train_features.npy  float32 [views, N, D]
+    train_labels.npy    int64 [N]
+    val_features.npy    float32 [1, N, D]
+    val_labels.npy      int64 [N]
+Cache tự dựng lại khi fingerprint không khớp. Chạy phân tán: mỗi rank trích đặc trưng
+cho phần ảnh của mình vào cùng file (các file phải nằm trên ổ dùng chung nếu nhiều máy).
+"""
+import json
+import os
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset, Subset
+from tqdm import tqdm
+
+from config import *
+from precision import amp_dtype, amp_enabled, autocast, to_device
+from distributed import ShardSampler, barrier, broadcast_flag, is_main, make_sampler
+
+META_FILE = "meta.json"
+
+
+class HeadOnly(nn.Module):
+    """embedding_layer + classifier của model, nhận đặc trưng backbone thay cho ảnh (dùng chung tham số)"""
+    def __init__(self, model):
+        super().__init__()
+        self.embedding_layer = model.embedding_layer
+        self.classifier = model.classifier
+
+    def forward(self, feats):
+        return self.classifier(self.embedding_layer(feats))
+
+
+class FeatureDataset(Dataset):
+    """(đặc trưng, nhãn) từ cache; có nhiều lượt augment thì mỗi lần đọc chọn ngẫu nhiên 1 lượt"""
+    def __init__(self, cache_dir: str, split: str):
+        self.features_path = os.path.join(cache_dir, f"{split}_features.npy")
+        self.targets = np.load(os.path.join(cache_dir, f"{split}_labels.npy")).tolist()
+        self._features = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_features"] = None
+        return state
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, i):
+        if self._features is None:
+            self._features = np.load(self.features_path, mmap_mode="c")
+        view = random.randrange(self._features.shape[0])
+        return torch.from_numpy(self._features[view, i]), self.targets[i]
+
+
+def _backbone_checksum(model) -> float:
+    with torch.no_grad():
+        return float(sum(p.double().sum() for p in model.backbone.parameters()))
+
+
+def _fingerprint(model, train_ds, val_ds, views: int, device) -> dict:
+    dtype = amp_dtype(device) if amp_enabled(device) else None
+    return {
+        "arch": "efficientnet_b3",
+        "img_size": IMG_SIZE,
+        "norm_mean": list(NORM_MEAN),
+        "norm_std": list(NORM_STD),
+        "train_count": len(train_ds),
+        "val_count": len(val_ds),
+        "views": views,
+        "seed": SEED,
+        "precision": str(dtype or torch.float32),
+        "backbone_checksum": _backbone_checksum(model),
+    }
+
+
+@torch.inference_mode()
+def _extract(model, dataset, cache_dir: str, split: str, views: int, device):
+    """Chạy backbone trên views lượt của phần dataset thuộc rank này, ghi vào file đã tạo sẵn"""
+    features = np.load(os.path.join(cache_dir, f"{split}_features.npy"), mmap_mode="r+")
+    labels = np.load(os.path.join(cache_dir, f"{split}_labels.npy"), mmap_mode="r+")
+    indices = list(ShardSampler(dataset))
+    loader = DataLoader(Subset(dataset, indices), BATCH_SIZE, shuffle=False, num_workers=NUM_WORKERS, pin_memory=True)
+    for v in range(views):
+        # Mỗi lượt có seed riêng: augment ngẫu nhiên nhưng dựng lại được
+        random.seed(SEED + v)
+        torch.manual_seed(SEED + v)
+        start = 0
+        for x, y in tqdm(loader, desc=f"{split} view {v + 1}/{views}", leave=False, disable=not is_main()):
+            with autocast(device):
+                feats = model.backbone(to_device(x, device)).float().cpu().numpy()
+            idx = indices[start:start + len(feats)]
+            features[v, idx] = feats
+            labels[idx] = y.numpy()
+            start += len(feats)
+    features.flush()
+    labels.flush()
+
+
+def build_feature_cache(model, train_ds, val_ds, device, cache_dir: str = FEATURE_CACHE_DIR, views: int = FEATURE_CACHE_VIEWS):
+    """
+    Dựng cache nếu chưa có / không khớp fingerprint; trả về (train_loader, val_loader) trên đặc trưng.
+    Chạy phân tán: rank 0 tạo file, mỗi rank trích đặc trưng phần dữ liệu của mình.
+    """
+    fingerprint = _fingerprint(model, train_ds, val_ds, views, device)
+    meta_path = os.path.join(cache_dir, META_FILE)
+    cached = None
+    if is_main() and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            cached = json.load(f)
+
+    if broadcast_flag(cached != fingerprint):
+        splits = (("train", train_ds, views), ("val", val_ds, 1))
+        if is_main():
+            print(f"🧮 Dựng cache đặc trưng backbone ({views} lượt augment) → {cache_dir}")
+            os.makedirs(cache_dir, exist_ok=True)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            dim = model.embedding_layer[0].in_features
+            for split, dataset, n in splits:
+                np.lib.format.open_memmap(os.path.join(cache_dir, f"{split}_features.npy"), mode="w+", dtype=np.float32, shape=(n, len(dataset), dim)).flush()
+                np.lib.format.open_memmap(os.path.join(cache_dir, f"{split}_labels.npy"), mode="w+", dtype=np.int64, shape=(len(dataset),)).flush()
+        barrier()
+        was_training = model.training
+        model.eval()
+        for split, dataset, n in splits:
+            _extract(model, dataset, cache_dir, split, n, device)
+        model.train(was_training)
+        barrier()
+        # meta.json ghi cuối cùng: có meta nghĩa là cache đầy đủ
+        if is_main():
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(fingerprint, f)
+    elif is_main():
+        print(f"🧮 Dùng cache đặc trưng backbone: {cache_dir}")
+
+    # Cùng batch size / sampler với loader ảnh để số bước / epoch (OneCycleLR) không đổi
+    train_ds, val_ds = FeatureDataset(cache_dir, "train"), FeatureDataset(cache_dir, "val")
+    train_sampler = make_sampler(train_ds, shuffle=True)
+    train_loader = DataLoader(train_ds, BATCH_SIZE, shuffle=train_sampler is None, sampler=train_sampler)
+    val_loader = DataLoader(val_ds, BATCH_SIZE, shuffle=False, sampler=make_sampler(val_ds, shuffle=False))
+    return train_loader, val_loader
@@ -0,0 +1,281 @@
+"""
+Dataset đã giải mã sẵn, lưu dạng uint8 memory-mapped.
+
+Đóng gói 1 lần (giải mã JPEG + resize), sau đó mỗi epoch chỉ đọc mảng uint8 từ mmap
+(trang nhớ dùng chung qua page cache giữa các worker DataLoader) và augment trực tiếp
+trên mảng đó: RandomResizedCrop + RandomHorizontalFlip + RandomRotation của train_tfms
+được gộp thành 1 phép cv2.warpAffine từ ảnh mmap ra ảnh IMG_SIZE, không qua PIL.
+
+Cấu trúc thư mục của mỗi split (train / val):
+    index.json          metadata: kích thước từng ảnh, classes, danh sách shard, đường dẫn gốc
+    labels.npy          nhãn int64 [N]
+    shard_00000.npy     ảnh uint8 [n, H, W, 3] (RGB), đọc bằng np.load(mmap_mode=...);
+                        H x W là kích thước lớn nhất trong shard, ảnh nhỏ hơn nằm ở góc trên trái
+
+- train giữ nguyên tỉ lệ khung hình gốc, cạnh ngắn = PACK_TRAIN_SIZE (lớn hơn IMG_SIZE):
+  RandomResizedCrop lấy mẫu vùng cắt (scale, ratio) trên khung hình có cùng tỉ lệ như ảnh gốc,
+  nên phân bố méo tỉ lệ giống train_tfms trên ImageFolder; chỉ khác độ phân giải nguồn
+  (cạnh ngắn PACK_TRAIN_SIZE thay vì ảnh gốc, vẫn lớn hơn IMG_SIZE);
+- val đóng gói đúng IMG_SIZE x IMG_SIZE bằng cùng phép resize với val_tfms (PIL bilinear),
+  nên lúc đánh giá chỉ còn normalize.
+
+Đóng gói DATA_DIR/{train,val} vào PACKED_DIR:
+    python packed_dataset.py
+    python packed_dataset.py --src data_skin --dst data_skin_packed --workers 8
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import datasets
+from tqdm import tqdm
+
+from config import *
+
+PACK_FORMAT = "skin-packed-v2"
+INDEX_FILE = "index.json"
+LABELS_FILE = "labels.npy"
+SHARD_IMAGES = 4096               # số ảnh mỗi shard (341x256x3 → ~1GB)
+
+
+# ---------------------------------------------------------------------- #
+# Đóng gói
+# ---------------------------------------------------------------------- #
+def _target_size(path: str, size=None, short_side: int = None):
+    """(h, w) sau khi resize: cố định `size`, hoặc giữ tỉ lệ với cạnh ngắn = short_side (chỉ đọc header ảnh)"""
+    if size is not None:
+        return tuple(size)
+    with Image.open(path) as img:
+        w, h = img.size
+    scale = short_side / min(h, w)
+    return max(1, round(h * scale)), max(1, round(w * scale))
+
+
+def _load_resized(args):
+    path, size = args
+    with Image.open(path) as img:
+        # Cùng phép resize với transforms.Resize((h, w)) trên ảnh PIL
+        img = img.convert("RGB").resize((size[1], size[0]), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def pack_split(
+    src_dir: str,
+    dst_dir: str,
+    size=None,
+    short_side: int = None,
+    num_workers: int = NUM_WORKERS,
+    shard_images: int = SHARD_IMAGES,
+):
+    """
+    Giải mã + resize mọi ảnh của 1 thư mục ImageFolder vào các shard uint8 [n, H, W, 3].
+    size=(h, w): resize cố định (như transforms.Resize((h, w))); short_side: giữ tỉ lệ gốc.
+    """
+    if (size is None) == (short_side is None):
+        raise ValueError("Pass exactly one of size / short_side")
+    folder = datasets.ImageFolder(src_dir)
+    samples = folder.samples
+    os.makedirs(dst_dir, exist_ok=True)
+
+    shards = []
+    with Pool(max(1, num_workers)) as pool:
+        sizes = pool.starmap(_target_size, ((path, size, short_side) for path, _ in samples), chunksize=64)
+        images = pool.imap(_load_resized, zip((path for path, _ in samples), sizes), chunksize=16)
+        for start in tqdm(range(0, len(samples), shard_images), desc=os.path.basename(dst_dir)):
+            count = min(shard_images, len(samples) - start)
+            h = max(hw[0] for hw in sizes[start:start + count])
+            w = max(hw[1] for hw in sizes[start:start + count])
+            name = f"shard_{len(shards):05d}.npy"
+            out = np.lib.format.open_memmap(os.path.join(dst_dir, name), mode="w+", dtype=np.uint8, shape=(count, h, w, 3))
+            for i in range(count):
+                img = next(images)
+                out[i, :img.shape[0], :img.shape[1]] = img
+            out.flush()
+            del out
+            shards.append({"file": name, "count": count})
+
+    np.save(os.path.join(dst_dir, LABELS_FILE), np.asarray([label for _, label in samples], dtype=np.int64))
+    index = {
+        "format": PACK_FORMAT,
+        "size": list(size) if size is not None else None,
+        "short_side": short_side,
+        "sizes": [list(hw) for hw in sizes],
+        "count": len(samples),
+        "classes": folder.classes,
+        "class_to_idx": folder.class_to_idx,
+        "shards": shards,
+        "paths": [os.path.relpath(path, src_dir) for path, _ in samples],
+    }
+    # index.json ghi cuối cùng: có index nghĩa là các shard đã đầy đủ
+    with open(os.path.join(dst_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+
+def is_packed(root: str) -> bool:
+    return os.path.exists(os.path.join(root, INDEX_FILE))
+
+
+# ---------------------------------------------------------------------- #
+# Dataset
+# ---------------------------------------------------------------------- #
+class PackedImageDataset(Dataset):
+    """
+    Giống ImageFolder (classes, class_to_idx, targets) nhưng đọc từ shard đã đóng gói.
+    transform nhận thẳng mảng uint8 [h, w, 3] của đúng ảnh đó, trỏ vào mmap (không copy);
+    không có transform thì trả về tensor uint8 [3, H, W] (cũng không copy).
+    """
+    def __init__(self, root: str, transform=None):
+        with open(os.path.join(root, INDEX_FILE), encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("format") != PACK_FORMAT:
+            raise ValueError(f"{root} is not a packed dataset ({PACK_FORMAT}); re-run packed_dataset.py")
+        self.root = root
+        self.transform = transform
+        self.sizes = index["sizes"]
+        self.classes = index["classes"]
+        self.class_to_idx = index["class_to_idx"]
+        self.targets = np.load(os.path.join(root, LABELS_FILE)).tolist()
+        self._files = [os.path.join(root, s["file"]) for s in index["shards"]]
+        self._offsets = np.cumsum([0] + [s["count"] for s in index["shards"]]).tolist()
+        self._shards = None
+
+    def __getstate__(self):
+        # Worker spawn (Windows / macOS) mở lại mmap, không pickle dữ liệu ảnh
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def _open(self):
+        # mmap_mode="c" (copy-on-write): đọc không copy, mảng ghi được nên torch.from_numpy không cảnh báo
+        self._shards = [np.load(f, mmap_mode="c") for f in self._files]
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def __getitem__(self, i):
+        if self._shards is None:
+            self._open()
+        s = bisect.bisect_right(self._offsets, i) - 1
+        h, w = self.sizes[i]
+        img = self._shards[s][i - self._offsets[s], :h, :w]
+        if self.transform is not None:
+            return self.transform(img), self.targets[i]
+        return torch.from_numpy(img).permute(2, 0, 1), self.targets[i]
+
+
+# ---------------------------------------------------------------------- #
+# Transform trên mảng uint8 [H, W, 3]
+# ---------------------------------------------------------------------- #
+class RandomCropFlipRotate:
+    """
+    RandomResizedCrop(size, scale, ratio) → RandomHorizontalFlip(p) → RandomRotation(degrees)
+    gộp thành 1 ma trận affine (ánh xạ điểm ảnh đích → điểm ảnh nguồn) và 1 lần cv2.warpAffine
+    bilinear; vùng ngoài ảnh sau khi xoay tô 0 như RandomRotation.
+    """
+    def __init__(self, size: int, scale=(0.8, 1.0), ratio=(3 / 4, 4 / 3), flip_p: float = 0.5, degrees: float = 10):
+        self.size = size
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.flip_p = flip_p
+        self.degrees = degrees
+
+    def _crop_params(self, h: int, w: int):
+        # Cùng cách lấy mẫu với transforms.RandomResizedCrop.get_params
+        area = h * w
+        for _ in range(10):
+            target = area * random.uniform(*self.scale)
+            aspect = math.exp(random.uniform(*self.log_ratio))
+            cw = int(round(math.sqrt(target * aspect)))
+            ch = int(round(math.sqrt(target / aspect)))
+            if 0 < cw <= w and 0 < ch <= h:
+                return random.randint(0, h - ch), random.randint(0, w - cw), ch, cw
+        side = min(h, w)
+        return (h - side) // 2, (w - side) // 2, side, side
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[:2]
+        i, j, ch, cw = self._crop_params(h, w)
+        s = self.size
+        c = (s - 1) / 2.0
+        # Ảnh đích → ảnh đã crop+resize (kích thước s x s), bước ngược của xoay rồi lật
+        theta = math.radians(random.uniform(-self.degrees, self.degrees))
+        cos, sin = math.cos(theta), math.sin(theta)
+        rotate = np.array([[cos, -sin, c - cos * c + sin * c], [sin, cos, c - sin * c - cos * c], [0, 0, 1]])
+        flip = np.array([[-1, 0, s - 1], [0, 1, 0], [0, 0, 1]]) if random.random() < self.flip_p else np.eye(3)
+        # Ảnh s x s → vùng crop trong ảnh nguồn (căn theo tâm điểm ảnh như resize bilinear)
+        sx, sy = cw / s, ch / s
+        crop = np.array([[sx, 0, j + 0.5 * sx - 0.5], [0, sy, i + 0.5 * sy - 0.5], [0, 0, 1]])
+        m = (crop @ flip @ rotate)[:2]
+        return cv2.warpAffine(
+            img, m, (s, s),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_CONSTANT, borderValue=0,
+        )
+
+
+class ToNormalizedTensor:
+    """uint8 [H, W, 3] → float32 [3, H, W], tương đương ToTensor() + Normalize(mean, std)"""
+    def __init__(self, mean, std):
+        std = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.shift = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1) / std
+
+    def __call__(self, img: np.ndarray) -> torch.Tensor:
+        x = torch.from_numpy(np.ascontiguousarray(img)).permute(2, 0, 1).float()
+        return x.mul_(self.scale).sub_(self.shift)
+
+
+class Compose:
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __call__(self, img):
+        for step in self.steps:
+            img = step(img)
+        return img
+
+
+def packed_transforms():
+    """Transform trên ảnh đóng gói, tương đương train_tfms / val_tfms trong train.py (xem docstring module)"""
+    train_tfms = Compose([
+        RandomCropFlipRotate(IMG_SIZE, scale=(0.8, 1.0), flip_p=0.5, degrees=10),
+        ToNormalizedTensor(NORM_MEAN, NORM_STD),
+    ])
+    val_tfms = ToNormalizedTensor(NORM_MEAN, NORM_STD)
+    return train_tfms, val_tfms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack an ImageFolder dataset into memory-mapped uint8 shards")
+    parser.add_argument("--src", default=DATA_DIR)
+    parser.add_argument("--dst", default=PACKED_DIR)
+    parser.add_argument("--train-size", type=int, default=PACK_TRAIN_SIZE)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--shard-images", type=int, default=SHARD_IMAGES)
+    args = parser.parse_args()
+
+    # train: giữ tỉ lệ gốc (cạnh ngắn = train_size); val: cùng Resize((IMG_SIZE, IMG_SIZE)) với val_tfms
+    splits = {"train": dict(short_side=args.train_size), "val": dict(size=(IMG_SIZE, IMG_SIZE))}
+    for split, kwargs in splits.items():
+        src = os.path.join(args.src, split)
+        if not os.path.isdir(src):
+            print(f"⚠️  Bỏ qua {src} (không tồn tại)")
+            continue
+        index = pack_split(src, os.path.join(args.dst, split), num_workers=args.workers, shard_images=args.shard_images, **kwargs)
+        shapes = sorted({tuple(hw) for hw in index["sizes"]})
+        shape_desc = ", ".join(f"{h}x{w}" for h, w in shapes[:3]) + (" ..." if len(shapes) > 3 else "")
+        print(f"✅ {split}: {index['count']} ảnh ({shape_desc}) → {os.path.join(args.dst, split)}")
+
+
+if __name__ == "__main__":
+    main()
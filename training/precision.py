@@ -0,0 +1,91 @@
+"""
+Precision / layout / compile cho train.py, không phụ thuộc thiết bị.
+
+- autocast: CUDA → float16 (kèm GradScaler), CPU → bfloat16 nếu CPU hỗ trợ
+  (AVX512-BF16 / AMX qua oneDNN) và bật CPU_AMP; không thì chạy fp32.
+  bfloat16 cùng dải số mũ với fp32 nên không cần GradScaler. CPU_AMP mặc định tắt:
+  với EfficientNet (nhiều depthwise conv + SE) bf16 trên CPU có thể chậm hơn fp32,
+  chạy bench_train_step.py trên máy train trước khi bật.
+- channels_last: model và batch ảnh ở layout NHWC (conv oneDNN / cuDNN nhanh hơn).
+- torch.compile: tuỳ chọn, trả về module đã compile dùng chung tham số với model gốc
+  (checkpoint vẫn lưu từ model gốc, không có tiền tố "_orig_mod.").
+- configure_threads: số thread intra-op / inter-op của PyTorch trên CPU.
+"""
+import contextlib
+
+import torch
+
+from config import *
+
+
+def amp_dtype(device: torch.device):
+    """dtype autocast thiết bị hỗ trợ, None nếu không có mixed precision"""
+    if device.type == "cuda":
+        return torch.float16
+    if device.type == "cpu" and torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        return torch.bfloat16
+    return None
+
+
+def amp_enabled(device: torch.device) -> bool:
+    """Theo config: USE_AMP, và thêm CPU_AMP với CPU"""
+    if not USE_AMP or amp_dtype(device) is None:
+        return False
+    return device.type != "cpu" or CPU_AMP
+
+
+def autocast(device: torch.device, enabled: bool = None):
+    """enabled=None: theo config (amp_enabled)"""
+    if enabled is None:
+        enabled = amp_enabled(device)
+    dtype = amp_dtype(device)
+    if not enabled or dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device.type, dtype=dtype)
+
+
+def make_scaler(device: torch.device, enabled: bool = None):
+    """GradScaler chỉ cần cho float16 (CUDA)"""
+    if enabled is None:
+        enabled = amp_enabled(device)
+    if enabled and amp_dtype(device) == torch.float16:
+        return torch.amp.GradScaler(device.type)
+    return None
+
+
+def to_device(x: torch.Tensor, device: torch.device, channels_last: bool = CHANNELS_LAST) -> torch.Tensor:
+    if channels_last and x.dim() == 4:
+        return x.to(device, non_blocking=True, memory_format=torch.channels_last)
+    return x.to(device, non_blocking=True)
+
+
+def prepare_model(model, channels_last: bool = CHANNELS_LAST, compile: bool = COMPILE):
+    """
+    Đổi layout model (tại chỗ) và compile nếu bật.
+    Trả về module dùng để forward; lưu checkpoint vẫn dùng model gốc.
+    """
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    if compile:
+        return torch.compile(model)
+    return model
+
+
+def configure_threads(num_threads: int = NUM_THREADS, interop_threads: int = NUM_INTEROP_THREADS):
+    """0: giữ mặc định của PyTorch; set_num_interop_threads chỉ gọi được trước khi chạy song song"""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            pass
+
+
+def describe(device: torch.device) -> str:
+    dtype = amp_dtype(device) if amp_enabled(device) else None
+    precision = str(dtype).replace("torch.", "") if dtype is not None else "float32"
+    return (
+        f"precision={precision} channels_last={CHANNELS_LAST} compile={COMPILE} "
+        f"threads={torch.get_num_threads()}"
+    )
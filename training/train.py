@@ -14,6 +14,13 @@ from sklearn.metrics import precision_score, recall_score, f1_score
 from models import EfficientNetClassifier
 from early_stop import EarlyStopping
 from checkpoint import save_last_ckpt, load_last_ckpt
+from packed_dataset import PackedImageDataset, is_packed, packed_transforms
+from feature_cache import HeadOnly, build_feature_cache
+from precision import autocast, configure_threads, describe, make_scaler, prepare_model, to_device
+from distributed import (
+    all_reduce_sum, barrier, broadcast_flag, cleanup, gather_lists, get_world_size,
+    init_distributed, is_main, make_sampler, set_epoch, wrap_ddp,
+)
 from config import *
 
 
@@ -28,16 +35,54 @@ def set_seed(seed):
 def freeze_backbone(model):
     for n, p in model.named_parameters():
         p.requires_grad = ("backbone" not in n)
-    print("🧊 Phase = HEAD (freeze backbone)")
+    if is_main():
+        print("🧊 Phase = HEAD (freeze backbone)")
 
 
 def unfreeze_all(model):
     for p in model.parameters():
         p.requires_grad = True
-    print("🔥 Phase = FINETUNE (unfreeze all)")
+    if is_main():
+        print("🔥 Phase = FINETUNE (unfreeze all)")
 
 
-def build_loaders():
+def build_head_optimizer(model, steps_per_epoch):
+    freeze_backbone(model)
+    optimizer = optim.AdamW(
+        filter(lambda p: p.requires_grad, model.parameters()),
+        lr=LR_FROZEN,
+        weight_decay=WEIGHT_DECAY
+    )
+    scheduler = optim.lr_scheduler.OneCycleLR(
+        optimizer,
+        max_lr=LR_FROZEN,
+        total_steps=FREEZE_EPOCHS * steps_per_epoch,
+        pct_start=0.3,
+        anneal_strategy="cos",
+    )
+    return optimizer, scheduler
+
+
+def build_train_model(model, device):
+    """Module forward / backward của phase hiện tại: DDP (nếu chạy phân tán) rồi compile (nếu bật)"""
+    module = wrap_ddp(model, device)
+    return torch.compile(module) if COMPILE else module
+
+
+def build_datasets(packed=None):
+    """
+    packed=None: dùng dataset đã đóng gói ở PACKED_DIR nếu có, ngược lại ImageFolder trên DATA_DIR.
+    """
+    if packed is None:
+        packed = bool(PACKED_DIR) and is_packed(os.path.join(PACKED_DIR, "train")) and is_packed(os.path.join(PACKED_DIR, "val"))
+    if packed:
+        train_tfms, val_tfms = packed_transforms()
+        if is_main():
+            print(f"📦 Dataset đóng gói: {PACKED_DIR}")
+        train_ds = PackedImageDataset(os.path.join(PACKED_DIR, "train"), train_tfms)
+        val_ds = PackedImageDataset(os.path.join(PACKED_DIR, "val"), val_tfms)
+        return train_ds, val_ds
+
     train_tfms = transforms.Compose([
         transforms.RandomResizedCrop(IMG_SIZE, scale=(0.8, 1.0), interpolation=IM.BILINEAR),
         transforms.RandomHorizontalFlip(0.5),
@@ -54,13 +99,21 @@ def build_loaders():
 
     train_ds = datasets.ImageFolder(os.path.join(DATA_DIR, "train"), train_tfms)
     val_ds = datasets.ImageFolder(os.path.join(DATA_DIR, "val"), val_tfms)
+    return train_ds, val_ds
+
+
+def build_loaders():
+    train_ds, val_ds = build_datasets()
 
+    # Chạy phân tán: mỗi rank đọc 1 phần dữ liệu (sampler=None khi 1 process)
+    train_sampler = make_sampler(train_ds, shuffle=True)
+    val_sampler = make_sampler(val_ds, shuffle=False)
     train_loader = DataLoader(
-        train_ds, BATCH_SIZE, shuffle=True,
+        train_ds, BATCH_SIZE, shuffle=train_sampler is None, sampler=train_sampler,
         num_workers=NUM_WORKERS, pin_memory=True
     )
     val_loader = DataLoader(
-        val_ds, BATCH_SIZE, shuffle=False,
+        val_ds, BATCH_SIZE, shuffle=False, sampler=val_sampler,
         num_workers=NUM_WORKERS, pin_memory=True
     )
 
@@ -72,17 +125,16 @@ def build_loaders():
 def train_one_epoch(model, loader, criterion, optimizer, device, scaler, scheduler):
     model.train()
     total_loss, correct, total = 0, 0, 0
-    use_amp = scaler is not None
 
-    for x, y in tqdm(loader, leave=False):
-        x, y = x.to(device), y.to(device)
+    for x, y in tqdm(loader, leave=False, disable=not is_main()):
+        x, y = to_device(x, device), y.to(device)
         optimizer.zero_grad(set_to_none=True)
 
-        with torch.amp.autocast("cuda", enabled=use_amp):
+        with autocast(device):
             logits = model(x)
             loss = criterion(logits, y)
 
-        if use_amp:
+        if scaler is not None:
             scaler.scale(loss).backward()
             scaler.step(optimizer)
             scaler.update()
@@ -96,6 +148,7 @@ def train_one_epoch(model, loader, criterion, optimizer, device, scaler, schedul
         correct += (logits.argmax(1) == y).sum().item()
         total += y.size(0)
 
+    total_loss, correct, total = all_reduce_sum(total_loss, correct, total)
     return total_loss / total, correct / total
 
 
@@ -105,9 +158,9 @@ def evaluate(model, loader, criterion, device):
     total_loss, correct, total = 0, 0, 0
     preds, labels = [], []
 
-    for x, y in tqdm(loader, leave=False):
-        x, y = x.to(device), y.to(device)
-        with torch.amp.autocast("cuda", enabled=(device.type == "cuda")):
+    for x, y in tqdm(loader, leave=False, disable=not is_main()):
+        x, y = to_device(x, device), y.to(device)
+        with autocast(device):
             logits = model(x)
             loss = criterion(logits, y)
 
@@ -119,6 +172,10 @@ def evaluate(model, loader, criterion, device):
         preds.extend(p.cpu().tolist())
         labels.extend(y.cpu().tolist())
 
+    # Chạy phân tán: mỗi rank đánh giá 1 phần val, gom lại để mọi rank có cùng kết quả
+    total_loss, correct, total = all_reduce_sum(total_loss, correct, total)
+    preds, labels = gather_lists(preds), gather_lists(labels)
+
     acc = correct / total
     p = precision_score(labels, preds, average="macro", zero_division=0)
     r = recall_score(labels, preds, average="macro", zero_division=0)
@@ -130,9 +187,22 @@ def evaluate(model, loader, criterion, device):
 # hàm train chính
 def main():
     set_seed(SEED)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    rank, world_size, local_rank = init_distributed()
+    configure_threads()
+    device = torch.device(f"cuda:{local_rank}" if torch.cuda.is_available() else "cpu")
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
 
     train_loader, val_loader, idx_to_class = build_loaders()
+    # Lưu cùng checkpoint để lúc phục vụ dùng đúng transform đã train (không phải copy tay)
+    hparams = {
+        "arch": "efficientnet_b3",
+        "num_classes": len(idx_to_class),
+        "embedding_dim": EMBEDDING_DIM,
+        "img_size": [IMG_SIZE, IMG_SIZE],
+        "norm_mean": list(NORM_MEAN),
+        "norm_std": list(NORM_STD),
+    }
 
     model = EfficientNetClassifier(
         num_classes=len(idx_to_class),
@@ -140,10 +210,15 @@ def main():
         pretrained=PRETRAINED,
         apply_softmax=False
     ).to(device)
+    # Layout đổi trước khi bọc DDP; lưu / nạp checkpoint luôn dùng model gốc
+    prepare_model(model, compile=False)
+    if is_main():
+        print(f"⚙️  {device.type}: {describe(device)} world_size={world_size}")
 
     criterion = nn.CrossEntropyLoss(label_smoothing=0.1)
-    scaler = torch.amp.GradScaler("cuda") if USE_AMP and device.type == "cuda" else None
+    scaler = make_scaler(device)
 
+    # Số bước / epoch của mỗi rank (giảm theo world size)
     steps_per_epoch = len(train_loader)
 
     
@@ -162,43 +237,41 @@ def main():
 
     # resumt train tiếp nếu bị ngắt giữa chừng
     if os.path.exists(LAST_MODEL):
-        print("🔁 Resume from LAST_MODEL")
+        if is_main():
+            print("🔁 Resume from LAST_MODEL")
+        # Phase HEAD: optimizer / scheduler chỉ gồm tham số head, phải dựng đúng trước khi nạp state
+        saved_phase = torch.load(LAST_MODEL, map_location="cpu", weights_only=False, mmap=True).get("training_phase")
+        if saved_phase == "head":
+            optimizer, scheduler = build_head_optimizer(model, steps_per_epoch)
         meta = load_last_ckpt(
             LAST_MODEL,
             model,
             optimizer,
             scheduler,
             scaler,
-            device
+            device,
+            steps_per_epoch,
         )
         start_epoch = meta["start_epoch"]
         training_phase = meta["training_phase"]
         
 
     elif os.path.exists(BEST_MODEL):
-        print("🔥 Load BEST_MODEL (finetune)")
+        if is_main():
+            print("🔥 Load BEST_MODEL (finetune)")
         ckpt = torch.load(BEST_MODEL, map_location=device)
         model.load_state_dict(ckpt["model_state"], strict=True)
         training_phase = "finetune"
 
     else:
-        print("🆕 Train from scratch")
-        freeze_backbone(model)
+        if is_main():
+            print("🆕 Train from scratch")
         training_phase = "head"
-        optimizer = optim.AdamW(
-            filter(lambda p: p.requires_grad, model.parameters()),
-            lr=LR_FROZEN,
-            weight_decay=WEIGHT_DECAY
-        )
-        scheduler = optim.lr_scheduler.OneCycleLR(
-            optimizer,
-            max_lr=LR_FROZEN,
-            total_steps=FREEZE_EPOCHS * steps_per_epoch,
-            pct_start=0.3,
-            anneal_strategy="cos",
-        )
+        optimizer, scheduler = build_head_optimizer(model, steps_per_epoch)
 
-    early_stop = EarlyStopping(BEST_MODEL, patience=8)
+    early_stop = EarlyStopping(BEST_MODEL, patience=8, verbose=is_main())
+    head_loaders = None
+    train_model = None
 
 
     for epoch in range(start_epoch, EPOCHS + 1):
@@ -207,6 +280,7 @@ def main():
         if training_phase == "head" and epoch == FREEZE_EPOCHS + 1:
             unfreeze_all(model)
             training_phase = "finetune"
+            train_model = None
             optimizer = optim.AdamW(model.parameters(), lr=LR_FULL, weight_decay=WEIGHT_DECAY)
             scheduler = optim.lr_scheduler.OneCycleLR(
                 optimizer,
@@ -216,55 +290,68 @@ def main():
                 anneal_strategy="cos",
             )
 
+        # Phase HEAD: backbone đóng băng → train head trên đặc trưng đã cache
+        if training_phase == "head" and FEATURE_CACHE:
+            if head_loaders is None:
+                head = HeadOnly(model)
+                head_loaders = build_feature_cache(model, train_loader.dataset, val_loader.dataset, device)
+                train_model = build_train_model(head, device)
+            epoch_train_loader, epoch_val_loader = head_loaders
+            eval_model = head
+        else:
+            if train_model is None:
+                train_model = build_train_model(model, device)
+            epoch_train_loader, epoch_val_loader = train_loader, val_loader
+            # Đánh giá không cần DDP (không có backward); 1 process thì dùng luôn model đã compile
+            eval_model = model if get_world_size() > 1 else train_model
+
+        set_epoch(epoch_train_loader, epoch)
         train_loss, train_acc = train_one_epoch(
-            model, train_loader, criterion,
+            train_model, epoch_train_loader, criterion,
             optimizer, device, scaler, scheduler
         )
 
-        val_loss, val_acc, p, r, f1 = evaluate(model, val_loader, criterion, device)
+        val_loss, val_acc, p, r, f1 = evaluate(eval_model, epoch_val_loader, criterion, device)
 
-        print(
-            f"[Epoch {epoch}/{EPOCHS}] phase={training_phase} | "
-            f"train_loss={train_loss:.4f} acc={train_acc:.4f} | "
-            f"val_loss={val_loss:.4f} acc={val_acc:.4f} | "
-            f"P={p:.3f} R={r:.3f} F1={f1:.3f} | {time.time()-t0:.1f}s"
-        )
+        # Chỉ rank 0 in log / ghi checkpoint; quyết định dừng sớm gửi cho mọi rank
+        if is_main():
+            print(
+                f"[Epoch {epoch}/{EPOCHS}] phase={training_phase} | "
+                f"train_loss={train_loss:.4f} acc={train_acc:.4f} | "
+                f"val_loss={val_loss:.4f} acc={val_acc:.4f} | "
+                f"P={p:.3f} R={r:.3f} F1={f1:.3f} | {time.time()-t0:.1f}s"
+            )
 
-        early_stop(
-            val_loss,
-            model,
-            extra={
-                "training_phase": training_phase,
-                "idx_to_class": idx_to_class,
-                "hparams": {
-                    "arch": "efficientnet_b3",
-                    "num_classes": len(idx_to_class),
-                    "embedding_dim": EMBEDDING_DIM,
+            early_stop(
+                val_loss,
+                model,
+                extra={
+                    "training_phase": training_phase,
+                    "idx_to_class": idx_to_class,
+                    "hparams": hparams,
                 }
-            }
-        )
+            )
 
-        save_last_ckpt(
-            LAST_MODEL,
-            epoch,
-            model,
-            optimizer,
-            scheduler,
-            scaler,
-            training_phase,
-            idx_to_class,
-            {
-                "arch": "efficientnet_b3",
-                "num_classes": len(idx_to_class),
-                "embedding_dim": EMBEDDING_DIM,
-            }
-        )
+            save_last_ckpt(
+                LAST_MODEL,
+                epoch,
+                model,
+                optimizer,
+                scheduler,
+                scaler,
+                training_phase,
+                idx_to_class,
+                hparams,
+                steps_per_epoch,
+            )
 
-        if early_stop.early_stop:
+        if broadcast_flag(early_stop.early_stop):
             break
 
-    print("✅ Training completed")
-
+    barrier()
+    if is_main():
+        print("✅ Training completed")
+    cleanup()
 
 if __name__ == "__main__":
     main()